@@ -1,12 +1,24 @@
 # admin_routes.py
 
-from flask import Blueprint, render_template, request, redirect, url_for, session, send_from_directory
-import sqlite3, os
-from database import get_db_connection
+from flask import Blueprint, render_template, request, redirect, url_for, session, send_from_directory, Response, stream_with_context
+import sqlite3, os, re, json, time, base64, zipfile
+from werkzeug.utils import safe_join
+from database import get_db_connection, PARTICIPANT_SORT_KEYS
+from event_journal import ensure_json, list_with_json
+from writer_pool import WRITERS
+from write_queue import WRITE_QUEUE
+from camera_format import ensure_export, bin_path_for_export, list_with_exports, RUNS
+from session_summary import get_participant_summaries, get_latest_summaries
+from zip_export import stream_zip, folder_entries, tree_entries, manifest_entry
+import metrics
+import profiler
+import timeline
+import grading
+from storage import USER_DATA_DIR, participant_dir, rel_path
+from file_manifest import participant_files, forget_participant
 import hashlib
-# Removed 're' import as sanitize_name_for_path is no longer needed
 
-ADMIN_DATA_DIR = os.path.join(os.path.dirname(__file__), "user_data")
+PARQUET_DIR = os.path.join(os.path.dirname(__file__), "parquet")   # written by compact.py
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -51,17 +63,110 @@ def admin_login():
 
 
 # ------------ Admin Dashboard ------------
-@admin_bp.route("/admin/dashboard")
-@admin_required
-def admin_dashboard():
+PAGE_SIZE = 50
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+def fts_query(text):
+    """Free text from the search box -> safe FTS5 prefix query ("tok"* AND ...)."""
+    tokens = re.findall(r"\w+", text or "", flags=re.UNICODE)
+    return " ".join(f'"{t}"*' for t in tokens)
+
+def fetch_participants_page(sort="id", direction="asc", search="", after=None, before=None):
+    """
+    One dashboard page via keyset pagination: cost depends on PAGE_SIZE,
+    not on how many participants exist.
+    Returns (rows, next_cursor, prev_cursor).
+    """
+    expr = PARTICIPANT_SORT_KEYS.get(sort, "id")
+    desc = direction == "desc"
+
+    where, params = [], []
+    match = fts_query(search)
+    if match:
+        where.append("id IN (SELECT rowid FROM participants_fts WHERE participants_fts MATCH ?)")
+        params.append(match)
+
+    # Walking backwards (prev page) = flip the order, then flip the rows back
+    cursor = decode_cursor(before) if before else decode_cursor(after) if after else None
+    backwards = bool(before) and cursor is not None
+    ascending = desc == backwards
+    if cursor is not None:
+        # the plain bound on the leading term lets SQLite seek into the index
+        op = ">" if ascending else "<"
+        where.append(f"{expr} {op}= ? AND ({expr}, id) {op} (?, ?)")
+        params.extend([cursor[0], cursor[0], cursor[1]])
+
+    order = "ASC" if ascending else "DESC"
+    sql = f"""
+        SELECT participant_id, name, email, age, mobile, institution, {expr} AS sort_key, id
+        FROM participants
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {expr} {order}, id {order}
+        LIMIT ?
+    """
+    params.append(PAGE_SIZE + 1)
+
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT participant_id, name, email, age, mobile, institution FROM participants")
-    participants = cur.fetchall()
+    cur.execute(sql, params)
+    rows = cur.fetchall()
     conn.close()
-    
-    # In the dashboard, we only need to pass the raw list as the raw name is the folder name.
-    return render_template("admin_dashboard.html", participants=participants)
+
+    has_more = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        if has_more or backwards:
+            next_cursor = encode_cursor(last[6], last[7])
+        if (cursor is not None and not backwards) or (backwards and has_more):
+            prev_cursor = encode_cursor(first[6], first[7])
+
+    return [r[:6] for r in rows], next_cursor, prev_cursor
+
+@admin_bp.route("/admin/dashboard")
+@admin_required
+def admin_dashboard():
+    sort = request.args.get("sort", "id")
+    if sort not in PARTICIPANT_SORT_KEYS:
+        sort = "id"
+    direction = "desc" if request.args.get("dir") == "desc" else "asc"
+    search = request.args.get("q", "").strip()
+
+    participants, next_cursor, prev_cursor = fetch_participants_page(
+        sort=sort,
+        direction=direction,
+        search=search,
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+    )
+
+    # latest session per participant on this page (one indexed query)
+    summaries = get_latest_summaries([p[0] for p in participants])
+
+    return render_template(
+        "admin_dashboard.html",
+        participants=participants,
+        summaries=summaries,
+        sort=sort,
+        direction=direction,
+        search=search,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+    )
 
 
 # ------------ View Participant Info ------------
@@ -95,14 +200,16 @@ def admin_view_participant(pid):
         other_institution
     ) = data
 
-    # Participant folder is EXACTLY the name (no sanitization)
-    participant_folder = os.path.join(ADMIN_DATA_DIR, name)
-    files = os.listdir(participant_folder) if os.path.exists(participant_folder) else []
+    # One indexed query on the file manifest (kept current at write time)
+    stored = {f["name"]: f for f in participant_files(participant_id)}
+    files = list_with_exports(list_with_json(list(stored)))
 
     return render_template(
         "participant_detail.html",
         participant=data,
         files=files,
+        stored=stored,
+        summaries=get_participant_summaries(participant_id),
         pid=pid
     )
 
@@ -122,16 +229,206 @@ def admin_download(pid, filename):
         
     participant_name = row[0]
     
-    # Folder lookup uses the raw participant name, NOT the PID
-    folder = os.path.join(ADMIN_DATA_DIR, participant_name)
+    # Sharded <pid> folder, or the participant's unmigrated name folder (storage.py)
+    folder = participant_dir(pid, participant_name)
     
     # Check if the folder exists before attempting to serve the file
     if not os.path.exists(folder):
         return f"Data folder for {participant_name} not found.", 404
+
+    file_path = safe_join(folder, filename)
+    if file_path:
+        # Appends are visible to every worker as soon as they are written
+        # (writer_pool.py); only the open run of a live change-only log is
+        # still in this worker's memory
+        RUNS.flush(bin_path_for_export(file_path) or file_path)
+
+        # Legacy shapes are rebuilt on demand if stale:
+        #   session_x_camera.csv / .json  <- session_x_camera.bin
+        #   session_x.json                <- session_x.ndjson journal
+        if bin_path_for_export(file_path):
+            ensure_export(file_path)
+        elif filename.endswith(".json"):
+            ensure_json(file_path)
+        if os.path.isfile(file_path):
+            metrics.add_bytes_read("download", os.path.getsize(file_path))
     
     return send_from_directory(folder, filename, as_attachment=True)
 
 
+# ------------ Streaming ZIP Export ------------
+def zip_response(entries, filename, compression=zipfile.ZIP_DEFLATED):
+    """Stream a ZIP built on the fly (chunked, constant memory, no temp file)."""
+    return Response(
+        stream_with_context(stream_zip(entries, compression)),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Accel-Buffering": "no",   # don't let a reverse proxy buffer the whole archive
+        },
+    )
+
+def export_entries(participants, manifest, legacy):
+    """participants: [(participant_id, name)] -> entries for their folders (+ manifest.csv)."""
+    if manifest:
+        yield manifest_entry([pid for pid, _ in participants])
+    seen = set()
+    for pid, name in participants:
+        folder = participant_dir(pid, name)
+        if folder in seen:   # unmigrated participants can share one name folder
+            continue
+        seen.add(folder)
+        yield from folder_entries(folder, rel_path(folder), legacy)
+
+def all_entries(manifest, legacy):
+    if manifest:
+        yield manifest_entry()
+    yield from tree_entries(USER_DATA_DIR, legacy)
+
+def export_participants(pids, manifest, legacy):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT participant_id, name FROM participants WHERE participant_id IN ({','.join('?' * len(pids))}) ORDER BY id",
+        pids,
+    )
+    participants = cur.fetchall()
+    conn.close()
+
+    if not participants:
+        return "Participant not found", 404
+
+    if len(participants) == 1:
+        filename = f"{participants[0][0]}.zip"
+    else:
+        filename = f"participants_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+    return zip_response(export_entries(participants, manifest, legacy), filename)
+
+@admin_bp.route("/admin/export", methods=["GET", "POST"])
+@admin_required
+def admin_export():
+    """
+    ZIP of the selected participants (pid=...&pid=...) or of everything (scope=all).
+    Options: manifest=1 adds manifest.csv from the participants table,
+             legacy=1 adds the derived .json / camera .csv / .json files.
+    """
+    manifest = request.values.get("manifest") == "1"
+    legacy = request.values.get("legacy") == "1"
+
+    if request.values.get("scope") == "all":
+        filename = f"user_data_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+        return zip_response(all_entries(manifest, legacy), filename)
+
+    pids = request.values.getlist("pid")
+    if not pids:
+        return "No participants selected", 400
+    return export_participants(pids, manifest, legacy)
+
+@admin_bp.route("/admin/export/<pid>")
+@admin_required
+def admin_export_participant(pid):
+    return export_participants(
+        [pid],
+        manifest=request.args.get("manifest") == "1",
+        legacy=request.args.get("legacy") == "1",
+    )
+
+
+# ------------ Parquet Datasets (built by compact.py) ------------
+@admin_bp.route("/admin/export/parquet")
+@admin_required
+def admin_export_parquet():
+    """The compacted events / camera / participants datasets as one ZIP (stored, Parquet is already compressed)."""
+    if not os.path.exists(os.path.join(PARQUET_DIR, "_state.json")):
+        return "No Parquet export yet. Run: python compact.py", 404
+
+    entries = (e for e in tree_entries(PARQUET_DIR, prefix="parquet/") if not e[0].endswith("_state.json"))
+    filename = f"parquet_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+    return zip_response(entries, filename, compression=zipfile.ZIP_STORED)
+
+
+# ------------ Ingestion Queue Stats (this worker) ------------
+@admin_bp.route("/admin/ingest_stats")
+@admin_required
+def admin_ingest_stats():
+    """Write-behind queue depth / latency counters and open writer handles of this worker."""
+    return {"pid": os.getpid(), "queue": WRITE_QUEUE.stats(), "open_handles": WRITERS.open_count()}
+
+
+# ------------ Stage / Question Emotion Queries (timeline.py) ------------
+@admin_bp.route("/admin/api/timeline/<session_file>")
+@admin_required
+def admin_session_timeline(session_file):
+    """Stage and question intervals of one session with emotion / AU counts (?label= to filter)."""
+    result = timeline.session_distribution(session_file, request.args.get("label") or None)
+    if result is None:
+        return {"error": "Unknown session"}, 404
+    return result
+
+
+@admin_bp.route("/admin/api/stage_emotions")
+@admin_required
+def admin_stage_emotions():
+    """
+    Cohort distribution during one interval label, e.g.
+    /admin/api/stage_emotions?label=eyes_closed&pid=P1&pid=P2 (all participants without pid).
+    """
+    label = request.args.get("label")
+    if not label:
+        return {"error": "label is required", "stages": timeline.STAGES}, 400
+    return timeline.cohort_distribution(label, request.args.getlist("pid") or None)
+
+# ------------ MCQ Grading / Item Analysis (grading.py) ------------
+@admin_bp.route("/admin/api/mcq_grades")
+@admin_required
+def admin_mcq_grades():
+    """
+    Per-session MCQ scores and per-question difficulty / discrimination / timing.
+    /admin/api/mcq_grades?pid=P1&pid=P2 (all participants without pid).
+    """
+    return grading.grade(request.args.getlist("pid") or None)
+
+
+# ------------ Metrics (Prometheus text format, this worker) ------------
+@admin_bp.route("/admin/metrics")
+@admin_required
+def admin_metrics():
+    """Request latency, SQLite time, user_data I/O, camera fps and session gauges."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# ------------ Request Profiles (profiler.py) ------------
+@admin_bp.route("/admin/profiles")
+@admin_required
+def admin_profiles():
+    profiles = []
+    for name in profiler.list_profiles():
+        try:
+            header = profiler.read_header(name)
+        except OSError:
+            continue   # rotated away meanwhile
+        stamp = name.split("_", 1)[0]
+        profiles.append({
+            "name": name,
+            "time": f"{stamp[0:4]}-{stamp[4:6]}-{stamp[6:8]} {stamp[9:11]}:{stamp[11:13]}:{stamp[13:15]}",
+            "route": header.get("route", ""),
+            "participant_id": header.get("participant_id", ""),
+            "session_file": header.get("session_file", ""),
+            "duration_ms": header.get("duration_ms", ""),
+            "samples": header.get("samples", "").split(" ", 1)[0],
+        })
+    enabled = profiler.SAMPLE_RATE > 0 or profiler.SLOW_MS > 0
+    return render_template("admin_profiles.html", profiles=profiles, enabled=enabled)
+
+
+@admin_bp.route("/admin/profiles/<filename>")
+@admin_required
+def admin_profile_download(filename):
+    if not filename.endswith(profiler.PROFILE_EXT):
+        return "Not a profile", 404
+    return send_from_directory(profiler.PROFILE_DIR, filename, as_attachment=True, mimetype="text/plain")
+
+
 # ------------ Logout ------------
 @admin_bp.route("/admin/logout")
 def admin_logout():
@@ -156,8 +453,8 @@ def admin_delete_participant(pid):
     participant_name = row[0]
     conn.close()
 
-    # Folder path: user_data/<participant_name>
-    folder_path = os.path.join(ADMIN_DATA_DIR, participant_name)
+    # Folder path: user_data/<ab>/<cd>/<pid>, or the unmigrated user_data/<participant_name>
+    folder_path = participant_dir(pid, participant_name)
 
     # --- Delete folder and all session files ---
     if os.path.exists(folder_path):
@@ -174,6 +471,8 @@ def admin_delete_participant(pid):
         except:
             pass
 
+    forget_participant(pid)
+
     # --- Delete participant record from database ---
     conn = get_db_connection()
     cur = conn.cursor()
@@ -1,10 +1,14 @@
 from flask import Flask
-from database import init_db
+from database import init_db, release_db_connection
 from auth_routes import auth_bp
 from experiment_routes import experiment_bp
 from admin_routes import admin_bp
 from camera_routes import camera_bp
-import os
+from assets import assets_bp
+import metrics
+import profiler
+import os, threading
+from file_manifest import backfill_if_empty
 
 app = Flask(__name__)
 app.secret_key = 'SAD_BTP'  # change for production
@@ -15,11 +19,24 @@ os.makedirs(USER_DATA_DIR, exist_ok=True)
 # Initialize database
 init_db()
 
+# First start after upgrading: index the files already under user_data/
+threading.Thread(target=backfill_if_empty, name="manifest-backfill", daemon=True).start()
+
 # Register blueprints   
 app.register_blueprint(admin_bp)  
 app.register_blueprint(auth_bp)
 app.register_blueprint(experiment_bp)
 app.register_blueprint(camera_bp)
+app.register_blueprint(assets_bp)
+
+# Pooled SQLite connections: roll back anything a failed request left open
+app.teardown_appcontext(release_db_connection)
+
+# Request / template timings for /admin/metrics
+metrics.init_app(app)
+
+# Opt-in: PROFILE_SLOW_MS / PROFILE_SAMPLE_RATE (profiles at /admin/profiles)
+profiler.init_app(app)
 
 @app.route('/')
 def home():
@@ -0,0 +1,117 @@
+# assets.py
+
+import os, json, mimetypes, threading
+from flask import Blueprint, abort, request, send_file, url_for
+from werkzeug.utils import safe_join
+
+# Serving side of build_assets.py.
+# Templates reference static files through asset_url('css/output.css') etc.
+# (registered as template globals). With a built manifest this resolves to
+# /assets/<dir>/<stem>.<hash><ext>, served here with a one-year immutable
+# Cache-Control and the precompressed .br / .gz sibling the client accepts.
+# Without a build (development) it falls back to plain /static/<name>.
+
+BASE_DIR = os.path.dirname(__file__)
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+mimetypes.add_type("text/javascript", ".js")   # module scripts need a JS type
+
+assets_bp = Blueprint("assets", __name__)
+
+
+# ---------- Manifest (reloaded when the build rewrites it) ----------
+
+_cache = {"stamp": None, "assets": {}}
+_lock = threading.Lock()
+
+def get_manifest():
+    """{logical name: entry} from static/dist/manifest.json ({} if not built)."""
+    try:
+        st = os.stat(MANIFEST_PATH)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return {}
+    if _cache["stamp"] == stamp:
+        return _cache["assets"]
+
+    with _lock:
+        if _cache["stamp"] != stamp:
+            try:
+                with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+                    _cache["assets"] = json.load(f).get("assets", {})
+            except ValueError:   # half-written by a concurrent build
+                return _cache["assets"]
+            _cache["stamp"] = stamp
+        return _cache["assets"]
+
+
+# ---------- Template helpers ----------
+
+def _dist_url(rel):
+    return url_for("assets.serve_asset", filename=rel)
+
+def asset_url(name):
+    """URL of static/<name>: the hashed build output if there is one, else /static/<name>."""
+    entry = get_manifest().get(name)
+    if entry is None:
+        return url_for("static", filename=name)
+    return _dist_url(entry["file"])
+
+def asset_sources(name):
+    """
+    [(mime type, srcset or url), ...] alternatives for <picture> / <audio>,
+    best first. Empty without a build (or without image variants).
+    """
+    entry = get_manifest().get(name) or {}
+    out = []
+    for source in entry.get("sources", []):
+        if "srcset" in source:
+            out.append((source["type"], ", ".join(f"{_dist_url(f)} {w}w" for f, w in source["srcset"])))
+        else:
+            out.append((source["type"], _dist_url(source["file"])))
+    return out
+
+def asset_map(names):
+    """{name: {"url", "sources"}} for handing asset URLs to JavaScript (window.ASSETS)."""
+    return {name: {"url": asset_url(name), "sources": asset_sources(name)} for name in names}
+
+@assets_bp.app_context_processor
+def inject_asset_helpers():
+    return {"asset_url": asset_url, "asset_sources": asset_sources, "asset_map": asset_map}
+
+
+# ---------- Serving ----------
+
+def accepted_encoding(available):
+    """
+    First of the content-codings `available` (in order of preference) the
+    request's Accept-Encoding allows, None for identity. Goes by the parsed
+    q-value, so "br;q=0" refuses br.
+    """
+    for name in available:
+        if request.accept_encodings[name] > 0:
+            return name
+    return None
+
+@assets_bp.route("/assets/<path:filename>")
+def serve_asset(filename):
+    path = safe_join(DIST_DIR, filename)
+    if not path or not os.path.isfile(path) or filename.endswith((".br", ".gz", ".json")):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = accepted_encoding([name for name, ext in ENCODINGS if os.path.isfile(path + ext)])
+    if encoding:
+        path += dict(ENCODINGS)[encoding]
+
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=31536000)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Cache-Control"] = IMMUTABLE
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
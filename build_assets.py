@@ -0,0 +1,286 @@
+# build_assets.py
+#
+# Build step for static/: content-hashed copies of every asset in static/dist/
+# plus static/dist/manifest.json, which assets.py uses to resolve template /
+# JS references. Run it on deploy (and after editing anything in static/):
+#
+#   python build_assets.py
+#   python build_assets.py --quiet
+#
+# For every file it writes  static/dist/<dir>/<stem>.<hash><ext>  and
+#   - text assets (.js .css .svg .json .html .txt): .gz and .br (brotli if
+#     installed) precompressed siblings, served by Accept-Encoding
+#   - JS modules: relative imports ("./face.js") rewritten to the hashed names
+#   - images (.jpg .jpeg .png), if Pillow is installed: WebP (and AVIF when
+#     Pillow supports it) variants at IMAGE_WIDTHS, never wider than the original
+#   - .wav: a mono, RESAMPLE_RATE Hz copy (NumPy, no external tools), plus an
+#     MP3 if ffmpeg is on the PATH
+# Files of the previous build are kept (pages rendered with the old manifest
+# may still ask for them); anything older is removed.
+
+import os, io, re, sys, json, gzip, wave, shutil, hashlib, argparse, subprocess
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+try:
+    from PIL import Image, features
+except ImportError:  # optional: images are only hashed
+    Image = None
+
+from assets import STATIC_DIR, DIST_DIR, MANIFEST_PATH
+
+EXCLUDE = {"css/input.css", "js/old_experiment.js"}     # tailwind source, unused legacy script
+TEXT_EXTS = {".js", ".css", ".svg", ".json", ".html", ".txt"}
+IMAGE_EXTS = {".jpg", ".jpeg", ".png"}
+IMAGE_WIDTHS = (640, 1280, 1920)
+WEBP_QUALITY = 75
+AVIF_QUALITY = 55
+RESAMPLE_RATE = 22050
+HASH_LEN = 12
+
+IMPORT_RE = re.compile(r"""((?:from|import)\s*\(?\s*["'])(\.{1,2}/[^"']+)(["'])""")
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LEN]
+
+def hashed_name(rel, data, ext=None):
+    stem, orig_ext = os.path.splitext(rel)
+    return f"{stem}.{content_hash(data)}{ext or orig_ext}"
+
+def write_output(rel, data):
+    path = os.path.join(DIST_DIR, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):           # same name = same content
+        with open(path, "wb") as f:
+            f.write(data)
+    return path
+
+
+# ---------- Per-type builders ----------
+
+class Builder:
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self.assets = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def log(self, msg):
+        if not self.quiet:
+            print(msg)
+
+    def sources(self):
+        for dirpath, dirnames, filenames in os.walk(STATIC_DIR):
+            dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != DIST_DIR]
+            for name in sorted(filenames):
+                rel = os.path.relpath(os.path.join(dirpath, name), STATIC_DIR).replace(os.sep, "/")
+                if rel not in EXCLUDE:
+                    yield rel
+
+    def build(self, rel):
+        """Build one asset (and, for JS, the modules it imports first). Returns its manifest entry."""
+        if rel in self.assets:
+            return self.assets[rel]
+        with open(os.path.join(STATIC_DIR, rel), "rb") as f:
+            data = f.read()
+        self.bytes_in += len(data)
+        ext = os.path.splitext(rel)[1].lower()
+
+        if ext == ".js":
+            data = self.rewrite_imports(rel, data)
+        if ext in IMAGE_EXTS:
+            entry = self.build_image(rel, data)
+        elif ext == ".wav":
+            entry = self.build_audio(rel, data)
+        else:
+            entry = self.build_file(rel, data, precompress=ext in TEXT_EXTS)
+
+        self.assets[rel] = entry
+        self.log(f"{rel} -> {entry['file']}")
+        return entry
+
+    def rewrite_imports(self, rel, data):
+        base = os.path.dirname(rel)
+
+        def repl(m):
+            target = os.path.normpath(os.path.join(base, m.group(2))).replace(os.sep, "/")
+            if not os.path.isfile(os.path.join(STATIC_DIR, target)):
+                return m.group(0)
+            hashed = self.build(target)["file"]
+            new = os.path.relpath(hashed, base or ".").replace(os.sep, "/")
+            return m.group(1) + ("./" + new if not new.startswith(".") else new) + m.group(3)
+
+        return IMPORT_RE.sub(repl, data.decode("utf-8")).encode("utf-8")
+
+    def emit(self, rel, data, precompress=False):
+        """Write data under its hashed name (+ .gz / .br). Returns (hashed rel, encodings)."""
+        out = hashed_name(rel, data)
+        write_output(out, data)
+        self.bytes_out += len(data)
+        encodings = []
+        if precompress:
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gz) < len(data):
+                write_output(out + ".gz", gz)
+                encodings.append("gzip")
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data):
+                    write_output(out + ".br", br)
+                    encodings.append("br")
+        return out, encodings
+
+    def build_file(self, rel, data, precompress=False):
+        out, encodings = self.emit(rel, data, precompress)
+        return {"file": out, "encodings": encodings}
+
+    def build_image(self, rel, data):
+        out, _ = self.emit(rel, data)
+        entry = {"file": out, "sources": []}
+        if Image is None:
+            return entry
+
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+        entry["width"], entry["height"] = img.size
+
+        formats = [("image/webp", "WEBP", ".webp", WEBP_QUALITY)]
+        if features.check("avif"):
+            formats.insert(0, ("image/avif", "AVIF", ".avif", AVIF_QUALITY))
+        widths = [w for w in IMAGE_WIDTHS if w < img.width] + [img.width]
+
+        stem = os.path.splitext(rel)[0]
+        for mime, fmt, ext, quality in formats:
+            srcset = []
+            for w in widths:
+                variant = img if w == img.width else img.resize((w, round(img.height * w / img.width)), Image.LANCZOS)
+                buf = io.BytesIO()
+                variant.save(buf, fmt, quality=quality)
+                encoded = buf.getvalue()
+                name = f"{stem}.{w}w.{content_hash(encoded)}{ext}"
+                write_output(name, encoded)
+                self.bytes_out += len(encoded)
+                srcset.append([name, w])
+            entry["sources"].append({"type": mime, "srcset": srcset})
+        return entry
+
+    def build_audio(self, rel, data):
+        """Mono, RESAMPLE_RATE Hz, 16-bit copy of a PCM WAV (+ MP3 when ffmpeg exists)."""
+        try:
+            small = shrink_wav(data)
+        except (wave.Error, ValueError):
+            small = data
+        out, _ = self.emit(rel, small if len(small) < len(data) else data)
+        entry = {"file": out, "sources": []}
+
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg:
+            proc = subprocess.run(
+                [ffmpeg, "-v", "error", "-i", "pipe:0", "-ac", "1", "-b:a", "64k", "-f", "mp3", "pipe:1"],
+                input=data, capture_output=True,
+            )
+            if proc.returncode == 0 and proc.stdout:
+                name = hashed_name(rel, proc.stdout, ".mp3")
+                write_output(name, proc.stdout)
+                self.bytes_out += len(proc.stdout)
+                entry["sources"].append({"type": "audio/mpeg", "file": name})
+        entry["sources"].append({"type": "audio/wav", "file": out})
+        return entry
+
+
+def shrink_wav(data, rate=RESAMPLE_RATE):
+    """16-bit PCM WAV -> mono 16-bit WAV at `rate` (linear interpolation)."""
+    with wave.open(io.BytesIO(data)) as w:
+        channels, width, src_rate, n = w.getnchannels(), w.getsampwidth(), w.getframerate(), w.getnframes()
+        pcm = w.readframes(n)
+    if width != 2:
+        raise ValueError("only 16-bit PCM is resampled")
+
+    samples = np.frombuffer(pcm, dtype="<i2").reshape(-1, channels).astype(np.float32).mean(axis=1)
+    if src_rate > rate:
+        t_out = np.arange(int(len(samples) * rate / src_rate)) * (src_rate / rate)
+        samples = np.interp(t_out, np.arange(len(samples)), samples)
+    else:
+        rate = src_rate
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes(np.clip(np.round(samples), -32768, 32767).astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+# ---------- Manifest + cleanup ----------
+
+def manifest_files(manifest):
+    """Every file (with precompressed siblings) a manifest refers to."""
+    files = set()
+    for entry in manifest.get("assets", {}).values():
+        files.add(entry["file"])
+        files.update(entry["file"] + (".br" if enc == "br" else ".gz") for enc in entry.get("encodings", []))
+        for source in entry.get("sources", []):
+            if "file" in source:
+                files.add(source["file"])
+            files.update(name for name, _ in source.get("srcset", []))
+    return files
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def cleanup(keep):
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(DIST_DIR):
+        for name in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, name), DIST_DIR).replace(os.sep, "/")
+            if rel != os.path.basename(MANIFEST_PATH) and rel not in keep:
+                os.remove(os.path.join(dirpath, name))
+                removed += 1
+    return removed
+
+
+def run(quiet=False):
+    previous = load_manifest()
+    builder = Builder(quiet=quiet)
+    for rel in builder.sources():
+        builder.build(rel)
+
+    manifest = {"assets": builder.assets, "previous": previous.get("assets", {})}
+    os.makedirs(DIST_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+    keep = manifest_files({"assets": builder.assets}) | manifest_files({"assets": manifest["previous"]})
+    removed = cleanup(keep)
+    print(f"{len(builder.assets)} assets, {builder.bytes_in:,} bytes in, "
+          f"{builder.bytes_out:,} bytes written (excl. .gz/.br), {removed} stale files removed"
+          + ("" if Image else "; Pillow not installed, no image variants")
+          + ("" if brotli else "; brotli not installed, gzip only"))
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build content-hashed, precompressed static assets.")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args(argv)
+    run(quiet=args.quiet)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+# camera_format.py
+
+import os, ast, csv, json, time, struct, threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+import metrics
+from writer_pool import WRITERS, atomic_open
+
+# Compact binary camera log: session_<name>_<ts>_camera.bin
+#
+# Fixed-width little-endian records, 11 bytes per frame:
+#   int64  ts       epoch milliseconds (UTC)
+#   uint8  emotion  index into EMOTIONS (255 = unknown label)
+#   uint16 aus      bitmask over AU_NAMES (bit i set = AU_NAMES[i] detected)
+#
+# The file is a plain array of records, so it can be np.memmap'ed and
+# scanned without parsing. The legacy _camera.csv / _camera.json shapes
+# are produced from it on demand (admin download).
+
+# Same labels as getEmotion() in static/camera/analysis.js
+EMOTIONS = ["neutral", "happy", "sad", "angry", "surprise", "fear", "disgust"]
+
+# Same order as AUMap in static/camera/analysis.js -- append only, never reorder
+AU_NAMES = [
+    "Lip Corner Puller (Smile)",
+    "Upper Lip Raiser",
+    "Looking Down",
+    "Brow Inner Raiser",
+    "Brow Outer Raiser",
+    "Blink",
+    "Lip Corner Depressor",
+    "Lip Tightener",
+    "Lip Pressor",
+    "Lid Tightener",
+    "Chin Raiser",
+    "Brow Lowerer",
+    "Cheek Raiser",
+    "Jaw Drop",
+]
+
+UNKNOWN_EMOTION = 255
+
+EMOTION_CODES = {name: i for i, name in enumerate(EMOTIONS)}
+AU_BITS = {name: 1 << i for i, name in enumerate(AU_NAMES)}
+
+RECORD = struct.Struct("<qBH")
+FRAME_DTYPE = np.dtype([("ts", "<i8"), ("emotion", "u1"), ("aus", "<u2")])
+
+# Optional raw blendshape log: session_<name>_<ts>_camera_scores.bin
+# (server-side classification mode, see emotion_model.py)
+#   int64     ts      epoch milliseconds (UTC)
+#   float16x52 scores MediaPipe blendshape scores, emotion_model.BLENDSHAPE_NAMES order
+N_BLENDSHAPES = 52
+SCORES_DTYPE = np.dtype([("ts", "<i8"), ("scores", "<f2", (N_BLENDSHAPES,))])
+
+# Change-only camera log (CAMERA_STORAGE=rle): session_<name>_<ts>_camera.rle
+#
+# One 23-byte record per run of identical (emotion, AUs) frames:
+#   int64  start    epoch ms of the first frame of the run
+#   int64  end      epoch ms of the last frame of the run
+#   uint32 count    frames in the run
+#   uint8  emotion  as above
+#   uint16 aus      as above
+# A run also ends at a gap of more than RLE_MAX_GAP_MS and at every
+# RLE_MAX_RUN_MS boundary, so no run spans a pause and at most one run per
+# log (the open one, kept in memory) is lost if the process dies.
+# expand_runs() gives back the per-frame view: labels and the first / last
+# timestamp of every run are exact, the frames in between get evenly
+# spaced timestamps (the recorder samples at a fixed ~33 ms).
+RLE_DTYPE = np.dtype([("start", "<i8"), ("end", "<i8"), ("count", "<u4"), ("emotion", "u1"), ("aus", "<u2")])
+RLE_MAX_GAP_MS = 250
+RLE_MAX_RUN_MS = 5000
+RLE_IDLE_S = 10.0       # an open run not extended for this long is written out
+
+BIN_SUFFIX = "_camera.bin"
+RLE_SUFFIX = "_camera.rle"
+SCORES_SUFFIX = "_camera_scores.bin"
+CSV_SUFFIX = "_camera.csv"
+JSON_SUFFIX = "_camera.json"
+
+
+# ---------- Encoding ----------
+
+def iso_to_epoch_ms(ts):
+    """'2025-11-14T15:10:12.123Z' (JS toISOString) -> epoch ms."""
+    dt = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return round(dt.timestamp() * 1000)
+
+def epoch_ms_to_iso(ms):
+    """Same format as JS new Date(ms).toISOString(), e.g. 2025-11-14T15:10:12.123Z"""
+    dt = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03d}Z"
+
+def emotion_code(emotion):
+    return EMOTION_CODES.get(emotion, UNKNOWN_EMOTION)
+
+def au_mask(aus):
+    mask = 0
+    for name in aus or []:
+        mask |= AU_BITS.get(name, 0)
+    return mask
+
+def encode_frames(frames):
+    """[(epoch_ms, emotion, [AU names]), ...] -> packed bytes"""
+    return b"".join(
+        RECORD.pack(int(ms), emotion_code(emotion), au_mask(aus))
+        for ms, emotion, aus in frames
+    )
+
+
+def pack_frames(ts, emotions, aus):
+    """Vectorized encode: arrays of epoch ms, emotion codes, AU masks -> packed bytes"""
+    frames = np.empty(len(ts), dtype=FRAME_DTYPE)
+    frames["ts"] = ts
+    frames["emotion"] = emotions
+    frames["aus"] = aus
+    return frames.tobytes()
+
+def pack_scores(ts, scores):
+    """Arrays of epoch ms and (n, 52) blendshape scores -> packed bytes"""
+    records = np.empty(len(ts), dtype=SCORES_DTYPE)
+    records["ts"] = ts
+    records["scores"] = scores
+    return records.tobytes()
+
+def encode_runs(frames):
+    """FRAME_DTYPE array (in time order) -> RLE_DTYPE array of runs."""
+    n = len(frames)
+    if n == 0:
+        return np.zeros(0, dtype=RLE_DTYPE)
+    ts, emo, aus = frames["ts"], frames["emotion"], frames["aus"]
+    gap = np.diff(ts)
+    breaks = ((emo[1:] != emo[:-1]) | (aus[1:] != aus[:-1])
+              | (gap > RLE_MAX_GAP_MS) | (gap < 0)
+              | (ts[1:] // RLE_MAX_RUN_MS != ts[:-1] // RLE_MAX_RUN_MS))
+    starts = np.flatnonzero(np.concatenate(([True], breaks)))
+    ends = np.append(starts[1:], n) - 1
+
+    runs = np.empty(len(starts), dtype=RLE_DTYPE)
+    runs["start"] = ts[starts]
+    runs["end"] = ts[ends]
+    runs["count"] = ends - starts + 1
+    runs["emotion"] = emo[starts]
+    runs["aus"] = aus[starts]
+    return runs
+
+
+class RunLog:
+    """
+    Appends frames to .rle logs through the writer pool. The last run of
+    every log stays open in memory (it may continue with the next batch)
+    and is written when it ends, on flush(), once idle for RLE_IDLE_S (so a
+    worker that stops receiving a session's batches does not hold its last
+    run back) and at shutdown.
+    """
+
+    def __init__(self):
+        self._open = {}    # path -> RLE_DTYPE record of the open run
+        self._touched = {}  # path -> monotonic time of the last append
+        self._lock = threading.Lock()
+
+    def append(self, path, frames):
+        runs = encode_runs(frames)
+        if len(runs) == 0:
+            return
+        with self._lock:
+            cur = self._open.pop(path, None)
+            if cur is not None:
+                first = runs[0]
+                if (cur["emotion"] == first["emotion"] and cur["aus"] == first["aus"]
+                        and 0 <= first["start"] - cur["end"] <= RLE_MAX_GAP_MS
+                        and cur["start"] // RLE_MAX_RUN_MS == first["start"] // RLE_MAX_RUN_MS):
+                    first["start"] = cur["start"]
+                    first["count"] += cur["count"]
+                else:
+                    WRITERS.write_bytes(path, cur.tobytes())
+            if len(runs) > 1:
+                WRITERS.write_bytes(path, runs[:-1].tobytes())
+            self._open[path] = runs[-1].copy()
+            self._touched[path] = time.monotonic()
+
+    def flush(self, path):
+        """Write the open run of path (the next frame starts a new run)."""
+        with self._lock:
+            cur = self._open.pop(path, None)
+            self._touched.pop(path, None)
+            if cur is not None:
+                WRITERS.write_bytes(path, cur.tobytes())
+
+    def has_open_run(self, path):
+        return path in self._open
+
+    def flush_idle(self, max_age=RLE_IDLE_S):
+        now = time.monotonic()
+        with self._lock:
+            for path in [p for p, t in self._touched.items() if now - t > max_age]:
+                del self._touched[path]
+                WRITERS.write_bytes(path, self._open.pop(path).tobytes())
+
+    def close_all(self):
+        with self._lock:
+            for path, cur in self._open.items():
+                WRITERS.write_bytes(path, cur.tobytes())
+            self._open.clear()
+            self._touched.clear()
+
+
+RUNS = RunLog()
+WRITERS.on_flush(RUNS.flush_idle)
+WRITERS.on_close_all(RUNS.close_all)
+
+
+# ---------- Decoding ----------
+
+def read_frames(bin_path):
+    """
+    Zero-copy view of a camera log as a structured array
+    (fields: ts, emotion, aus). A trailing partial record is ignored.
+    A change-only _camera.rle log is expanded to the same shape.
+    """
+    if bin_path.endswith(RLE_SUFFIX):
+        return expand_runs(read_runs(bin_path))
+    size = os.path.getsize(bin_path) if os.path.exists(bin_path) else 0
+    count = size // FRAME_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=FRAME_DTYPE)
+    metrics.add_bytes_read("camera", count * FRAME_DTYPE.itemsize)
+    return np.memmap(bin_path, dtype=FRAME_DTYPE, mode="r", shape=(count,))
+
+def read_runs(rle_path):
+    """Zero-copy view of a change-only log (fields: start, end, count, emotion, aus)."""
+    size = os.path.getsize(rle_path) if os.path.exists(rle_path) else 0
+    count = size // RLE_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=RLE_DTYPE)
+    metrics.add_bytes_read("camera", count * RLE_DTYPE.itemsize)
+    return np.memmap(rle_path, dtype=RLE_DTYPE, mode="r", shape=(count,))
+
+def expand_runs(runs):
+    """RLE_DTYPE runs -> FRAME_DTYPE frames, one per counted frame, in time order."""
+    counts = np.asarray(runs["count"], dtype=np.int64)
+    total = int(counts.sum())
+    frames = np.empty(total, dtype=FRAME_DTYPE)
+    if total == 0:
+        return frames
+
+    run = np.repeat(np.arange(len(runs)), counts)
+    pos = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)   # index within run
+    start = np.asarray(runs["start"], dtype=np.int64)
+    span = np.asarray(runs["end"], dtype=np.int64) - start
+    frames["ts"] = start[run] + span[run] * pos // np.maximum(counts - 1, 1)[run]
+    frames["emotion"] = np.asarray(runs["emotion"])[run]
+    frames["aus"] = np.asarray(runs["aus"])[run]
+
+    # several workers may have written runs of the same log
+    if total > 1 and np.any(np.diff(frames["ts"]) < 0):
+        frames = frames[np.argsort(frames["ts"], kind="stable")]
+    return frames
+
+def read_legacy_csv(csv_path):
+    """
+    Frames of a legacy text _camera.csv (timestamp, emotion, str(AU list)),
+    as recorded before the binary log, in the read_frames() shape.
+    Rows with an unparseable timestamp are skipped.
+    """
+    rows = []
+    with open(csv_path, "r", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                ts = iso_to_epoch_ms(row.get("timestamp"))
+            except (TypeError, ValueError):
+                continue
+            try:
+                aus = ast.literal_eval(row.get("AUs") or "[]")
+            except (ValueError, SyntaxError):
+                aus = []
+            rows.append((ts, emotion_code(row.get("emotion")), au_mask(aus if isinstance(aus, (list, tuple)) else [])))
+        metrics.add_bytes_read("camera", f.tell())
+    return np.array(rows, dtype=FRAME_DTYPE)
+
+def read_scores(scores_path):
+    """Zero-copy view of a raw blendshape log (fields: ts, scores[52])."""
+    size = os.path.getsize(scores_path) if os.path.exists(scores_path) else 0
+    count = size // SCORES_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=SCORES_DTYPE)
+    metrics.add_bytes_read("camera", count * SCORES_DTYPE.itemsize)
+    return np.memmap(scores_path, dtype=SCORES_DTYPE, mode="r", shape=(count,))
+
+def decode_emotion(code):
+    return EMOTIONS[code] if code < len(EMOTIONS) else ""
+
+def decode_aus(mask):
+    return [name for i, name in enumerate(AU_NAMES) if mask & (1 << i)]
+
+def iter_rows(frames):
+    """Structured frames -> legacy (timestamp, emotion, AUs list) tuples."""
+    for ts, emo, aus in zip(frames["ts"].tolist(), frames["emotion"].tolist(), frames["aus"].tolist()):
+        yield epoch_ms_to_iso(ts), decode_emotion(emo), decode_aus(aus)
+
+
+# ---------- On-demand exports ----------
+
+def export_csv(bin_path, csv_path):
+    """Write the legacy _camera.csv shape: timestamp, emotion, str(AU list)."""
+    frames = read_frames(bin_path)
+    with atomic_open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp", "emotion", "AUs"])
+        writer.writerows([ts, emo, str(aus)] for ts, emo, aus in iter_rows(frames))
+        metrics.add_bytes_written("export", f.tell())
+    return csv_path
+
+def export_json(bin_path, json_path):
+    """Write the _camera.json shape: [{timestamp, emotion, AUs}, ...]."""
+    frames = read_frames(bin_path)
+    records = [
+        {"timestamp": ts, "emotion": emo, "AUs": aus}
+        for ts, emo, aus in iter_rows(frames)
+    ]
+    with atomic_open(json_path, "w", encoding="utf-8") as f:
+        json.dump(records, f, indent=4, ensure_ascii=False)
+        metrics.add_bytes_written("export", f.tell())
+    return json_path
+
+def bin_path_for_export(path):
+    """session_x_camera.csv / .json -> session_x_camera.bin, or its .rle (or None)."""
+    for suffix in (CSV_SUFFIX, JSON_SUFFIX):
+        if path.endswith(suffix):
+            stem = path[: -len(suffix)]
+            if not os.path.exists(stem + BIN_SUFFIX) and os.path.exists(stem + RLE_SUFFIX):
+                return stem + RLE_SUFFIX
+            return stem + BIN_SUFFIX
+    return None
+
+def ensure_export(path):
+    """
+    Rebuild session_x_camera.csv / .json from the binary log if it is
+    missing or older than the .bin. Legacy sessions (no .bin) are untouched.
+    """
+    bin_path = bin_path_for_export(path)
+    if not bin_path or not os.path.exists(bin_path):
+        return path
+
+    if bin_path.endswith(RLE_SUFFIX):
+        RUNS.flush(bin_path)
+    WRITERS.flush(bin_path)
+    if (not os.path.exists(path)
+            or os.path.getmtime(path) < os.path.getmtime(bin_path)):
+        if path.endswith(CSV_SUFFIX):
+            export_csv(bin_path, path)
+        else:
+            export_json(bin_path, path)
+    return path
+
+def list_with_exports(files):
+    """Adds the (virtual) _camera.csv / _camera.json next to every _camera.bin / .rle."""
+    names = set(files)
+    for f in files:
+        for suffix in (BIN_SUFFIX, RLE_SUFFIX):
+            if f.endswith(suffix):
+                stem = f[: -len(suffix)]
+                names.add(stem + CSV_SUFFIX)
+                names.add(stem + JSON_SUFFIX)
+    return sorted(names)
@@ -1,48 +1,191 @@
-import os
-import json
-import csv
+import os, json, threading
+import numpy as np
 from flask import Blueprint, request, session
+from writer_pool import WRITERS
+from camera_format import (
+    encode_frames, pack_frames, pack_scores, iso_to_epoch_ms, emotion_code, RUNS,
+    FRAME_DTYPE, BIN_SUFFIX, RLE_SUFFIX, SCORES_SUFFIX, CSV_SUFFIX, JSON_SUFFIX
+)
+from emotion_model import DEFAULT_MODEL, align_scores
+from session_summary import record_frames
+from storage import participant_dir
+from file_manifest import register_files, finalize_files, file_status
+from write_queue import WRITE_QUEUE, DROPPED, REJECTED, busy_response
+import metrics
+
+try:
+    from flask_sock import Sock
+except ImportError:  # optional: HTTP chunk uploads only
+    Sock = None
 
 camera_bp = Blueprint("camera", __name__)
 
-# Fix path to match experiment_routes logic
-BASE_DIR = os.path.dirname(__file__)
-USER_DATA_DIR = os.path.join(BASE_DIR, 'user_data')
+# "labels": the browser classifies frames (analysis.js) and sends emotion + AUs
+# "scores": the browser sends raw blendshape scores, classified here by
+#           emotion_model.py; the raw scores are kept in _camera_scores.bin
+CAMERA_UPLOAD_MODE = os.environ.get("CAMERA_UPLOAD_MODE", "labels")
+
+# "frames": one 11-byte record per frame in _camera.bin
+# "rle":    change-only log, one record per run of identical (emotion, AUs)
+#           frames in _camera.rle (see camera_format.py); exports expand it
+CAMERA_STORAGE = os.environ.get("CAMERA_STORAGE", "frames")
 
 def get_camera_files():
     """Recovers the correct paths based on the active experiment session."""
-    participant_name = session.get("participant_name")
+    participant_id = session.get("participant_id")
     base_filename = session.get("current_base_filename")
 
-    if not participant_name or not base_filename:
-        return None, None
+    if not participant_id or not base_filename:
+        return None, None, None
 
-    # Folder is: user_data/ParticipantName/
-    folder = os.path.join(USER_DATA_DIR, participant_name)
+    # Same folder as the session's events (storage.py)
+    folder = participant_dir(participant_id, session.get("participant_name"))
     
-    # Files will be: session_..._camera.csv
-    csv_path = os.path.join(folder, f"{base_filename}_camera.csv")
-    json_path = os.path.join(folder, f"{base_filename}_camera.json")
+    # Frames are stored in session_..._camera.bin (or .rle, CAMERA_STORAGE);
+    # session_..._camera.csv / .json are exported from it on download.
+    log_suffix = RLE_SUFFIX if CAMERA_STORAGE == "rle" else BIN_SUFFIX
+    bin_path = os.path.join(folder, f"{base_filename}{log_suffix}")
+    csv_path = os.path.join(folder, f"{base_filename}{CSV_SUFFIX}")
+    json_path = os.path.join(folder, f"{base_filename}{JSON_SUFFIX}")
     
-    return csv_path, json_path
+    return bin_path, csv_path, json_path
+
+def get_scores_file(bin_path):
+    """session_..._camera.bin / .rle -> session_..._camera_scores.bin"""
+    suffix = RLE_SUFFIX if bin_path.endswith(RLE_SUFFIX) else BIN_SUFFIX
+    return bin_path[: -len(suffix)] + SCORES_SUFFIX
 
 @camera_bp.route("/start_camera_log", methods=["POST"])
 def start_camera_log():
-    csv_path, json_path = get_camera_files()
+    bin_path, csv_path, json_path = get_camera_files()
     
-    if not csv_path:
+    if not bin_path:
         return {"status": "error", "msg": "Experiment session not started"}, 400
 
-    # Initialize files
-    with open(json_path, "w") as f:
-        json.dump([], f, indent=4)
-
-    with open(csv_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["timestamp", "emotion", "AUs"])
+    # Create the binary log -- queued, so it stays ordered behind frames
+    # of an earlier recording that are still being written
+    scores_mode = CAMERA_UPLOAD_MODE == "scores"
+    if WRITE_QUEUE.submit(reset_camera_log, bin_path, scores_mode,
+                          session.get("participant_id"), session.get("current_base_filename")) == REJECTED:
+        return busy_response()
 
     session["camera_initialized"] = True
-    return {"status": "started"}
+    return {"status": "started", "mode": CAMERA_UPLOAD_MODE}
+
+def append_frames(bin_path, data):
+    """Append packed FRAME_DTYPE records to the camera log (run-length encoded for .rle)."""
+    # Frames that arrive after the log was closed (the browser sends its last
+    # chunk and /end_camera_log at once): store them, then close + finalize
+    # again so the manifest row does not keep a stale size and checksum.
+    # Only checked when this worker has nothing open for the log.
+    late = (not WRITERS.is_open(bin_path) and not RUNS.has_open_run(bin_path)
+            and file_status(bin_path) == "final")
+    if bin_path.endswith(RLE_SUFFIX):
+        RUNS.append(bin_path, np.frombuffer(data, dtype=FRAME_DTYPE))
+    else:
+        WRITERS.write_bytes(bin_path, data)
+    if late:
+        close_camera_log(bin_path)
+
+def write_camera_frames(bin_path, frames):
+    """Append (epoch_ms, emotion, AUs) frames to the binary camera log in one go (pooled handle)."""
+    try:
+        append_frames(bin_path, encode_frames(frames))
+    except Exception as e:
+        print(f"Camera Log Write Error: {e}")
+
+def update_summary(session_file, ts, emotions):
+    """Add a batch of frames to the session_summaries row of the session."""
+    metrics.add_frames(len(ts))
+    try:
+        record_frames(session_file, ts, emotions)
+    except Exception as e:
+        print(f"Session summary error: {e}")
+
+# ---------- Write-behind jobs (run on the write_queue thread) ----------
+
+def reset_camera_log(bin_path, scores_mode, participant_id=None, session_file=None):
+    """
+    Create the binary log (and the raw-score log in scores mode) if missing.
+    Never truncates: another worker may already be appending frames of this
+    session, and a restarted recording simply continues the log.
+    """
+    RUNS.flush(bin_path)
+    paths = [bin_path] + ([get_scores_file(bin_path)] if scores_mode else [])
+    for path in paths:
+        open(path, "ab").close()
+
+    try:
+        register_files(participant_id, session_file, "camera", paths)
+    except Exception as e:
+        print(f"File manifest error: {e}")
+
+def store_frames(bin_path, session_file, frames):
+    write_camera_frames(bin_path, frames)
+    update_summary(session_file, [f[0] for f in frames], [emotion_code(f[1]) for f in frames])
+
+def store_packed(bin_path, session_file, data):
+    """Append already packed FRAME_DTYPE records (WebSocket channel)."""
+    try:
+        append_frames(bin_path, data)
+    except Exception as e:
+        print(f"Camera Log Write Error: {e}")
+    frames = np.frombuffer(data, dtype=FRAME_DTYPE)
+    update_summary(session_file, frames["ts"], frames["emotion"])
+
+def store_scores(bin_path, session_file, ts, S):
+    """Classify a raw-score chunk in one vectorized pass, then store scores + labels."""
+    emotions, aus = DEFAULT_MODEL.classify(S)
+    try:
+        WRITERS.write_bytes(get_scores_file(bin_path), pack_scores(ts, S))
+        append_frames(bin_path, pack_frames(ts, emotions, aus))
+    except Exception as e:
+        print(f"Camera Log Write Error: {e}")
+    update_summary(session_file, ts, emotions)
+
+def close_camera_log(bin_path):
+    """Flush + fsync + release the pooled handles of this camera log."""
+    RUNS.flush(bin_path)
+    WRITERS.close(bin_path)
+    WRITERS.close(get_scores_file(bin_path))
+    try:
+        finalize_files([bin_path, get_scores_file(bin_path)])
+    except Exception as e:
+        print(f"File manifest error: {e}")
+
+def close_session_camera_logs(folder, session_file):
+    """Close the camera log(s) of a session, whichever format it was recorded in (end of session)."""
+    for suffix in (BIN_SUFFIX, RLE_SUFFIX):
+        bin_path = os.path.join(folder, session_file + suffix)
+        if os.path.exists(bin_path):
+            close_camera_log(bin_path)
+
+def queue_response(result, **extra):
+    if result == REJECTED:
+        return busy_response()
+    return {"status": "dropped" if result == DROPPED else "ok", **extra}
+
+def decode_frame_batch(data):
+    """
+    Columnar chunk from recorder.js -> list of (epoch_ms, emotion, AUs) frames.
+    {
+      "t0": 1731597012123,          # epoch ms of the first frame
+      "dt": [0, 33, 34, ...],       # ms since the previous frame (first is 0)
+      "emotion": ["neutral", ...],
+      "AUs": [["Blink"], [], ...]
+    }
+    """
+    t = int(data.get("t0", 0))
+    deltas = data.get("dt") or []
+    emotions = data.get("emotion") or []
+    aus = data.get("AUs") or []
+
+    n = min(len(deltas), len(emotions), len(aus))
+    frames = []
+    for i in range(n):
+        t += int(deltas[i])
+        frames.append((t, emotions[i], aus[i]))
+    return frames
 
 @camera_bp.route("/append_camera_log", methods=["POST"])
 def append_camera_log():
@@ -50,26 +193,174 @@ def append_camera_log():
         return {"status": "ignored"}
 
     data = request.json
-    csv_path, json_path = get_camera_files()
+    bin_path, csv_path, json_path = get_camera_files()
     
-    if not csv_path:
+    if not bin_path:
         return {"status": "error"}, 400
 
-    timestamp = data.get("timestamp")
+    try:
+        timestamp = iso_to_epoch_ms(data.get("timestamp"))
+    except (TypeError, ValueError):
+        return {"status": "error", "msg": "Bad timestamp"}, 400
     emotion = data.get("emotion")
     aus = data.get("AUs") # This is a list ['Dimpler', 'Lip...']
 
-    # Append CSV
+    # Append one record
+    result = WRITE_QUEUE.submit(store_frames, bin_path, session.get("current_base_filename"), [(timestamp, emotion, aus)])
+    return queue_response(result)
+
+@camera_bp.route("/append_camera_log_batch", methods=["POST"])
+def append_camera_log_batch():
+    """One request per chunk of frames (about a second's worth) instead of per frame."""
+    if not session.get("camera_initialized"):
+        return {"status": "ignored"}
+
+    bin_path, csv_path, json_path = get_camera_files()
+    if not bin_path:
+        return {"status": "error"}, 400
+
+    # sendBeacon bodies may arrive without a JSON content type
+    data = request.get_json(force=True, silent=True) or {}
+    frames = decode_frame_batch(data)
+    if not frames:
+        return {"status": "ok", "count": 0}
+
+    result = WRITE_QUEUE.submit(store_frames, bin_path, session.get("current_base_filename"), frames)
+    return queue_response(result, count=len(frames))
+
+def decode_scores_batch(data):
+    """
+    Columnar chunk of raw blendshape scores from recorder.js (mode "scores").
+    {
+      "t0": 1731597012123,
+      "dt": [0, 33, 34, ...],
+      "names": ["_neutral", "browDownLeft", ...],   # column order of "scores"
+      "scores": [[0.01, 0.2, ...], ...]             # one row per frame
+    }
+    Returns (epoch ms array, (n, 52) score matrix in emotion_model order).
+    """
+    deltas = np.asarray(data.get("dt") or [], dtype=np.int64)
+    names = data.get("names") or []
+    scores = data.get("scores") or []
+    if not len(deltas) or not names or not scores:
+        return None, None
+
+    S = align_scores(scores, names)
+    n = min(len(deltas), len(S))
+    ts = int(data.get("t0", 0)) + np.cumsum(deltas[:n])
+    return ts, S[:n]
+
+@camera_bp.route("/append_camera_scores_batch", methods=["POST"])
+def append_camera_scores_batch():
+    """Raw-score chunk: classified here in one vectorized pass, then stored."""
+    if not session.get("camera_initialized"):
+        return {"status": "ignored"}
+
+    bin_path, csv_path, json_path = get_camera_files()
+    if not bin_path:
+        return {"status": "error"}, 400
+
+    data = request.get_json(force=True, silent=True) or {}
     try:
-        with open(csv_path, "a", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, emotion, str(aus)])
-    except Exception as e:
-        print(f"CSV Write Error: {e}")
+        ts, S = decode_scores_batch(data)
+    except ValueError:
+        return {"status": "error", "msg": "Bad score matrix"}, 400
+    if ts is None:
+        return {"status": "ok", "count": 0}
 
-    return {"status": "ok"}
+    result = WRITE_QUEUE.submit(store_scores, bin_path, session.get("current_base_filename"), ts, S)
+    return queue_response(result, count=int(len(ts)))
 
 @camera_bp.route("/end_camera_log", methods=["POST"])
 def end_camera_log():
     session["camera_initialized"] = False
-    return {"status": "ended"}
\ No newline at end of file
+
+    # Flush + fsync + release the pooled handle for this camera log
+    bin_path, csv_path, json_path = get_camera_files()
+    if bin_path:
+        WRITE_QUEUE.submit(close_camera_log, bin_path)   # after this log's queued frames
+
+    return {"status": "ended"}
+
+
+# ---------- WebSocket channel (/camera_ws) ----------
+#
+# One long-lived connection per recording instead of a POST per chunk.
+# The session cookie and file paths are resolved once when the socket
+# opens; after that every frame is one 11-byte binary message (the
+# FRAME_DTYPE record: int64 ts, uint8 emotion code, uint16 AU mask) that is
+# appended to a per-connection buffer and handed to the write queue every
+# WS_FLUSH_FRAMES frames or WS_FLUSH_SECONDS.
+# Text messages:
+#   {"type": "scores", "t0", "dt", "names", "scores"}   raw-score chunk (scores mode)
+#   {"type": "end"}                                     flush, answer {"status": "ended"}
+# Without flask-sock installed the route does not exist and recorder.js
+# keeps using the HTTP chunk endpoints above.
+
+WS_FLUSH_FRAMES = 30
+WS_FLUSH_SECONDS = 1.0
+WS_MAX_BUFFER = 1024 * 1024     # bytes kept while the write queue rejects, then dropped
+
+_open_sockets = 0
+_sockets_lock = threading.Lock()
+
+def _count_socket(delta):
+    global _open_sockets
+    with _sockets_lock:
+        _open_sockets += delta
+
+metrics.register_gauge("camera_sockets", "Open /camera_ws connections.", lambda: _open_sockets)
+
+def camera_stream(ws):
+    bin_path, csv_path, json_path = get_camera_files()
+    session_file = session.get("current_base_filename")
+    if not bin_path or not session.get("camera_initialized"):
+        ws.send(json.dumps({"status": "error", "msg": "Camera log not started"}))
+        return
+    ws.send(json.dumps({"status": "ready", "mode": CAMERA_UPLOAD_MODE}))
+
+    record_size = FRAME_DTYPE.itemsize
+    flush_bytes = WS_FLUSH_FRAMES * record_size
+    buf = bytearray()
+    _count_socket(1)
+
+    def flush():
+        if not buf:
+            return
+        if WRITE_QUEUE.submit(store_packed, bin_path, session_file, bytes(buf)) == REJECTED \
+                and len(buf) < WS_MAX_BUFFER:
+            return   # keep it, retried on the next flush
+        buf.clear()
+
+    try:
+        while True:
+            msg = ws.receive(timeout=WS_FLUSH_SECONDS)
+            if msg is None:                        # idle tick
+                flush()
+            elif isinstance(msg, (bytes, bytearray)):
+                buf += msg[: len(msg) - len(msg) % record_size]
+                if len(buf) >= flush_bytes:
+                    flush()
+            else:
+                try:
+                    data = json.loads(msg)
+                except ValueError:
+                    continue
+                if data.get("type") == "scores":
+                    try:
+                        ts, S = decode_scores_batch(data)
+                    except ValueError:
+                        continue
+                    if ts is not None:
+                        WRITE_QUEUE.submit(store_scores, bin_path, session_file, ts, S)
+                elif data.get("type") == "end":
+                    flush()
+                    WRITE_QUEUE.submit(close_camera_log, bin_path)   # after the frames just flushed
+                    ws.send(json.dumps({"status": "ended"}))
+                    return
+    finally:
+        flush()
+        _count_socket(-1)
+
+if Sock is not None:
+    Sock().route("/camera_ws", bp=camera_bp)(camera_stream)
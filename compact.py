@@ -0,0 +1,338 @@
+# compact.py
+#
+# Nightly compaction of finished sessions into partitioned Parquet datasets,
+# so analyses load a few columnar files instead of thousands of small CSVs.
+#
+#   python compact.py                    # new finished sessions only
+#   python compact.py --rebuild          # drop the datasets and recompact everything
+#   python compact.py --settle-hours 2   # treat sessions idle for 2h as finished
+#
+# Output (default parquet/):
+#   events/session_date=YYYY-MM-DD/part-<run>-<n>.parquet
+#   camera/session_date=YYYY-MM-DD/part-<run>-<n>.parquet
+#   participants.parquet                  (whole participants table, rewritten each run)
+#   _state.json                           (compacted sessions + completed runs)
+# events and camera carry participant_id / session_file, so they join with
+# participants.parquet (and with each other) on participant_id.
+#
+# A session is "finished" once participant_sessions.end_time is set, or when
+# none of its files changed for --settle-hours (abandoned / pre-registry
+# sessions). Each run appends one part file per partition; parts left behind
+# by a run that crashed before recording its state are removed on the next run.
+
+import os, re, ast, sys, json, time, shutil, argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from database import get_db_connection
+from camera_format import (
+    read_frames, EMOTIONS, AU_NAMES, AU_BITS, BIN_SUFFIX, RLE_SUFFIX, SCORES_SUFFIX, CSV_SUFFIX, JSON_SUFFIX
+)
+from event_journal import JOURNAL_EXT, order_events
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USER_DATA_DIR = os.path.join(BASE_DIR, 'user_data')
+PARQUET_DIR = os.path.join(BASE_DIR, 'parquet')
+
+STATE_FILE = "_state.json"
+SETTLE_HOURS = 12
+BATCH_ROWS = 5_000_000        # rows buffered per dataset before a part file is written
+COMPRESSION = "zstd"
+
+PARTICIPANT_COLUMNS = [
+    "participant_id", "name", "email", "age", "mobile", "institution",
+    "batch", "branch", "roll_number", "other_institution",
+]
+
+# "Lip Corner Puller (Smile)" -> "au_lip_corner_puller_smile"
+AU_COLUMNS = ["au_" + re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_") for name in AU_NAMES]
+
+SESSION_TS = re.compile(r"_(\d{4})(\d{2})(\d{2})_\d{6}$")
+
+
+# ---------- Discovery ----------
+
+def session_stem(filename):
+    """session_x.ndjson / .json / .csv / _camera.bin / _camera.csv ... -> session_x (or None)."""
+    if not filename.startswith("session_"):
+        return None
+    for suffix in (SCORES_SUFFIX, BIN_SUFFIX, RLE_SUFFIX, CSV_SUFFIX, JSON_SUFFIX):
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)]
+    if "_camera." in filename:   # reanalyze outputs (_camera.v<version>.bin / .json)
+        return None
+    for suffix in (JOURNAL_EXT, ".json", ".csv"):
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)]
+    return None
+
+def discover(root):
+    """{"<folder>/<stem>": {"folder": ..., "stem": ..., "files": [...]}} for every session on disk."""
+    sessions = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for f in filenames:
+            stem = session_stem(f)
+            if stem is None:
+                continue
+            key = os.path.relpath(os.path.join(dirpath, stem), root).replace(os.sep, "/")
+            entry = sessions.setdefault(key, {"folder": dirpath, "stem": stem, "files": []})
+            entry["files"].append(f)
+    return sessions
+
+def session_date(stem, mtime):
+    m = SESSION_TS.search(stem)
+    if m:
+        return f"{m.group(1)}-{m.group(2)}-{m.group(3)}"
+    return time.strftime("%Y-%m-%d", time.localtime(mtime))
+
+def load_registry():
+    """{session_file: (participant_id, end_time)} from participant_sessions."""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT session_file, participant_id, end_time FROM participant_sessions").fetchall()
+    conn.close()
+    return {r[0]: (r[1], r[2]) for r in rows}
+
+
+# ---------- Loading one session ----------
+
+def _load_event_records(folder, stem, files):
+    """Stored events of one session, from the journal, legacy .json array or .csv."""
+    if stem + JOURNAL_EXT in files:
+        records = []
+        with open(os.path.join(folder, stem + JOURNAL_EXT), "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        pass   # torn last line
+        return order_events(records)
+
+    if stem + ".json" in files:
+        with open(os.path.join(folder, stem + ".json"), "r", encoding="utf-8") as f:
+            try:
+                return json.load(f)
+            except ValueError:
+                return []
+
+    if stem + ".csv" in files:
+        df = pd.read_csv(os.path.join(folder, stem + ".csv"), dtype=str, keep_default_na=False)
+        return df.to_dict("records")
+
+    return []
+
+def load_events(folder, stem, files, participant_id):
+    records = _load_event_records(folder, stem, files)
+    if not records:
+        return None
+
+    fields = [r.get("VariableFields", {}) for r in records]
+    df = pd.DataFrame({
+        "participant_id": [r.get("UserID") or participant_id for r in records],
+        "session_file": stem,
+        "seq": np.arange(len(records), dtype=np.int32),
+        "event_type": [r.get("EventType") for r in records],
+        "time_elapsed": pd.to_numeric(pd.Series([r.get("TimeElapsed") for r in records]), errors="coerce"),
+        "timestamp": pd.to_datetime(pd.Series([r.get("timestamp") for r in records]), errors="coerce", utc=True, format="ISO8601"),
+        "variable_fields": [f if isinstance(f, str) else json.dumps(f, ensure_ascii=False) for f in fields],
+    })
+    return df
+
+def _legacy_camera_frame(folder, stem):
+    """Legacy text _camera.csv (timestamp, emotion, str(AU list)) -> (ts_ms, emotion codes, masks)."""
+    df = pd.read_csv(os.path.join(folder, stem + CSV_SUFFIX), dtype=str, keep_default_na=False)
+    ts = pd.to_datetime(df["timestamp"], errors="coerce", utc=True, format="ISO8601")
+    df, ts = df[ts.notna()], ts[ts.notna()]
+    if df.empty:
+        return None
+    ts_ms = (ts.astype("int64") // 1_000_000).to_numpy()
+    codes = np.array([EMOTIONS.index(e) if e in EMOTIONS else 255 for e in df["emotion"]], dtype=np.uint8)
+    masks = np.zeros(len(df), dtype=np.uint16)
+    for i, raw in enumerate(df["AUs"]):
+        try:
+            masks[i] = sum(AU_BITS.get(a, 0) for a in ast.literal_eval(raw or "[]"))
+        except (ValueError, SyntaxError):
+            pass
+    return ts_ms, codes, masks
+
+def load_camera(folder, stem, files, participant_id):
+    log_name = next((stem + s for s in (BIN_SUFFIX, RLE_SUFFIX) if stem + s in files), None)
+    if log_name:
+        frames = read_frames(os.path.join(folder, log_name))
+        if len(frames) == 0:
+            return None
+        ts_ms, codes, masks = np.array(frames["ts"]), np.array(frames["emotion"]), np.array(frames["aus"])
+    elif stem + CSV_SUFFIX in files:
+        loaded = _legacy_camera_frame(folder, stem)
+        if loaded is None:
+            return None
+        ts_ms, codes, masks = loaded
+    else:
+        return None
+
+    labels = np.array(EMOTIONS + [None] * (256 - len(EMOTIONS)), dtype=object)
+    cols = {
+        "participant_id": participant_id,
+        "session_file": stem,
+        "ts": pd.to_datetime(ts_ms, unit="ms", utc=True),
+        "emotion": pd.Categorical(labels[codes], categories=EMOTIONS),
+        "aus": masks.astype(np.uint16),
+    }
+    for bit, col in enumerate(AU_COLUMNS):
+        cols[col] = (masks >> bit) & 1 == 1
+    return pd.DataFrame(cols)
+
+
+# ---------- Writing ----------
+
+class DatasetWriter:
+    """Buffers DataFrames for one dataset and writes them as hive-partitioned part files."""
+
+    def __init__(self, root, name, run_id):
+        self.path = os.path.join(root, name)
+        self.run_id = run_id
+        self.frames = []
+        self.rows = 0
+        self.parts = 0
+        self.total = 0
+
+    def add(self, df, date):
+        df["session_date"] = date
+        self.frames.append(df)
+        self.rows += len(df)
+        if self.rows >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.frames:
+            return
+        table = pa.Table.from_pandas(pd.concat(self.frames, ignore_index=True), preserve_index=False)
+        pq.write_to_dataset(
+            table, self.path,
+            partition_cols=["session_date"],
+            basename_template=f"part-{self.run_id}-{self.parts}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            compression=COMPRESSION,
+        )
+        self.parts += 1
+        self.total += self.rows
+        self.frames, self.rows = [], 0
+
+def write_participants(out):
+    conn = get_db_connection()
+    df = pd.read_sql_query(f"SELECT {', '.join(PARTICIPANT_COLUMNS)} FROM participants ORDER BY id", conn)
+    conn.close()
+    tmp = os.path.join(out, "participants.parquet.tmp")
+    df.to_parquet(tmp, index=False, compression=COMPRESSION)
+    os.replace(tmp, os.path.join(out, "participants.parquet"))
+    return len(df)
+
+
+# ---------- State ----------
+
+def load_state(out):
+    try:
+        with open(os.path.join(out, STATE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"runs": [], "sessions": {}}
+
+def save_state(out, state):
+    tmp = os.path.join(out, STATE_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, os.path.join(out, STATE_FILE))
+
+def remove_orphan_parts(out, runs):
+    """Delete part files written by runs that never recorded their state."""
+    known = set(runs)
+    removed = 0
+    for dataset in ("events", "camera"):
+        for dirpath, dirnames, filenames in os.walk(os.path.join(out, dataset)):
+            for f in filenames:
+                m = re.match(r"part-([^-]+)-", f)
+                if m and m.group(1) not in known:
+                    os.remove(os.path.join(dirpath, f))
+                    removed += 1
+    return removed
+
+
+# ---------- Driver ----------
+
+def run(root=USER_DATA_DIR, out=PARQUET_DIR, settle_hours=SETTLE_HOURS, rebuild=False, quiet=False):
+    if rebuild and os.path.isdir(out):
+        shutil.rmtree(out)
+    os.makedirs(out, exist_ok=True)
+
+    state = load_state(out)
+    removed = remove_orphan_parts(out, state["runs"])
+    if removed:
+        print(f"Removed {removed} part files from an interrupted run")
+
+    run_id = time.strftime("%Y%m%dT%H%M%S")
+    registry = load_registry()
+    settle_before = time.time() - settle_hours * 3600
+    started = time.monotonic()
+
+    events = DatasetWriter(out, "events", run_id)
+    camera = DatasetWriter(out, "camera", run_id)
+    done, pending = {}, 0
+
+    for key, entry in sorted(discover(root).items()):
+        if key in state["sessions"]:
+            continue
+        folder, stem, files = entry["folder"], entry["stem"], entry["files"]
+        participant_id, end_time = registry.get(stem, (None, None))
+        mtime = max(os.path.getmtime(os.path.join(folder, f)) for f in files)
+        if end_time is None and mtime > settle_before:
+            pending += 1
+            continue
+
+        date = session_date(stem, mtime)
+        ev = load_events(folder, stem, files, participant_id)
+        if ev is not None:
+            participant_id = participant_id or ev["participant_id"].iloc[0]
+            events.add(ev, date)
+        cam = load_camera(folder, stem, files, participant_id)
+        if cam is not None:
+            camera.add(cam, date)
+
+        done[key] = {"run": run_id, "events": 0 if ev is None else len(ev), "frames": 0 if cam is None else len(cam)}
+        if not quiet:
+            print(f"  {key}: {done[key]['events']} events, {done[key]['frames']} frames")
+
+    events.flush()
+    camera.flush()
+    n_participants = write_participants(out)
+
+    # parts are on disk -> record the run (a crash before this point is cleaned up next time)
+    state["runs"].append(run_id)
+    state["sessions"].update(done)
+    save_state(out, state)
+
+    print(f"Compacted {len(done)} sessions ({events.total} events, {camera.total} frames), "
+          f"{pending} still open, {n_participants} participants, "
+          f"in {time.monotonic() - started:.1f}s")
+    return {"sessions": len(done), "events": events.total, "frames": camera.total, "pending": pending}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact finished sessions into partitioned Parquet datasets.")
+    parser.add_argument("--root", default=USER_DATA_DIR, help="user_data directory to scan")
+    parser.add_argument("--out", default=PARQUET_DIR, help="output directory for the datasets")
+    parser.add_argument("--settle-hours", type=float, default=SETTLE_HOURS,
+                        help="sessions without end_time count as finished after this many idle hours")
+    parser.add_argument("--rebuild", action="store_true", help="drop existing datasets and recompact everything")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args(argv)
+
+    run(args.root, args.out, settle_hours=args.settle_hours, rebuild=args.rebuild, quiet=args.quiet)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,34 @@
 import sqlite3
 import os
 import hashlib
+import threading
+import time
+
+import metrics
 
 DB_PATH = 'experiment.db'
 
+# --- Connection tuning ---
+# WAL lets admin reads run while participants are being inserted, and
+# synchronous=NORMAL is durable across app crashes in WAL mode (only an OS
+# crash can lose the last transactions).
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16 * 1024        # page cache per connection
+CACHED_STATEMENTS = 256          # prepared statements kept per connection
+
+# Sortable dashboard columns -> NULL-free sort expression (indexed in init_db)
+PARTICIPANT_SORT_KEYS = {
+    "id": "id",
+    "participant_id": "participant_id",
+    "name": "COALESCE(name, '')",
+    "email": "COALESCE(email, '')",
+    "age": "COALESCE(age, -1)",
+    "institution": "COALESCE(institution, '')",
+}
+
 def init_db():
     conn = sqlite3.connect(DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")   # persistent, stored in the db file
     c = conn.cursor()
 
     # -----------------------------------------------------
@@ -68,12 +91,210 @@ def init_db():
         )
     ''')
 
+    # -----------------------------------------------------
+    # TABLE 4: session_summaries (one row per session, kept up to date
+    # incrementally by the ingestion routes -- see session_summary.py)
+    # -----------------------------------------------------
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            session_file TEXT PRIMARY KEY,
+            participant_id TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            event_count INTEGER NOT NULL DEFAULT 0,
+            first_event_at TEXT,
+            last_event_at TEXT,
+            duration_seconds INTEGER NOT NULL DEFAULT 0,   -- max TimeElapsed seen
+            mcq_answers TEXT NOT NULL DEFAULT '{}',        -- {"<Qn>": "<latest option>"}
+            mcq_answered INTEGER NOT NULL DEFAULT 0,
+            mcq_correct INTEGER NOT NULL DEFAULT 0,
+            camera_frames INTEGER NOT NULL DEFAULT 0,
+            first_frame_ms INTEGER,
+            last_frame_ms INTEGER,
+            emotion_histogram TEXT NOT NULL DEFAULT '{}'   -- {"<emotion>": frames}
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_summaries_participant ON session_summaries(participant_id)")
+
+    # -----------------------------------------------------
+    # TABLE 5: session_files (manifest of the files under user_data/,
+    # maintained at write time -- see file_manifest.py)
+    # -----------------------------------------------------
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS session_files (
+            path TEXT PRIMARY KEY,            -- relative to user_data/: <folder>/<file>
+            participant_id TEXT,
+            session_file TEXT,                -- session_<name>_<ts> stem
+            kind TEXT NOT NULL,               -- 'events' | 'camera'
+            size INTEGER NOT NULL DEFAULT 0,
+            row_count INTEGER,                -- events / frames
+            checksum TEXT,                    -- sha256, set when final
+            status TEXT NOT NULL,             -- 'open' | 'final'
+            updated_at TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_session_files_participant ON session_files(participant_id, path)")
+
+    # -----------------------------------------------------
+    # TABLE 6: mcq_responses (per-session MCQ answers / timings extracted
+    # from the event log, cached for cohort grading -- see grading.py)
+    # -----------------------------------------------------
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS mcq_responses (
+            session_file TEXT PRIMARY KEY,
+            participant_id TEXT,
+            source_size INTEGER NOT NULL,     -- event log the extract was read from
+            source_mtime_ns INTEGER NOT NULL,
+            responses TEXT NOT NULL,          -- {"<Qn>": {"answer", "first_seen", "answered_at", "dwell", "submits"}}
+            updated_at TEXT
+        )
+    ''')
+
+    # -----------------------------------------------------
+    # TABLE 7: participants_fts (full-text search for the admin dashboard)
+    # External-content FTS5 index over participants, kept in sync by triggers
+    # -----------------------------------------------------
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='participants_fts'")
+    fts_is_new = c.fetchone() is None
+
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS participants_fts USING fts5(
+            name, email, institution, branch, roll_number,
+            content='participants', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS participants_fts_ai AFTER INSERT ON participants BEGIN
+            INSERT INTO participants_fts(rowid, name, email, institution, branch, roll_number)
+            VALUES (new.id, new.name, new.email, new.institution, new.branch, new.roll_number);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS participants_fts_ad AFTER DELETE ON participants BEGIN
+            INSERT INTO participants_fts(participants_fts, rowid, name, email, institution, branch, roll_number)
+            VALUES ('delete', old.id, old.name, old.email, old.institution, old.branch, old.roll_number);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS participants_fts_au AFTER UPDATE ON participants BEGIN
+            INSERT INTO participants_fts(participants_fts, rowid, name, email, institution, branch, roll_number)
+            VALUES ('delete', old.id, old.name, old.email, old.institution, old.branch, old.roll_number);
+            INSERT INTO participants_fts(rowid, name, email, institution, branch, roll_number)
+            VALUES (new.id, new.name, new.email, new.institution, new.branch, new.roll_number);
+        END
+    ''')
+    if fts_is_new:
+        # index participants that existed before the FTS table
+        c.execute("INSERT INTO participants_fts(participants_fts) VALUES ('rebuild')")
+
+    # -----------------------------------------------------
+    # Indexes for the lookups the routes actually do
+    # (participants.participant_id is already indexed by UNIQUE)
+    # -----------------------------------------------------
+    c.execute("CREATE INDEX IF NOT EXISTS idx_participants_name ON participants(name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_participant ON participant_sessions(participant_id, session_file)")
+
+    # Keyset pagination on the dashboard: one index per sortable column,
+    # on exactly the expression used in ORDER BY (see PARTICIPANT_SORT_KEYS)
+    for column, expr in PARTICIPANT_SORT_KEYS.items():
+        if column == "id":
+            continue
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_participants_sort_{column} ON participants({expr}, id)")
+
     conn.commit()
     conn.close()
 
 
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports statement / fetch time to metrics.py."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_sql(sql, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            metrics.add_fetch_time(time.perf_counter() - started)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            metrics.add_fetch_time(time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.add_fetch_time(time.perf_counter() - started)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that is reused by its thread.
+    Callers keep doing conn.close() as before; that only rolls back anything
+    left uncommitted and hands the connection back to the pool.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        super().close()
+
+
+_local = threading.local()
+
+def _connect():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        factory=PooledConnection,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+def release_db_connection(exc=None):
+    """
+    Flask teardown hook: make sure a request that failed half-way through
+    never leaves its thread's pooled connection inside an open transaction.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid() and conn.in_transaction:
+        conn.rollback()
+
 def get_db_connection():
-    return sqlite3.connect(DB_PATH)
+    """
+    Per-thread pooled connection (one per worker thread, re-created after
+    fork so gunicorn workers never share a connection with the master).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
 
 
 # Create DB & tables if missing
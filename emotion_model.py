@@ -0,0 +1,163 @@
+# emotion_model.py
+
+import json, hashlib
+
+import numpy as np
+
+from camera_format import EMOTIONS, AU_NAMES
+
+# Server-side version of getEmotion() / getAUs() from static/camera/analysis.js.
+# Works on whole frame matrices (n_frames x 52 blendshape scores) at once, so
+# thresholds / mappings can be changed here and re-applied to stored raw
+# scores without re-running participants.
+
+# MediaPipe Face Landmarker blendshape categories, in model output order
+BLENDSHAPE_NAMES = [
+    "_neutral",
+    "browDownLeft", "browDownRight", "browInnerUp", "browOuterUpLeft", "browOuterUpRight",
+    "cheekPuff", "cheekSquintLeft", "cheekSquintRight",
+    "eyeBlinkLeft", "eyeBlinkRight",
+    "eyeLookDownLeft", "eyeLookDownRight", "eyeLookInLeft", "eyeLookInRight",
+    "eyeLookOutLeft", "eyeLookOutRight", "eyeLookUpLeft", "eyeLookUpRight",
+    "eyeSquintLeft", "eyeSquintRight", "eyeWideLeft", "eyeWideRight",
+    "jawForward", "jawLeft", "jawOpen", "jawRight",
+    "mouthClose", "mouthDimpleLeft", "mouthDimpleRight",
+    "mouthFrownLeft", "mouthFrownRight", "mouthFunnel", "mouthLeft",
+    "mouthLowerDownLeft", "mouthLowerDownRight", "mouthPressLeft", "mouthPressRight",
+    "mouthPucker", "mouthRight", "mouthRollLower", "mouthRollUpper",
+    "mouthShrugLower", "mouthShrugUpper", "mouthSmileLeft", "mouthSmileRight",
+    "mouthStretchLeft", "mouthStretchRight", "mouthUpperUpLeft", "mouthUpperUpRight",
+    "noseSneerLeft", "noseSneerRight",
+]
+BLENDSHAPE_INDEX = {name: i for i, name in enumerate(BLENDSHAPE_NAMES)}
+
+# ---------- Configuration (mirrors analysis.js) ----------
+
+# emotion -> blendshapes averaged for its score (checked in this order)
+EMOTION_MAP = {
+    "happy": ["mouthSmileLeft", "mouthSmileRight"],
+    "sad": ["mouthFrownLeft", "mouthFrownRight", "browInnerUp"],
+    "angry": ["browDownLeft", "browDownRight"],
+    "surprise": ["eyeWideLeft", "eyeWideRight", "jawOpen", "browOuterUpLeft"],
+    "fear": ["browInnerUp", "eyeWideLeft", "eyeWideRight"],
+    "disgust": ["noseSneerLeft", "noseSneerRight", "mouthUpperUpLeft"],
+}
+
+# AU -> blendshapes summed for its score (names must exist in camera_format.AU_NAMES)
+AU_MAP = {
+    "Lip Corner Puller (Smile)": ["mouthSmileLeft", "mouthSmileRight"],
+    "Upper Lip Raiser": ["mouthUpperUpLeft", "mouthUpperUpRight"],
+    "Looking Down": ["eyeLookDownLeft", "eyeLookDownRight"],
+    "Brow Inner Raiser": ["browInnerUp"],
+    "Brow Outer Raiser": ["browOuterUpLeft", "browOuterUpRight"],
+    "Blink": ["eyeBlinkLeft", "eyeBlinkRight"],
+    "Lip Corner Depressor": ["mouthFrownLeft", "mouthFrownRight"],
+    "Lip Tightener": ["mouthPucker"],
+    "Lip Pressor": ["mouthPressLeft", "mouthPressRight"],
+    "Lid Tightener": ["eyeSquintLeft", "eyeSquintRight"],
+    "Chin Raiser": ["mouthShrugLower"],
+    "Brow Lowerer": ["browDownLeft", "browDownRight"],
+    "Cheek Raiser": ["cheekSquintLeft", "cheekSquintRight"],
+    "Jaw Drop": ["jawOpen"],
+}
+
+EMOTION_THRESHOLD = 0.15    # best average below this -> neutral
+HAPPY_OVERRIDE = 0.3        # smile average above this -> happy, regardless of others
+AU_THRESHOLD = 0.2          # summed AU score above this -> AU present
+
+
+class EmotionModel:
+    """
+    Precomputed weight matrices for one mapping configuration.
+      emotion scores = S @ emotion_weights   (averages, n x n_emotions)
+      AU scores      = S @ au_weights        (sums, n x n_AUs)
+    """
+
+    def __init__(self, emotion_map=None, au_map=None, emotion_threshold=None,
+                 happy_override=None, au_threshold=None):
+        self.emotion_map = emotion_map if emotion_map is not None else EMOTION_MAP
+        self.au_map = au_map if au_map is not None else AU_MAP
+        self.emotion_threshold = EMOTION_THRESHOLD if emotion_threshold is None else emotion_threshold
+        self.happy_override = HAPPY_OVERRIDE if happy_override is None else happy_override
+        self.au_threshold = AU_THRESHOLD if au_threshold is None else au_threshold
+
+        n = len(BLENDSHAPE_NAMES)
+
+        self.emotion_names = list(self.emotion_map)
+        self.emotion_codes = np.array([EMOTIONS.index(e) for e in self.emotion_names], dtype=np.uint8)
+        self.emotion_weights = np.zeros((n, len(self.emotion_names)), dtype=np.float32)
+        for j, emo in enumerate(self.emotion_names):
+            keys = self.emotion_map[emo]
+            for k in keys:
+                self.emotion_weights[BLENDSHAPE_INDEX[k], j] += 1.0 / len(keys)
+
+        self.au_names = list(self.au_map)
+        self.au_bits = np.array([1 << AU_NAMES.index(a) for a in self.au_names], dtype=np.uint16)
+        self.au_weights = np.zeros((n, len(self.au_names)), dtype=np.float32)
+        for j, au in enumerate(self.au_names):
+            for k in self.au_map[au]:
+                self.au_weights[BLENDSHAPE_INDEX[k], j] += 1.0
+
+        self.happy_col = self.emotion_names.index("happy") if "happy" in self.emotion_names else None
+        self.version = self._version()
+
+    def _version(self):
+        """Short hash of the mapping config, used to tag derived outputs."""
+        cfg = json.dumps({
+            "emotion_map": self.emotion_map,
+            "au_map": self.au_map,
+            "emotion_threshold": self.emotion_threshold,
+            "happy_override": self.happy_override,
+            "au_threshold": self.au_threshold,
+        }, sort_keys=True)
+        return hashlib.sha1(cfg.encode("utf-8")).hexdigest()[:10]
+
+    def classify(self, scores):
+        """
+        scores: (n_frames, 52) blendshape matrix in BLENDSHAPE_NAMES order.
+        Returns (emotion codes uint8, AU bitmasks uint16), both shape (n_frames,),
+        using the camera_format.EMOTIONS / AU_NAMES encodings.
+        """
+        S = np.asarray(scores, dtype=np.float32)
+        if S.ndim != 2 or S.shape[1] != len(BLENDSHAPE_NAMES):
+            raise ValueError(f"expected (n, {len(BLENDSHAPE_NAMES)}) score matrix, got {S.shape}")
+
+        # --- emotions ---
+        avg = S @ self.emotion_weights
+        best = np.argmax(avg, axis=1)                # first max wins, like the JS loop
+        best_score = avg[np.arange(len(S)), best]
+
+        emotions = self.emotion_codes[best]
+        neutral = (best_score < self.emotion_threshold) | (best_score <= 0)
+        emotions = np.where(neutral, EMOTIONS.index("neutral"), emotions).astype(np.uint8)
+
+        if self.happy_col is not None:
+            happy = avg[:, self.happy_col] > self.happy_override
+            emotions[happy] = EMOTIONS.index("happy")
+
+        # --- AUs ---
+        present = (S @ self.au_weights) > self.au_threshold
+        masks = (present * self.au_bits).sum(axis=1, dtype=np.uint32).astype(np.uint16)
+
+        return emotions, masks
+
+
+def align_scores(scores, names):
+    """
+    Reorder an (n, k) matrix whose columns are `names` into BLENDSHAPE_NAMES
+    order (missing columns are 0, unknown ones are dropped).
+    """
+    S = np.asarray(scores, dtype=np.float32).reshape(-1, len(names))
+    if list(names) == BLENDSHAPE_NAMES:
+        return S
+
+    out = np.zeros((S.shape[0], len(BLENDSHAPE_NAMES)), dtype=np.float32)
+    for j, name in enumerate(names):
+        i = BLENDSHAPE_INDEX.get(name)
+        if i is not None:
+            out[:, i] = S[:, j]
+    return out
+
+
+DEFAULT_MODEL = EmotionModel()
+MAPPING_VERSION = DEFAULT_MODEL.version
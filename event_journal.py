@@ -0,0 +1,144 @@
+# event_journal.py
+
+import os, json
+import metrics
+from writer_pool import WRITERS, atomic_open
+
+# The journal is the canonical event store for a session:
+#   <participant folder>/session_<name>_<ts>.ndjson   (one JSON event per line)
+# The pretty session_<name>_<ts>.json array is only rebuilt from it on
+# demand (download / end of session), never on every event.
+
+JOURNAL_EXT = ".ndjson"
+
+
+def journal_path_for(json_path):
+    """session_x.json -> session_x.ndjson"""
+    return os.path.splitext(json_path)[0] + JOURNAL_EXT
+
+
+def json_path_for(journal_path):
+    """session_x.ndjson -> session_x.json"""
+    return os.path.splitext(journal_path)[0] + ".json"
+
+
+def encode_event(event):
+    """Single NDJSON line (with trailing newline) for one event."""
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+def create_journal(journal_path, first_event):
+    """Start a fresh journal containing only the first (START) event."""
+    WRITERS.close(journal_path)
+    with open(journal_path, "w", encoding="utf-8") as f:
+        f.write(encode_event(first_event))
+
+
+def append_event(journal_path, event):
+    """Append one event with a single write() through the pooled handle."""
+    WRITERS.write(journal_path, encode_event(event))
+
+
+def append_events(journal_path, events):
+    """Append several events, in order, with a single write() through the pooled handle."""
+    if not events:
+        return
+    WRITERS.write(journal_path, "".join(encode_event(ev) for ev in events))
+
+
+def _seq(event):
+    seq = event.get("Seq")
+    return seq if isinstance(seq, int) and not isinstance(seq, bool) else None
+
+
+def order_events(events):
+    """
+    Events in the order the browser logged them. Batches can reach the
+    journal out of order (an unload beacon overtaking a send in flight, a
+    retried batch), so events are sorted by their "Seq" and repeated Seqs
+    dropped. Events without one (the server's START event, older sessions)
+    stay right after the event before them.
+    """
+    seen, keyed, last, in_order = set(), [], -1, True
+    for i, ev in enumerate(events):
+        seq = _seq(ev)
+        if seq is not None:
+            if seq in seen:
+                in_order = False
+                continue
+            seen.add(seq)
+            in_order = in_order and seq > last
+            last = seq
+        keyed.append((last, i, ev))
+    if in_order:
+        return events
+    keyed.sort(key=lambda k: (k[0], k[1]))
+    return [ev for _, _, ev in keyed]
+
+
+def read_events(journal_path):
+    """
+    Read all events back from the journal, in logged order (order_events).
+    A torn last line (e.g. crash mid-write) is skipped instead of failing.
+    """
+    WRITERS.flush(journal_path)
+    events = []
+    if not os.path.exists(journal_path):
+        return events
+
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+        metrics.add_bytes_read("events", f.tell())
+    return order_events(events)
+
+
+def materialize_json(journal_path, json_path=None):
+    """
+    Build the legacy pretty-printed .json array from the journal.
+    Written to a temp file and swapped in, so readers never see half a file.
+    """
+    json_path = json_path or json_path_for(journal_path)
+    events = read_events(journal_path)
+
+    with atomic_open(json_path, "w", encoding="utf-8") as f:
+        json.dump(events, f, indent=4, ensure_ascii=False)
+        metrics.add_bytes_written("export", f.tell())
+    return json_path
+
+
+def ensure_json(json_path):
+    """
+    Make sure session_x.json reflects the journal before it is served.
+    Rebuilds only if the journal is newer than the existing .json
+    (or the .json does not exist yet). Legacy sessions without a
+    journal are left untouched.
+    """
+    journal_path = journal_path_for(json_path)
+    if not os.path.exists(journal_path):
+        return json_path
+
+    WRITERS.flush(journal_path)
+    if (not os.path.exists(json_path)
+            or os.path.getmtime(json_path) < os.path.getmtime(journal_path)):
+        materialize_json(journal_path, json_path)
+    return json_path
+
+
+def list_with_json(files):
+    """
+    Folder listing helper for admin / participant views:
+    adds the (virtual) session_x.json for every journal that has not been
+    materialized yet, so the .json stays downloadable as before.
+    """
+    names = set(files)
+    for f in files:
+        if f.endswith(JOURNAL_EXT):
+            names.add(os.path.splitext(f)[0] + ".json")
+    return sorted(names)
@@ -1,24 +1,49 @@
 # experiment_routes.py
 
 import sqlite3
-from flask import Blueprint, redirect, render_template, request, jsonify, session, send_from_directory, url_for
+from flask import Blueprint, Response, redirect, render_template, request, jsonify, session, send_from_directory, url_for
 from datetime import datetime, timedelta
 import os, csv, json
 import uuid
+import threading
+from collections import OrderedDict
 
+from werkzeug.utils import safe_join
 from database import get_db_connection
+from writer_pool import WRITERS
+from stimuli import get_bundle, get_stimulus
+from session_summary import start_summary, record_events, end_session
+from storage import USER_DATA_DIR, participant_dir, ensure_participant_dir
+from file_manifest import register_files, finalize_files, participant_files
+from write_queue import WRITE_QUEUE, DROPPED, REJECTED, busy_response
+import metrics
+from camera_format import ensure_export, bin_path_for_export, list_with_exports
+from camera_routes import close_session_camera_logs
+from assets import accepted_encoding
+from event_journal import (
+    journal_path_for, create_journal, append_events, materialize_json,
+    ensure_json, list_with_json
+)
 
 experiment_bp = Blueprint('experiment', __name__)
 
-# --- Paths ---
-BASE_DIR = os.path.dirname(__file__)
-USER_DATA_DIR = os.path.join(BASE_DIR, 'user_data')
-DATA_DIR = os.path.join(BASE_DIR, 'data')
-
+# --- Paths (participant folders: see storage.py) ---
 os.makedirs(USER_DATA_DIR, exist_ok=True)
 
-# In-memory: current session files per participant_id
-SESSION_FILES = {}
+# Active sessions are registered in the participant_sessions table and the
+# session file is carried in the signed session cookie, so any gunicorn
+# worker can resolve them. Writes are single O_APPEND appends (writer_pool.py),
+# but each worker has its own write queue: keep a session on one worker (or
+# INGEST_QUEUE_POLICY=sync) when its files must be in send order (README).
+# This is only a per-worker read cache: (participant_id, session_file) -> paths,
+# least recently used first. Entries are dropped when the session ends, when
+# the cache is full, and when the cached files are gone (folder migrated).
+SESSION_CACHE = OrderedDict()
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "4096"))
+_session_cache_lock = threading.Lock()
+
+# Events after which the session is over and the .json array is rebuilt
+END_EVENTS = {"FINISH", "session_ended", "EXIT"}
 
 # --- Time helpers ---
 def get_ist_time_iso():
@@ -49,6 +74,81 @@ def get_or_create_participant_id():
     session["participant_id"] = pid
     return pid
 
+# --- Session registry helpers ---
+def _cache_get(key):
+    with _session_cache_lock:
+        paths = SESSION_CACHE.get(key)
+        if paths is not None:
+            SESSION_CACHE.move_to_end(key)
+        return paths
+
+def _cache_put(key, paths):
+    with _session_cache_lock:
+        SESSION_CACHE[key] = paths
+        SESSION_CACHE.move_to_end(key)
+        while len(SESSION_CACHE) > SESSION_CACHE_SIZE:
+            SESSION_CACHE.popitem(last=False)
+
+def forget_session(participant_id, base_filename):
+    """Drop a session from this worker's cache (session over / files moved)."""
+    with _session_cache_lock:
+        SESSION_CACHE.pop((participant_id, base_filename), None)
+
+def build_session_paths(participant_id, participant_name, base_filename):
+    """Deterministic file paths for one session of one participant."""
+    folder = participant_dir(participant_id, participant_name)
+    json_path = os.path.join(folder, base_filename + ".json")
+    return {
+        "session_file": base_filename,
+        "csv": os.path.join(folder, base_filename + ".csv"),
+        "json": json_path,
+        "journal": journal_path_for(json_path)
+    }
+
+def register_session(participant_id, participant_name, base_filename, start_time):
+    """Persist a newly started session so every worker can find it."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO participant_sessions (participant_id, session_file, start_time)
+        VALUES (?, ?, ?)
+    """, (participant_id, base_filename, start_time))
+    conn.commit()
+    conn.close()
+
+    paths = build_session_paths(participant_id, participant_name, base_filename)
+    _cache_put((participant_id, base_filename), paths)
+    return paths
+
+def lookup_session(participant_id, participant_name, base_filename):
+    """
+    Resolve the active session from the cookie values.
+    Hits the per-worker cache first, then the participant_sessions table.
+    Returns None if this participant never started that session.
+    """
+    key = (participant_id, base_filename)
+    paths = _cache_get(key)
+    if paths and os.path.exists(paths["csv"]):
+        return paths
+    # not cached, or the folder moved (migrate_storage.py): resolve it again
+    forget_session(participant_id, base_filename)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT 1 FROM participant_sessions
+        WHERE participant_id=? AND session_file=?
+    """, (participant_id, base_filename))
+    row = cur.fetchone()
+    conn.close()
+
+    if not row:
+        return None
+
+    paths = build_session_paths(participant_id, participant_name, base_filename)
+    _cache_put(key, paths)
+    return paths
+
 # =========================
 #  PUBLIC EXPERIMENT ROUTES
 # =========================
@@ -75,9 +175,8 @@ def participant_submit():
     session['participant_id'] = participant_id
     session["participant_name"] = name
 
-    # create folder for participant
-    folder = os.path.join(USER_DATA_DIR, name)
-    os.makedirs(folder, exist_ok=True)
+    # create folder for participant (user_data/<ab>/<cd>/<participant_id>, see storage.py)
+    ensure_participant_dir(participant_id)
 
     # store details in DB (your table name may differ)
     conn = get_db_connection()
@@ -107,74 +206,77 @@ def begin_experiment():
     return render_template('index.html', name=name, participant_id=participant_id,show_exit=True)
 
 # ---------- Text / question config ----------
+# All four files are parsed once per worker and cached until they change
+# on disk (see stimuli.py).
 
 @experiment_bp.route('/get_paragraph')
 def get_paragraph():
-    paragraph_path = os.path.join(DATA_DIR, 'paragraph.txt')
-    with open(paragraph_path, 'r', encoding='utf-8') as f:
-        text = f.read().strip()
-    return jsonify({"paragraph": text})
+    return jsonify({"paragraph": get_stimulus("paragraph")})
 
 @experiment_bp.route('/get_questions')
 def get_questions():
-    questions_path = os.path.join(DATA_DIR, 'questions.txt')
-    with open(questions_path, 'r', encoding='utf-8') as f:
-        questions = [line.strip() for line in f if line.strip()]
-    return jsonify({"questions": questions})
+    return jsonify({"questions": get_stimulus("questions")})
 
 @experiment_bp.route('/get_mcq_questions')
 def get_mcq_questions():
-    mcq_path = os.path.join(DATA_DIR, 'mcq_questions.json')
-    if not os.path.exists(mcq_path):
-        return jsonify({"questions": []})
-    with open(mcq_path, 'r', encoding='utf-8') as f:
-        mcqs = json.load(f)
-    return jsonify({"questions": mcqs})
+    return jsonify({"questions": get_stimulus("mcq_questions")})
 
 @experiment_bp.route('/get_feedback_questions')
 def get_feedback_questions():
-    feedback_path = os.path.join(DATA_DIR, 'feedback_questions.txt')
-    if not os.path.exists(feedback_path):
-        return jsonify({"questions": []})
-
-    questions = []
-    with open(feedback_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            if "|" in line:
-                q_text, q_opts = line.split("|", 1)
-                q_text = q_text.strip()
-                q_opts = q_opts.strip()
-                if q_opts == "TEXT":
-                    opts = ["TEXT"]
-                else:
-                    opts = [opt.strip() for opt in q_opts.split(",")]
-                questions.append({"question": q_text, "options": opts})
-    return jsonify({"questions": questions})
-
-
-# ---------- Start session (creates CSV + JSON) ----------
+    return jsonify({"questions": get_stimulus("feedback_questions")})
+
+@experiment_bp.route('/get_experiment_bundle')
+def get_experiment_bundle():
+    """
+    Everything the experiment page needs in one response:
+    { "paragraph": ..., "questions": [...], "mcq_questions": [...], "feedback_questions": [...] }
+    Served precompressed with a strong ETag, so repeat loads are a 304.
+    """
+    bundle = get_bundle()
+
+    # One strong ETag per content-coding
+    encoding = accepted_encoding(["br", "gzip"] if bundle.br_body is not None else ["gzip"])
+    if encoding == "br":
+        body, etag = bundle.br_body, bundle.etag + "-br"
+    elif encoding == "gzip":
+        body, etag = bundle.gzip_body, bundle.etag + "-gz"
+    else:
+        body, etag = bundle.body, bundle.etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"   # cache, but revalidate (cheap 304)
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+# ---------- Start session (creates CSV + event journal) ----------
 
 @experiment_bp.route('/start_session', methods=['POST'])
 def start_session():
     """
     Called from frontend when participant clicks "Start Experiment".
     - Ensures we have a participant_id in session
-    - Creates user_data/<participant_id>/session_<timestamp>.csv / .json
+    - Creates <participant folder>/session_<name>_<timestamp>.csv / .ndjson
     - Writes the first START row / event
+    (session_<timestamp>.json is built from the .ndjson journal on demand)
     """
     participant_id = get_or_create_participant_id()
     participant_name = session.get("participant_name")
     timestamp_tag = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
 
-    participant_folder = os.path.join(USER_DATA_DIR, participant_name)
-    os.makedirs(participant_folder, exist_ok=True)
+    ensure_participant_dir(participant_id, participant_name)
 
     base_filename = f"session_{participant_name}_{timestamp_tag}"
-    csv_path = os.path.join(participant_folder, base_filename + ".csv")
-    json_path = os.path.join(participant_folder, base_filename + ".json")
+    paths = build_session_paths(participant_id, participant_name, base_filename)
+    csv_path = paths["csv"]
+    journal_path = paths["journal"]
 
     # ---------------------------------------------------
     # CRITICAL FIX: Save this to session for camera_routes
@@ -185,12 +287,13 @@ def start_session():
     ist_iso = get_ist_time_iso()
 
     # --- Create CSV file ---
+    WRITERS.close(csv_path)
     with open(csv_path, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
         writer.writerow(['UserID', 'EventType', 'TimeElapsed', 'timestamp', 'VariableFields'])
         writer.writerow([participant_id, 'START', 0, ist_iso, json.dumps({}, ensure_ascii=False)])
 
-    # --- Create JSON file ---
+    # --- Create event journal (NDJSON) ---
     first_event = {
         "UserID": participant_id,
         "EventType": "START",
@@ -198,14 +301,12 @@ def start_session():
         "timestamp": ist_iso,
         "VariableFields": {}
     }
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump([first_event], f, indent=4, ensure_ascii=False)
+    create_journal(journal_path, first_event)
 
-    # store paths in memory
-    SESSION_FILES[participant_name] = {
-        "csv": csv_path,
-        "json": json_path
-    }
+    # register in participant_sessions (shared by all workers)
+    register_session(participant_id, participant_name, base_filename, ist_iso)
+    start_summary(participant_id, base_filename, ist_iso)
+    register_files(participant_id, base_filename, "events", [csv_path, journal_path])
 
     return jsonify({
         "status": "session_started",
@@ -214,7 +315,85 @@ def start_session():
     }), 200
 
 
-# ---------- Log events (append to CSV + JSON) ----------
+# ---------- Log events (append to CSV + journal) ----------
+
+def get_active_session_paths():
+    """
+    Returns (participant_id, paths, error_response).
+    error_response is set when there is no participant / no started session.
+    """
+    participant_name = session.get("participant_name")
+    participant_id = session.get("participant_id")
+    base_filename = session.get("current_base_filename")
+    if not participant_id:
+        return None, None, (jsonify({"error": "No participant in session"}), 400)
+
+    paths = None
+    if participant_name and base_filename:
+        paths = lookup_session(participant_id, participant_name, base_filename)
+
+    if not paths or not os.path.exists(paths["csv"]) or not os.path.exists(paths["journal"]):
+        return None, None, (jsonify({"error": "No active session. Call /start_session first."}), 400)
+
+    return participant_id, paths, None
+
+def parse_event(data):
+    """Normalize one frontend event payload into the stored event dict."""
+    event = {
+        "EventType": data.get("stage"),
+        "TimeElapsed": data.get("time_elapsed", -1),
+        "timestamp": data.get("timestamp", get_ist_time_iso()),
+        "VariableFields": data.get("variable_field", {})
+    }
+    # client sequence number: restores the logged order of batches that
+    # arrived out of order (event_journal.order_events)
+    if isinstance(data.get("seq"), int) and not isinstance(data.get("seq"), bool):
+        event["Seq"] = data["seq"]
+    return event
+
+def write_events(participant_id, paths, events):
+    """
+    Append a list of events (in order) to the session CSV and journal.
+    One write per file regardless of how many events are passed; the files
+    stay open in the writer pool between requests.
+    """
+    rows = []
+    records = []
+    for ev in events:
+        rows.append([
+            participant_id,
+            ev["EventType"],
+            ev["TimeElapsed"],
+            ev["timestamp"],
+            json.dumps(ev["VariableFields"], ensure_ascii=False)
+        ])
+        records.append({"UserID": participant_id, **ev})
+
+    # ---- 1. Append to CSV (pooled handle, one write) ----
+    WRITERS.write_rows(paths["csv"], rows)
+
+    # ---- 2. Append to journal (one write, no re-read) ----
+    append_events(paths["journal"], records)
+
+    # ---- 3. Running totals for the admin views ----
+    try:
+        record_events(paths["session_file"], events)
+    except Exception as e:
+        print(f"Session summary error: {e}")
+
+    # ---- 4. Session over: flush + close handles, build the legacy .json array once ----
+    if any(ev["EventType"] in END_EVENTS for ev in events):
+        WRITERS.close(paths["csv"])
+        WRITERS.close(paths["journal"])
+        materialize_json(paths["journal"], paths["json"])
+        end_session(paths["session_file"], get_ist_time_iso())
+        try:
+            finalize_files([paths["csv"], paths["journal"]])
+        except Exception as e:
+            print(f"File manifest error: {e}")
+        # the browser's /end_camera_log is fire-and-forget (the page navigates away)
+        close_session_camera_logs(os.path.dirname(paths["csv"]), paths["session_file"])
+        forget_session(participant_id, paths["session_file"])
 
 @experiment_bp.route('/log_event', methods=['POST'])
 def log_event():
@@ -227,52 +406,44 @@ def log_event():
       "variable_field": {...}          # dict, will be stored as JSON
     }
     """
-    participant_name = session.get("participant_name")
-    participant_id = session.get("participant_id")
-    paths = SESSION_FILES.get(participant_name)
-    if not participant_id:
-        return jsonify({"error": "No participant in session"}), 400
-
-    if not paths or not os.path.exists(paths["csv"]) or not os.path.exists(paths["json"]):
-        return jsonify({"error": "No active session. Call /start_session first."}), 400
+    participant_id, paths, error = get_active_session_paths()
+    if error:
+        return error
 
     data = request.get_json() or {}
-    event_type   = data.get("stage")
-    timestamp    = data.get("timestamp", get_ist_time_iso())
-    time_elapsed = data.get("time_elapsed", -1)
-    variable_json = data.get("variable_field", {})
+    result = WRITE_QUEUE.submit(write_events, participant_id, paths, [parse_event(data)])
+    if result == REJECTED:
+        return busy_response()
 
-    # ---- 1. Append to CSV ----
-    with open(paths["csv"], "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            participant_id,
-            event_type,
-            time_elapsed,
-            timestamp,
-            json.dumps(variable_json, ensure_ascii=False)
-        ])
+    return jsonify({"status": "dropped" if result == DROPPED else "logged"}), 200
 
-    # ---- 2. Append to JSON ----
-    try:
-        with open(paths["json"], "r", encoding="utf-8") as f:
-            txt = f.read().strip()
-            events = json.loads(txt) if txt else []
-    except Exception:
-        events = []
+@experiment_bp.route('/log_events', methods=['POST'])
+def log_events():
+    """
+    Batched version of /log_event, used by the buffered frontend logger.
+    Frontend sends (also via navigator.sendBeacon on unload):
+    {
+      "events": [ {<same shape as /log_event>}, ... ]   # in the order they happened
+    }
+    """
+    participant_id, paths, error = get_active_session_paths()
+    if error:
+        return error
 
-    events.append({
-        "UserID": participant_id,
-        "EventType": event_type,
-        "TimeElapsed": time_elapsed,
-        "timestamp": timestamp,
-        "VariableFields": variable_json
-    })
+    # sendBeacon bodies may arrive without a JSON content type
+    data = request.get_json(force=True, silent=True) or {}
+    batch = data.get("events", []) if isinstance(data, dict) else data
+    if not isinstance(batch, list):
+        return jsonify({"error": "events must be a list"}), 400
 
-    with open(paths["json"], "w", encoding="utf-8") as f:
-        json.dump(events, f, indent=4, ensure_ascii=False)
+    events = [parse_event(ev) for ev in batch if isinstance(ev, dict)]
+    result = None
+    if events:
+        result = WRITE_QUEUE.submit(write_events, participant_id, paths, events)
+        if result == REJECTED:
+            return busy_response()
 
-    return jsonify({"status": "logged"}), 200
+    return jsonify({"status": "dropped" if result == DROPPED else "logged", "count": len(events)}), 200
 
 
 # ---------- Optional: list / download sessions (later for admin) ----------
@@ -287,11 +458,7 @@ def list_sessions():
     if not participant_id:
         return jsonify([])
 
-    participant_folder = os.path.join(USER_DATA_DIR, participant_id)
-    if not os.path.exists(participant_folder):
-        return jsonify([])
-
-    files = sorted(os.listdir(participant_folder))
+    files = list_with_exports(list_with_json([f["name"] for f in participant_files(participant_id)]))
     return jsonify(files)
 
 @experiment_bp.route('/download_session/<session_file>')
@@ -304,11 +471,16 @@ def download_session(session_file):
     if not participant_id:
         return "No participant in session", 400
 
-    participant_folder = os.path.join(USER_DATA_DIR, participant_id)
-    file_path = os.path.join(participant_folder, session_file)
-    if not os.path.exists(file_path):
+    participant_folder = participant_dir(participant_id, session.get("participant_name"))
+    file_path = safe_join(participant_folder, session_file)
+    if file_path and bin_path_for_export(file_path):
+        ensure_export(file_path)
+    elif file_path and session_file.endswith(".json"):
+        ensure_json(file_path)
+    if not file_path or not os.path.exists(file_path):
         return "File not found", 404
 
+    metrics.add_bytes_read("download", os.path.getsize(file_path))
     return send_from_directory(participant_folder, session_file, as_attachment=True)
 
 
@@ -0,0 +1,301 @@
+# file_manifest.py
+#
+# session_files: one row per stored session file under user_data/
+# (path, participant, session, kind, size, row count, checksum, status).
+# The routes keep it current at write time, so the admin listings are one
+# indexed query instead of os.listdir + stat per page view:
+#   start_session      -> events CSV + journal registered as 'open'
+#   start_camera_log   -> camera log (and raw-score log) registered as 'open'
+#   end of session     -> events files finalized (size, rows, sha256, 'final')
+#   end_camera_log     -> camera files finalized
+# While the table is empty (first start after upgrading) the app fills it
+# from disk in the background. Rebuild it from disk at any time (e.g. after
+# copying data in by hand, or nightly to finalize abandoned sessions):
+#
+#   python file_manifest.py                 # reconcile all of user_data/
+#   python file_manifest.py --no-checksum   # sizes / rows only (fast)
+
+import os, sys, json, time, hashlib, argparse
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: every process may run the first backfill
+    fcntl = None
+
+from database import get_db_connection, DB_PATH
+from event_journal import JOURNAL_EXT
+from storage import USER_DATA_DIR, rel_path, iter_participant_dirs
+from camera_format import FRAME_DTYPE, SCORES_DTYPE, BIN_SUFFIX, RLE_SUFFIX, SCORES_SUFFIX, CSV_SUFFIX, JSON_SUFFIX
+
+MANIFEST_COLUMNS = ["path", "participant_id", "session_file", "kind", "size", "row_count", "checksum", "status", "updated_at"]
+CHUNK_SIZE = 1024 * 1024
+SETTLE_HOURS = 12       # an 'open' file unchanged this long belongs to an abandoned session: finalized
+LOCK_PATH = DB_PATH + ".manifest-lock"   # held by the process running the first backfill
+
+
+# ---------- Classifying files ----------
+
+def classify(filename, names=()):
+    """
+    session file name -> (session stem, kind) or None for anything that is
+    not a primary session file (exports of a .bin / journal, reanalyze outputs, temp files).
+    names: the other files in the folder, to tell legacy CSV / JSON files from exports.
+    """
+    if not filename.startswith("session_") or filename.endswith(".tmp"):
+        return None
+    for suffix in (SCORES_SUFFIX, BIN_SUFFIX, RLE_SUFFIX):
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)], "camera"
+    for suffix in (CSV_SUFFIX, JSON_SUFFIX):
+        if filename.endswith(suffix):
+            stem = filename[: -len(suffix)]
+            if stem + BIN_SUFFIX in names or stem + RLE_SUFFIX in names:
+                return None    # on-demand export of the binary log
+            return stem, "camera"
+    if "_camera." in filename:
+        return None
+    for suffix in (JOURNAL_EXT, ".json", ".csv"):
+        if filename.endswith(suffix):
+            stem = filename[: -len(suffix)]
+            if suffix == ".json" and stem + JOURNAL_EXT in names:
+                return None    # materialized from the journal
+            return stem, "events"
+    return None
+
+
+# ---------- Measuring files ----------
+
+def record_rows(path, size):
+    """Frames of a fixed-size-record log, from its size alone (None for other files)."""
+    if path.endswith(SCORES_SUFFIX):
+        return size // SCORES_DTYPE.itemsize
+    if path.endswith(BIN_SUFFIX):
+        return size // FRAME_DTYPE.itemsize
+    return None
+
+def count_rows(path):
+    """Events in an events file, frames in a camera log (None if unknown)."""
+    size = os.path.getsize(path)
+    if path.endswith((SCORES_SUFFIX, BIN_SUFFIX)):
+        return record_rows(path, size)
+    if path.endswith(RLE_SUFFIX):
+        from camera_format import read_runs
+        return int(read_runs(path)["count"].sum())
+    if path.endswith(".json"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return len(json.load(f))
+        except ValueError:
+            return None
+    lines = 0
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(CHUNK_SIZE)
+            if not block:
+                break
+            lines += block.count(b"\n")
+    return lines - 1 if path.endswith(".csv") and lines else lines   # CSV header
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(CHUNK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+# ---------- Write-time maintenance ----------
+
+def register_files(participant_id, session_file, kind, paths):
+    """New (or truncated) files of a session: status 'open', size as of now."""
+    now = _now()
+    rows = [
+        (rel_path(p), participant_id, session_file, kind, os.path.getsize(p) if os.path.exists(p) else 0, now)
+        for p in paths
+    ]
+    conn = get_db_connection()
+    conn.executemany("""
+        INSERT OR REPLACE INTO session_files (path, participant_id, session_file, kind, size, row_count, checksum, status, updated_at)
+        VALUES (?, ?, ?, ?, ?, NULL, NULL, 'open', ?)
+    """, rows)
+    conn.commit()
+    conn.close()
+
+def finalize_files(paths, checksum=True):
+    """Closed files: record final size, row count and sha256. Unregistered or missing paths are skipped."""
+    now = _now()
+    rows = []
+    for p in paths:
+        if not os.path.exists(p):
+            continue
+        rows.append((os.path.getsize(p), count_rows(p), sha256_file(p) if checksum else None, now, rel_path(p)))
+    if not rows:
+        return
+    conn = get_db_connection()
+    conn.executemany("""
+        UPDATE session_files SET size=?, row_count=?, checksum=?, status='final', updated_at=?
+        WHERE path=?
+    """, rows)
+    conn.commit()
+    conn.close()
+
+def file_status(path):
+    """'open' / 'final' of a registered file, None if it is not in the manifest."""
+    conn = get_db_connection()
+    row = conn.execute("SELECT status FROM session_files WHERE path=?", (rel_path(path),)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def forget_participant(participant_id):
+    conn = get_db_connection()
+    conn.execute("DELETE FROM session_files WHERE participant_id=?", (participant_id,))
+    conn.commit()
+    conn.close()
+
+
+# ---------- Listing ----------
+
+def _settled(mtime):
+    return mtime < time.time() - SETTLE_HOURS * 3600
+
+def _participant_rows(participant_id):
+    conn = get_db_connection()
+    rows = conn.execute(
+        f"SELECT {', '.join(MANIFEST_COLUMNS)} FROM session_files WHERE participant_id=? ORDER BY path",
+        (participant_id,),
+    ).fetchall()
+    conn.close()
+    return [dict(zip(MANIFEST_COLUMNS, row), name=row[0].rsplit("/", 1)[-1]) for row in rows]
+
+def participant_files(participant_id, root=USER_DATA_DIR):
+    """
+    Manifest rows of one participant as dicts, by file name. Files still
+    'open' get their current size from a stat (and frame count where the
+    size gives it) -- never a full read. Open files of abandoned sessions
+    (unchanged for SETTLE_HOURS) are finalized once, here.
+    """
+    files = _participant_rows(participant_id)
+    abandoned = []
+    for f in files:
+        if f["status"] != "open":
+            continue
+        path = os.path.join(root, *f["path"].split("/"))
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if _settled(st.st_mtime):
+            abandoned.append(path)
+        f["size"], f["row_count"] = st.st_size, record_rows(path, st.st_size)
+    if abandoned:
+        finalize_files(abandoned)
+        files = _participant_rows(participant_id)
+    return files
+
+
+# ---------- Reconcile (rebuild from disk) ----------
+
+def reconcile(root=USER_DATA_DIR, checksum=True, quiet=False):
+    """
+    Make session_files match the files on disk: add / refresh every session
+    file found, drop rows whose file is gone. Files of sessions that have not
+    ended (participant_sessions.end_time NULL) stay 'open' unless unchanged
+    for SETTLE_HOURS (abandoned, or recorded before sessions were registered).
+    """
+    conn = get_db_connection()
+    pids = {}
+    for pid, name in conn.execute("SELECT participant_id, name FROM participants"):
+        pids.setdefault(name, []).append(pid)
+    owners = dict(conn.execute("SELECT session_file, participant_id FROM participant_sessions"))
+    ended = {sf for (sf,) in conn.execute("SELECT session_file FROM participant_sessions WHERE end_time IS NOT NULL")}
+    known = {path: (size, status) for path, size, status in conn.execute("SELECT path, size, status FROM session_files")}
+    conn.close()
+
+    now = _now()
+    seen, upserts, unowned = set(), [], []
+    for folder_path, folder_pid, legacy_name in iter_participant_dirs(root):
+        # a flat-layout folder belongs to its name only if no one else has that name
+        named = pids.get(legacy_name, [])
+        folder_owner = folder_pid or (named[0] if len(named) == 1 else None)
+        names = set(os.listdir(folder_path))
+        for name in sorted(names):
+            found = classify(name, names)
+            if found is None:
+                continue
+            stem, kind = found
+            path = os.path.join(folder_path, name)
+            rel = rel_path(path, root)
+            seen.add(rel)
+            st = os.stat(path)
+            status = "final" if stem in ended or _settled(st.st_mtime) else "open"
+            size = st.st_size
+            if known.get(rel) == (size, status):
+                continue    # unchanged since the last write / reconcile
+            owner = folder_pid or owners.get(stem) or folder_owner
+            if owner is None:
+                unowned.append(rel)
+                print(f"{rel}: {len(named)} participants named {legacy_name!r}, none with this session -- owner left empty")
+            upserts.append((
+                rel, owner, stem, kind, size, count_rows(path),
+                sha256_file(path) if checksum and status == "final" else None, status, now,
+            ))
+            if not quiet:
+                print(f"{rel}: {kind}, {size:,} bytes, {status}")
+
+    gone = [p for p in known if p not in seen]
+    conn = get_db_connection()
+    conn.executemany(f"""
+        INSERT OR REPLACE INTO session_files ({', '.join(MANIFEST_COLUMNS)})
+        VALUES ({', '.join('?' * len(MANIFEST_COLUMNS))})
+    """, upserts)
+    conn.executemany("DELETE FROM session_files WHERE path=?", [(p,) for p in gone])
+    conn.commit()
+    conn.close()
+    print(f"{len(seen)} files on disk, {len(upserts)} rows written, {len(gone)} stale rows removed, "
+          f"{len(unowned)} without owner")
+    return {"files": len(seen), "written": len(upserts), "removed": len(gone), "unowned": unowned}
+
+def backfill_if_empty(root=USER_DATA_DIR):
+    """
+    First start after upgrading: index the files already on disk (no
+    checksums). Every worker calls this at startup; a lock file makes one
+    of them do the work and the others skip it.
+    """
+    lock = None
+    try:
+        if fcntl is not None:
+            lock = open(LOCK_PATH, "w")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return   # another worker is backfilling
+        conn = get_db_connection()
+        empty = conn.execute("SELECT 1 FROM session_files LIMIT 1").fetchone() is None
+        conn.close()
+        if empty:
+            reconcile(root, checksum=False, quiet=True)
+    except Exception as e:
+        print(f"File manifest backfill error: {e}")
+    finally:
+        if lock is not None:
+            lock.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the session_files manifest from user_data/.")
+    parser.add_argument("--root", default=USER_DATA_DIR, help="user_data directory to scan")
+    parser.add_argument("--no-checksum", action="store_true", help="skip sha256 of finished files")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args(argv)
+    reconcile(args.root, checksum=not args.no_checksum, quiet=args.quiet)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
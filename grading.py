@@ -0,0 +1,322 @@
+# grading.py
+
+import os, re, sys, json, argparse, warnings
+from datetime import datetime, timezone
+
+import numpy as np
+
+import metrics
+from database import get_db_connection
+from writer_pool import WRITERS
+from event_journal import JOURNAL_EXT, order_events
+from stimuli import get_stimulus
+from timeline import find_sessions, load_session_events, event_fields
+
+# Cohort MCQ grading and item analysis.
+#
+# extract_responses() reduces a session's event stream to one record per
+# MCQ question it saw:
+#   answer        option of the last QSubmit (None if never answered)
+#   first_seen    TimeElapsed (s) of Qfirstseen
+#   answered_at   TimeElapsed (s) of the last QSubmit
+#   dwell         seconds spent on the question over all visits (Qfirstseen /
+#                 QChange open a visit, the next QChange or the end of the MCQ
+#                 section closes it)
+#   submits       number of QSubmit events (answer changes + 1)
+# Extracts are cached per session in the mcq_responses table, keyed by size
+# and mtime of the event log, so only new or changed sessions are re-read.
+#
+# grade() turns the extracts into an (n sessions x n questions) matrix of
+# option indices and scores it against data/mcq_questions.json in one numpy
+# pass. Per item:
+#   difficulty      share of graded sessions answering correctly (p-value)
+#   discrimination  corrected item-total (point-biserial) correlation
+#   upper_lower     p(correct) in the top 27% by rest score minus the bottom 27%
+#   time_to_answer  median s from first seen to final answer; median dwell
+#   options         how often each option was chosen
+# Sessions are found on disk (timeline.find_sessions), so sessions recorded
+# before participant_sessions existed are graded too. Sessions without an
+# event log or that never answered an MCQ are not graded; the report counts
+# them ("found", "no_events", "no_answers").
+#
+#   python grading.py                  # cohort report (JSON) on stdout
+#   python grading.py --pid P1 --pid P2
+
+MCQ_EVENTS = {"Qfirstseen", "QChange", "QSubmit"}
+MCQ_END_EVENTS = {"End", "mcq_timeout", "FINISH", "session_ended", "EXIT"}
+GROUP_SHARE = 0.27          # upper / lower groups for the discrimination index
+NO_ANSWER = -1
+NOT_AN_OPTION = -2          # answered with text that matches no option of the key
+
+# journal lines worth decoding, found in one regex scan of the file (everything else is never parsed)
+_TYPE_RE = re.compile(r'"EventType": "(?:' + "|".join(sorted(MCQ_EVENTS | MCQ_END_EVENTS)) + r')"')
+
+
+# ---------- Events -> per-question responses ----------
+
+def _seconds(ev):
+    try:
+        return float(ev.get("TimeElapsed"))
+    except (TypeError, ValueError):
+        return None
+
+def _qn(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def extract_responses(events):
+    """Stored events (in order) -> {"<Qn>": {answer, first_seen, answered_at, dwell, submits}}."""
+    out = {}
+    current, since, last_t = None, None, None
+
+    def entry(qn):
+        return out.setdefault(str(qn), {"answer": None, "first_seen": None, "answered_at": None, "dwell": 0.0, "submits": 0})
+
+    def leave(t):
+        if current is not None and since is not None and t is not None and t >= since:
+            entry(current)["dwell"] += t - since
+
+    for ev in events:
+        kind = ev.get("EventType")
+        t = _seconds(ev)
+        last_t = t if t is not None else last_t
+        if kind in MCQ_END_EVENTS:
+            leave(t)
+            current = None
+            continue
+        if kind not in MCQ_EVENTS:
+            continue
+        fields = event_fields(ev)
+        qn = _qn(fields.get("Qn"))
+        if qn is None:
+            continue
+
+        if kind == "Qfirstseen":
+            e = entry(qn)
+            if e["first_seen"] is None:
+                seen = fields.get("FirsttimeSeen")
+                e["first_seen"] = float(seen) if isinstance(seen, (int, float)) else t
+            if current != qn:
+                leave(t)
+                current, since = qn, t
+        elif kind == "QChange":
+            to = _qn(fields.get("Qnto"))
+            leave(t)
+            current, since = to, t
+        else:   # QSubmit
+            e = entry(qn)
+            e["answer"] = fields.get("Soption")
+            e["answered_at"] = t
+            e["submits"] += 1
+            if e["first_seen"] is None and isinstance(fields.get("FirsttimeSeen"), (int, float)):
+                e["first_seen"] = float(fields["FirsttimeSeen"])
+
+    leave(last_t)   # section cut short: close at the last event
+    return out
+
+def read_mcq_events(folder, stem):
+    """MCQ-relevant events of a session; journal lines are filtered before decoding."""
+    journal = os.path.join(folder, stem + JOURNAL_EXT)
+    if not os.path.exists(journal):
+        return load_session_events(folder, stem)
+    WRITERS.flush(journal)
+    with open(journal, "r", encoding="utf-8") as f:
+        text = f.read()
+        metrics.add_bytes_read("events", f.tell())
+    events = []
+    for m in _TYPE_RE.finditer(text):
+        start = text.rfind("\n", 0, m.start()) + 1
+        end = text.find("\n", m.end())
+        try:
+            events.append(json.loads(text[start:end if end >= 0 else len(text)]))
+        except ValueError:
+            continue   # torn last line of a live session
+    return order_events(events)
+
+def event_log(folder, stem):
+    """The file extract_responses reads for a session (journal, else legacy .json / .csv)."""
+    for ext in (JOURNAL_EXT, ".json", ".csv"):
+        path = os.path.join(folder, stem + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# ---------- Per-session cache (mcq_responses) ----------
+
+def load_responses(sessions):
+    """
+    sessions: [(participant_id, folder, session_file)] ->
+    ({session_file: (participant_id, responses)}, number re-extracted).
+    Only sessions whose event log is new or changed since it was cached are read.
+    """
+    conn = get_db_connection()
+    cached = {
+        sf: (size, mtime, responses)
+        for sf, size, mtime, responses in conn.execute(
+            "SELECT session_file, source_size, source_mtime_ns, responses FROM mcq_responses")
+    }
+    conn.close()
+
+    out, updates = {}, []
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    for pid, folder, sf in sessions:
+        path = event_log(folder, sf)
+        if path is None:
+            continue
+        WRITERS.flush(path)
+        st = os.stat(path)
+        hit = cached.get(sf)
+        if hit and hit[0] == st.st_size and hit[1] == st.st_mtime_ns:
+            out[sf] = (pid, json.loads(hit[2]))
+            continue
+        responses = extract_responses(read_mcq_events(folder, sf))
+        out[sf] = (pid, responses)
+        updates.append((sf, pid, st.st_size, st.st_mtime_ns, json.dumps(responses, ensure_ascii=False), now))
+
+    if updates:
+        conn = get_db_connection()
+        conn.executemany("""
+            INSERT OR REPLACE INTO mcq_responses (session_file, participant_id, source_size, source_mtime_ns, responses, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, updates)
+        conn.commit()
+        conn.close()
+    return out, len(updates)
+
+
+# ---------- Scoring + item analysis ----------
+
+def answer_key():
+    """(questions, key index per question, options per question) from data/mcq_questions.json."""
+    questions = get_stimulus("mcq_questions")
+    options = [list(q.get("options", [])) for q in questions]
+    key = np.array([
+        opts.index(q.get("answer")) if q.get("answer") in opts else NOT_AN_OPTION
+        for q, opts in zip(questions, options)
+    ], dtype=np.int16)
+    return questions, key, options
+
+def response_matrix(responses, options):
+    """
+    [{"<Qn>": record}] -> (R option index, T time to answer, W dwell, S submits),
+    each (n sessions x n questions); R is NO_ANSWER / T, W NaN where unanswered / unseen.
+    """
+    n, q = len(responses), len(options)
+    R = np.full((n, q), NO_ANSWER, dtype=np.int16)
+    T = np.full((n, q), np.nan)
+    W = np.full((n, q), np.nan)
+    S = np.zeros((n, q), dtype=np.int32)
+    lookup = [{opt: i for i, opt in enumerate(opts)} for opts in options]
+    for i, record in enumerate(responses):
+        for qn, r in record.items():
+            j = int(qn)
+            if not 0 <= j < q:
+                continue
+            W[i, j] = r["dwell"]
+            S[i, j] = r["submits"]
+            if r["answer"] is not None:
+                R[i, j] = lookup[j].get(r["answer"], NOT_AN_OPTION)
+                if r["answered_at"] is not None and r["first_seen"] is not None:
+                    T[i, j] = r["answered_at"] - r["first_seen"]
+    return R, T, W, S
+
+def _nan_stat(fn, a):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)   # all-NaN columns
+        v = fn(a, axis=0)
+    return [None if np.isnan(x) else round(float(x), 3) for x in v]
+
+def item_statistics(R, key, T, W, n_options):
+    """Per-item difficulty, discrimination, timing and option counts (vectorized over items)."""
+    n, q = R.shape
+    correct = ((R == key[None, :]) & (R >= 0)).astype(np.float64)
+    total = correct.sum(axis=1)
+
+    # corrected item-total correlation: item vs. score on the other items
+    rest = total[:, None] - correct
+    xc = correct - correct.mean(axis=0)
+    yc = rest - rest.mean(axis=0)
+    denom = np.sqrt((xc ** 2).sum(axis=0) * (yc ** 2).sum(axis=0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        point_biserial = np.where(denom > 0, (xc * yc).sum(axis=0) / denom, np.nan)
+
+    k = max(1, int(round(GROUP_SHARE * n)))
+    order = np.argsort(total, kind="stable")
+    upper_lower = correct[order[-k:]].mean(axis=0) - correct[order[:k]].mean(axis=0)
+
+    option_counts = (R[:, :, None] == np.arange(n_options)[None, None, :]).sum(axis=0)
+
+    return {
+        "difficulty": correct.mean(axis=0),
+        "answered": (R != NO_ANSWER).sum(axis=0),
+        "point_biserial": point_biserial,
+        "upper_lower": upper_lower,
+        "time_to_answer": _nan_stat(np.nanmedian, T),
+        "dwell": _nan_stat(np.nanmedian, W),
+        "option_counts": option_counts,
+    }, correct
+
+def _round(x):
+    return None if x is None or np.isnan(x) else round(float(x), 3)
+
+def grade(participant_ids=None):
+    """Scores of every session that answered MCQs, plus item statistics for the cohort."""
+    questions, key, options = answer_key()
+    found = find_sessions(participant_ids)
+    loaded, refreshed = load_responses(found)
+    graded = [(sf, pid, r) for sf, (pid, r) in loaded.items() if any(x["answer"] is not None for x in r.values())]
+
+    result = {
+        "questions": len(questions), "sessions": len(graded), "refreshed": refreshed,
+        "found": len(found), "no_events": len(found) - len(loaded), "no_answers": len(loaded) - len(graded),
+        "scores": [], "items": [],
+    }
+    if not graded or not questions:
+        return result
+
+    R, T, W, S = response_matrix([r for _, _, r in graded], options)
+    stats, correct = item_statistics(R, key, T, W, max(len(o) for o in options))
+    scores = correct.sum(axis=1)
+    answered = (R != NO_ANSWER).sum(axis=1)
+
+    result["mean_score"] = _round(scores.mean())
+    result["scores"] = [
+        {
+            "participant_id": pid, "session_file": sf, "answered": int(answered[i]),
+            "correct": int(scores[i]), "percent": round(100.0 * scores[i] / len(questions), 1),
+        }
+        for i, (sf, pid, _) in enumerate(graded)
+    ]
+    result["items"] = [
+        {
+            "question": j + 1,
+            "text": q.get("question"),
+            "answer": q.get("answer"),
+            "difficulty": _round(stats["difficulty"][j]),
+            "answered": int(stats["answered"][j]),
+            "discrimination": _round(stats["point_biserial"][j]),
+            "upper_lower": _round(stats["upper_lower"][j]),
+            "time_to_answer": stats["time_to_answer"][j],
+            "dwell": stats["dwell"][j],
+            "mean_submits": _round(S[:, j][R[:, j] != NO_ANSWER].mean()) if stats["answered"][j] else None,
+            "options": {opt: int(stats["option_counts"][j][o]) for o, opt in enumerate(options[j])},
+        }
+        for j, q in enumerate(questions)
+    ]
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade MCQ answers of all sessions and print item statistics.")
+    parser.add_argument("--pid", action="append", help="only these participants (repeatable)")
+    args = parser.parse_args(argv)
+    json.dump(grade(args.pid), sys.stdout, indent=1, ensure_ascii=False)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,380 @@
+# loadtest.py
+#
+# Load test / benchmark: starts the app on a scratch copy of the repo and
+# drives N simulated participants through the real flow
+#   /participant -> /start_session -> /start_camera_log
+#   -> 30 fps camera stream  +  /log_event MCQ bursts
+#   -> /log_event FINISH -> /end_camera_log
+# The camera stream is sent the way static/camera/recorder.js sends it:
+# columnar chunks of up to 30 frames, about one per second, to
+# /append_camera_log_batch, or (--camera ws) one 11-byte binary message per
+# frame over /camera_ws, closed with {"type": "end"}.
+# then reports throughput, p50/p95/p99 latency per endpoint, camera frame
+# rate actually achieved and bytes written.
+#
+#   python loadtest.py                                  # 20 participants, 30 s
+#   python loadtest.py -n 60 --duration 60 --json out.json
+#   python loadtest.py --server gunicorn --workers 4
+#   python loadtest.py --url http://127.0.0.1:5000      # an already running server
+#   python loadtest.py --camera ws                      # needs simple-websocket (client) + flask-sock (server)
+#
+# The MCQ bursts use a fixed --seed, so two runs with the same arguments send
+# the same traffic and their --json reports can be compared for regressions.
+
+import os, sys, json, time, random, shutil, socket, argparse, tempfile, threading, subprocess
+import http.client
+from collections import defaultdict
+from urllib.parse import urlsplit, urlencode
+
+import numpy as np
+
+try:
+    from simple_websocket import Client as WSClient, ConnectionClosed
+except ImportError:
+    WSClient = None
+
+from camera_format import EMOTIONS, RECORD, emotion_code, au_mask
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FPS = 30
+CHUNK_FLUSH_S = 1.0                          # recorder.js CHUNK_FLUSH_MS
+CHUNK_MAX_FRAMES = 30                        # recorder.js CHUNK_MAX_FRAMES
+COPY_DIRS = ["data", "templates"]            # needed by the app besides the *.py modules
+AUS = ["Blink", "Jaw Drop", "Looking Down", "Brow Inner Raiser", "Lip Corner Puller (Smile)"]
+MCQ_QUESTIONS = 30
+
+
+# ---------- Server ----------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def scratch_copy():
+    """Copy the app into a temp dir so the run never touches the real user_data/ or experiment.db."""
+    root = tempfile.mkdtemp(prefix="sad_loadtest_")
+    for f in os.listdir(BASE_DIR):
+        if f.endswith(".py"):
+            shutil.copy2(os.path.join(BASE_DIR, f), root)
+    for d in COPY_DIRS:
+        if os.path.isdir(os.path.join(BASE_DIR, d)):
+            shutil.copytree(os.path.join(BASE_DIR, d), os.path.join(root, d))
+    return root
+
+def start_server(root, port, server="werkzeug", workers=4, threads=16):
+    if server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "-k", "gthread", "-w", str(workers),
+               "--threads", str(threads), "-b", f"127.0.0.1:{port}", "--log-level", "warning", "app:app"]
+    else:
+        cmd = [sys.executable, "-c",
+               "from werkzeug.serving import make_server; from app import app; "
+               f"make_server('127.0.0.1', {port}, app, threaded=True).serve_forever()"]
+    proc = subprocess.Popen(cmd, cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start within 30 s")
+
+def dir_size(path):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for f in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, f))
+            except OSError:
+                pass
+    return total
+
+
+# ---------- Client ----------
+
+class Stats:
+    def __init__(self):
+        self.latency = defaultdict(list)     # endpoint -> [seconds]
+        self.status = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self.frames_sent = 0
+        self.frame_lag = []                  # seconds behind the 30 fps schedule
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, status):
+        with self._lock:
+            self.latency[endpoint].append(seconds)
+            self.status[endpoint][status] += 1
+
+    def error(self, endpoint):
+        with self._lock:
+            self.errors[endpoint] += 1
+
+
+class Participant:
+    """One simulated browser: own cookie, own keep-alive connection per thread."""
+
+    def __init__(self, base_url, stats):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.stats = stats
+        self.cookie = ""
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        return conn
+
+    def post(self, endpoint, json_body=None, form=None):
+        if form is not None:
+            body, ctype = urlencode(form), "application/x-www-form-urlencoded"
+        else:
+            body, ctype = json.dumps(json_body or {}), "application/json"
+        headers = {"Content-Type": ctype}
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+
+        conn = self._conn()
+        started = time.perf_counter()
+        try:
+            conn.request("POST", endpoint, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            self.stats.error(endpoint)
+            return None
+        self.stats.record(endpoint, time.perf_counter() - started, resp.status)
+
+        set_cookie = resp.getheader("Set-Cookie")
+        if set_cookie:
+            self.cookie = set_cookie.split(";", 1)[0]
+        return resp.status
+
+
+def camera_frames(p, stop_at, rng):
+    """Yields (epoch ms, emotion, AUs) at FPS on a fixed schedule, recording how late each frame is."""
+    interval = 1.0 / FPS
+    next_at = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if now >= stop_at:
+            break
+        if now < next_at:
+            time.sleep(next_at - now)
+        p.stats.frame_lag.append(max(0.0, time.monotonic() - next_at))
+        yield int(time.time() * 1000), rng.choice(EMOTIONS), rng.sample(AUS, rng.randint(0, 2))
+        next_at += interval
+
+def count_frames(p, n):
+    with p.stats._lock:
+        p.stats.frames_sent += n
+
+def camera_stream(p, stop_at, rng):
+    """recorder.js HTTP path: columnar chunks to /append_camera_log_batch (30 frames or 1 s)."""
+    chunk, last_ms, chunk_started = None, None, 0.0
+
+    def send():
+        p.post("/append_camera_log_batch", chunk)
+        count_frames(p, len(chunk["dt"]))
+
+    for ms, emotion, aus in camera_frames(p, stop_at, rng):
+        if chunk is None:
+            chunk = {"t0": ms, "dt": [], "emotion": [], "AUs": []}
+            last_ms, chunk_started = ms, time.monotonic()
+        chunk["dt"].append(ms - last_ms)
+        chunk["emotion"].append(emotion)
+        chunk["AUs"].append(aus)
+        last_ms = ms
+        if len(chunk["dt"]) >= CHUNK_MAX_FRAMES or time.monotonic() - chunk_started >= CHUNK_FLUSH_S:
+            send()
+            chunk = None
+    if chunk:
+        send()
+
+def camera_socket(p, stop_at, rng, ws_url):
+    """
+    recorder.js WebSocket path: one 11-byte frame record per message over
+    /camera_ws, then {"type": "end"}. Falls back to camera_stream() when the
+    socket cannot be opened (as the recorder does).
+    """
+    started = time.perf_counter()
+    try:
+        ws = WSClient.connect(ws_url, headers={"Cookie": p.cookie})
+        ready = json.loads(ws.receive(timeout=10) or "{}")
+    except (OSError, ValueError, ConnectionClosed):
+        ready = {}
+    if ready.get("status") != "ready":
+        p.stats.error("/camera_ws")
+        return camera_stream(p, stop_at, rng)
+    p.stats.record("/camera_ws", time.perf_counter() - started, 101)
+
+    try:
+        for ms, emotion, aus in camera_frames(p, stop_at, rng):
+            ws.send(RECORD.pack(ms, emotion_code(emotion), au_mask(aus)))
+            count_frames(p, 1)
+        started = time.perf_counter()
+        ws.send(json.dumps({"type": "end"}))
+        ended = json.loads(ws.receive(timeout=30) or "{}")
+        p.stats.record("/camera_ws end", time.perf_counter() - started, 200 if ended.get("status") == "ended" else 500)
+    except (OSError, ValueError, ConnectionClosed):
+        p.stats.error("/camera_ws")
+    finally:
+        ws.close()
+
+def mcq_bursts(p, stop_at, rng, started):
+    """MCQ stage: per question a Qfirstseen, a few QChange and a QSubmit, with think time."""
+    qn = 0
+    while time.monotonic() < stop_at:
+        elapsed = int(time.monotonic() - started)
+        burst = [("Qfirstseen", {"Qn": qn})]
+        burst += [("QChange", {"Qn": qn, "option": rng.choice("ABCD")}) for _ in range(rng.randint(0, 3))]
+        burst.append(("QSubmit", {"Qn": qn, "Soption": rng.choice("ABCD")}))
+        for stage, fields in burst:
+            p.post("/log_event", {"stage": stage, "time_elapsed": elapsed, "variable_field": fields})
+        qn = (qn + 1) % MCQ_QUESTIONS
+        time.sleep(rng.uniform(0.5, 2.0))
+
+def run_participant(i, base_url, stats, duration, seed, run_tag, camera="batch"):
+    rng = random.Random(seed * 100_003 + i)
+    p = Participant(base_url, stats)
+    p.post("/participant", form={"name": f"bench_{run_tag}_{i}", "email": f"bench{i}@example.com", "age": "20"})
+    p.post("/start_session")
+    p.post("/start_camera_log")
+
+    started = time.monotonic()
+    stop_at = started + duration
+    cam_rng = random.Random(rng.random())
+    if camera == "ws":
+        ws_url = base_url.replace("http", "ws", 1) + "/camera_ws"
+        cam = threading.Thread(target=camera_socket, args=(p, stop_at, cam_rng, ws_url))
+    else:
+        cam = threading.Thread(target=camera_stream, args=(p, stop_at, cam_rng))
+    cam.start()
+    mcq_bursts(p, stop_at, rng, started)
+    cam.join()
+
+    p.post("/log_event", {"stage": "FINISH", "time_elapsed": int(duration), "variable_field": {}})
+    p.post("/end_camera_log")
+
+
+# ---------- Report ----------
+
+def summarize(stats, wall, n, duration, bytes_written):
+    endpoints = {}
+    for endpoint, lat in sorted(stats.latency.items()):
+        ms = np.asarray(lat) * 1000
+        endpoints[endpoint] = {
+            "requests": int(len(ms)),
+            "rps": len(ms) / wall,
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max()),
+            "status": dict(stats.status[endpoint]),
+            "errors": stats.errors.get(endpoint, 0),
+        }
+    lag = np.asarray(stats.frame_lag or [0.0]) * 1000
+    total = sum(e["requests"] for e in endpoints.values())
+    return {
+        "participants": n,
+        "duration_s": duration,
+        "wall_s": wall,
+        "requests": total,
+        "rps": total / wall,
+        "frames_sent": stats.frames_sent,
+        "fps_per_participant": stats.frames_sent / n / duration if n and duration else 0.0,
+        "frame_lag_p95_ms": float(np.percentile(lag, 95)),
+        "bytes_written": bytes_written,
+        "endpoints": endpoints,
+    }
+
+def print_report(r):
+    print(f"\n{r['participants']} participants, {r['duration_s']:.0f} s stream, wall {r['wall_s']:.1f} s")
+    print(f"{r['requests']} requests, {r['rps']:,.0f} req/s; camera {r['fps_per_participant']:.1f} fps/participant "
+          f"(target {FPS}), frame lag p95 {r['frame_lag_p95_ms']:.1f} ms")
+    if r["bytes_written"] is not None:
+        print(f"bytes written (user_data + db): {r['bytes_written']:,}")
+    print(f"\n{'endpoint':24s} {'reqs':>7s} {'req/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'max ms':>8s}  status")
+    for endpoint, e in r["endpoints"].items():
+        status = " ".join(f"{k}:{v}" for k, v in sorted(e["status"].items()))
+        if e["errors"]:
+            status += f" err:{e['errors']}"
+        print(f"{endpoint:24s} {e['requests']:7d} {e['rps']:8.1f} {e['p50_ms']:8.2f} {e['p95_ms']:8.2f} "
+              f"{e['p99_ms']:8.2f} {e['max_ms']:8.2f}  {status}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a cohort of participants against the app.")
+    parser.add_argument("-n", "--participants", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of camera stream / MCQ per participant")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="target an already running server instead of a scratch copy")
+    parser.add_argument("--server", choices=["werkzeug", "gunicorn"], default="werkzeug")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=16, help="gunicorn threads per worker")
+    parser.add_argument("--camera", choices=["batch", "ws"], default="batch",
+                        help="camera upload path: HTTP chunks (default) or the /camera_ws socket")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch copy (user_data, db) for inspection")
+    args = parser.parse_args(argv)
+    if args.camera == "ws" and WSClient is None:
+        parser.error("--camera ws needs the simple-websocket package")
+
+    proc = root = None
+    base_url = args.url
+    if not base_url:
+        root = scratch_copy()
+        port = free_port()
+        proc = start_server(root, port, args.server, args.workers, args.threads)
+        base_url = f"http://127.0.0.1:{port}"
+        print(f"Server ({args.server}) on {base_url}, scratch dir {root}")
+
+    stats = Stats()
+    run_tag = time.strftime("%H%M%S")
+    threads = [
+        threading.Thread(target=run_participant, args=(i, base_url, stats, args.duration, args.seed, run_tag,
+                                                     args.camera))
+        for i in range(args.participants)
+    ]
+    started = time.monotonic()
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.monotonic() - started
+    finally:
+        if proc:
+            proc.terminate()   # graceful: lets the write queue drain
+            try:
+                proc.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    bytes_written = None
+    if root:
+        bytes_written = dir_size(os.path.join(root, "user_data")) + sum(
+            os.path.getsize(os.path.join(root, f)) for f in os.listdir(root) if f.startswith("experiment.db"))
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = summarize(stats, wall, args.participants, args.duration, bytes_written)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+# metrics.py
+
+import os, time, bisect, threading
+from collections import defaultdict
+
+# In-process instrumentation, rendered in the Prometheus text format at
+# /admin/metrics. Every series is per worker process (label "pid"): with
+# several gunicorn workers, scrape each one or sum across pids.
+#
+#   http_request_duration_seconds{route,method,status}   histogram, all blueprints
+#   template_render_seconds{template}                     histogram
+#   sqlite_query_seconds{op}, sqlite_fetch_seconds_total  execute() histogram + fetch*() time
+#   user_data_bytes_written_total / _read_total{kind}     counters
+#   camera_frames_total, camera_frames_per_second         counter + 10 s rate gauge
+#   ingest_queue_rejected_total / _dropped_total          counters
+#   active_sessions, camera_sockets, ingest_queue_*       gauges (collected at scrape)
+#
+# Recording is a bisect + a few integer adds under one lock, cheap enough to
+# leave on during real sessions.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+RATE_WINDOW = 10        # seconds, for camera_frames_per_second
+ACTIVE_WINDOW = 600     # seconds without events/frames before a session stops counting as active
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.series = {}   # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, values, seconds):
+        with _lock:
+            s = self.series.get(values)
+            if s is None:
+                s = self.series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[bisect.bisect_left(self.buckets, seconds)] += 1
+            s[-1] += seconds
+
+    def render(self, out, pid):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} histogram")
+        with _lock:
+            items = [(k, list(v)) for k, v in self.series.items()]
+        for values, s in sorted(items):
+            base = _labels(self.labels, values, pid)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), s[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f'{self.name}_bucket{{{base},le="{le}"}} {cumulative}')
+            out.append(f"{self.name}_sum{{{base}}} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{{{base}}} {cumulative}")
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.series = defaultdict(float)
+
+    def inc(self, values=(), amount=1):
+        with _lock:
+            self.series[values] += amount
+
+    def render(self, out, pid):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} counter")
+        with _lock:
+            items = sorted(self.series.items())
+        for values, v in items:
+            out.append(f"{self.name}{{{_labels(self.labels, values, pid)}}} {v:g}")
+
+
+class RateWindow:
+    """Events per second over the last RATE_WINDOW seconds (one slot per second)."""
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.slots = [0] * window
+        self.stamps = [0] * window
+
+    def add(self, n):
+        sec = int(time.monotonic())
+        i = sec % self.window
+        with _lock:
+            if self.stamps[i] != sec:
+                self.stamps[i], self.slots[i] = sec, 0
+            self.slots[i] += n
+
+    def rate(self):
+        now = int(time.monotonic())
+        with _lock:
+            total = sum(c for c, s in zip(self.slots, self.stamps) if now - s < self.window)
+        return total / self.window
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values, pid):
+    pairs = [f'pid="{pid}"'] + [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    return ",".join(pairs)
+
+
+_lock = threading.Lock()
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route.", ("route", "method", "status"))
+TEMPLATE_SECONDS = Histogram("template_render_seconds", "Jinja template render time.", ("template",))
+SQL_SECONDS = Histogram("sqlite_query_seconds", "SQLite execute() time by statement type.", ("op",), SQL_BUCKETS)
+SQL_FETCH_SECONDS = Counter("sqlite_fetch_seconds_total", "Time spent in cursor fetchone/fetchmany/fetchall.")
+BYTES_WRITTEN = Counter("user_data_bytes_written_total", "Bytes written under user_data/.", ("kind",))
+BYTES_READ = Counter("user_data_bytes_read_total", "Bytes read from user_data/.", ("kind",))
+CAMERA_FRAMES = Counter("camera_frames_total", "Camera frames received.")
+INGEST_REJECTED = Counter("ingest_queue_rejected_total", "Ingestion requests answered 503 (queue full / shutting down).")
+INGEST_DROPPED = Counter("ingest_queue_dropped_total", "Ingestion jobs dropped (policy drop).")
+INGEST_REJECTED.inc((), 0)   # export 0 before the first event, so rate() works from the start
+INGEST_DROPPED.inc((), 0)
+FRAME_RATE = RateWindow()
+
+GAUGES = {}   # name -> (help, callable returning a number), evaluated at scrape time
+_activity = {}   # session_file -> monotonic time of its last event / frame batch in this worker
+
+
+# ---------- Recording helpers (called from the modules that do the work) ----------
+
+def add_bytes_written(kind, n):
+    if n > 0:
+        BYTES_WRITTEN.inc((kind,), n)
+
+def add_bytes_read(kind, n):
+    if n > 0:
+        BYTES_READ.inc((kind,), n)
+
+def add_frames(n):
+    if n:
+        CAMERA_FRAMES.inc((), n)
+        FRAME_RATE.add(n)
+
+def add_ingest_rejected():
+    INGEST_REJECTED.inc()
+
+def add_ingest_dropped():
+    INGEST_DROPPED.inc()
+
+def observe_sql(sql, seconds):
+    op = sql.lstrip().split(None, 1)[0].upper() if sql and sql.strip() else "?"
+    SQL_SECONDS.observe((op,), seconds)
+
+def add_fetch_time(seconds):
+    SQL_FETCH_SECONDS.inc((), seconds)
+
+def register_gauge(name, help, fn):
+    GAUGES[name] = (help, fn)
+
+def touch_session(session_file):
+    with _lock:
+        _activity[session_file] = time.monotonic()
+
+def session_ended(session_file):
+    with _lock:
+        _activity.pop(session_file, None)
+
+def active_sessions():
+    """Sessions not ended that saw events or frames in the last ACTIVE_WINDOW seconds."""
+    cutoff = time.monotonic() - ACTIVE_WINDOW
+    with _lock:
+        for session_file in [k for k, t in _activity.items() if t < cutoff]:
+            del _activity[session_file]
+        return len(_activity)
+
+
+# ---------- Flask wiring ----------
+
+def init_app(app):
+    """Time every request (all blueprints) and every template render."""
+    from flask import g, request, template_rendered, before_render_template
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop("_metrics_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_SECONDS.observe((route, request.method, str(response.status_code)),
+                                    time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def _record_failed_request(exc):
+        # after_request is skipped when a view raised
+        started = g.pop("_metrics_started", None)
+        if started is not None and exc is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_SECONDS.observe((route, request.method, "500"), time.perf_counter() - started)
+
+    def _render_started(sender, template, context, **extra):
+        g._metrics_render_started = time.perf_counter()
+
+    def _render_done(sender, template, context, **extra):
+        started = g.pop("_metrics_render_started", None)
+        if started is not None:
+            TEMPLATE_SECONDS.observe((template.name or "?",), time.perf_counter() - started)
+
+    # local functions: keep strong references or blinker drops them
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_done, app, weak=False)
+
+
+# ---------- Exposition ----------
+
+def render():
+    """All metrics of this process in the Prometheus text format (0.0.4)."""
+    pid = os.getpid()
+    out = []
+    for metric in (REQUEST_SECONDS, TEMPLATE_SECONDS, SQL_SECONDS, SQL_FETCH_SECONDS,
+                   BYTES_WRITTEN, BYTES_READ, CAMERA_FRAMES, INGEST_REJECTED, INGEST_DROPPED):
+        metric.render(out, pid)
+
+    out.append("# HELP camera_frames_per_second Camera frames received per second (10 s window).")
+    out.append("# TYPE camera_frames_per_second gauge")
+    out.append(f'camera_frames_per_second{{pid="{pid}"}} {FRAME_RATE.rate():g}')
+    out.append("# HELP active_sessions Sessions with events or frames in the last 10 minutes, not yet ended.")
+    out.append("# TYPE active_sessions gauge")
+    out.append(f'active_sessions{{pid="{pid}"}} {active_sessions()}')
+
+    for name, (help, fn) in sorted(GAUGES.items()):
+        try:
+            value = fn()
+        except Exception:
+            continue
+        out.append(f"# HELP {name} {help}")
+        out.append(f"# TYPE {name} gauge")
+        out.append(f'{name}{{pid="{pid}"}} {value:g}')
+    return "\n".join(out) + "\n"
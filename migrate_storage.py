@@ -0,0 +1,215 @@
+# migrate_storage.py
+#
+# Moves participant data from the flat layout (user_data/<participant name>/)
+# to the sharded one (user_data/<ab>/<cd>/<participant_id>/, see storage.py).
+# Safe to run while the app is serving sessions:
+#
+#   python migrate_storage.py              # migrate everything that is idle
+#   python migrate_storage.py --dry-run    # only show what would move
+#
+# Per participant:
+#   1. skipped if one of their sessions is live (open and started less than
+#      --live-hours ago, or any of their files written in the last --idle-minutes);
+#      run the command again later to pick them up
+#   2. their files are hard-linked into a staging folder next to the target,
+#      which is then renamed into place -- one atomic step after which
+#      storage.participant_dir() resolves to the new folder, while every file
+#      stays reachable at its old path until then
+#   3. session_files paths and compact.py's state keys are rewritten
+#   4. the old names are unlinked; the name folder is removed once empty
+# Participants sharing a name folder get only their own sessions (matched
+# through participant_sessions); files nobody owns move only if the name is
+# unambiguous, otherwise they stay and are reported.
+# Re-running is harmless: migrated participants are skipped and a run that
+# stopped half-way is completed.
+
+import os, re, sys, json, time, shutil, argparse
+from datetime import datetime
+
+from database import get_db_connection
+from storage import USER_DATA_DIR, shard_dir, legacy_dir, rel_path
+
+PARQUET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parquet")   # written by compact.py
+STATE_PATH = os.path.join(PARQUET_DIR, "_state.json")
+LIVE_HOURS = 12
+IDLE_MINUTES = 10
+STAGING_PREFIX = ".migrating-"
+
+
+# ---------- Planning ----------
+
+def load_participants():
+    """{name: [(participant_id, {session_file: (start_time, end_time)})]} for every named participant."""
+    conn = get_db_connection()
+    people = conn.execute("SELECT participant_id, name FROM participants ORDER BY id").fetchall()
+    sessions = conn.execute("SELECT participant_id, session_file, start_time, end_time FROM participant_sessions").fetchall()
+    conn.close()
+
+    by_pid = {}
+    for pid, sf, start, end in sessions:
+        by_pid.setdefault(pid, {})[sf] = (start, end)
+    by_name = {}
+    for pid, name in people:
+        if name:
+            by_name.setdefault(name, []).append((pid, by_pid.get(pid, {})))
+    return by_name
+
+def owned_files(names, session_files):
+    """Files of the folder belonging to one of the given sessions (logs, exports, reanalyze outputs)."""
+    out = []
+    for f in names:
+        for sf in session_files:
+            if f.startswith(sf) and re.match(r"[._]", f[len(sf):]):
+                out.append(f)
+                break
+    return out
+
+def _started(ts):
+    try:
+        return datetime.fromisoformat(ts).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def is_live(folder, files, sessions, live_hours, idle_minutes):
+    now = time.time()
+    for start, end in sessions.values():
+        started = _started(start)
+        if end is None and started is not None and now - started < live_hours * 3600:
+            return True
+    return any(now - os.path.getmtime(os.path.join(folder, f)) < idle_minutes * 60 for f in files)
+
+
+# ---------- compact.py state ----------
+
+def load_compact_state():
+    """compact.py's _state.json (keys are <folder>/<stem>), or None if it never ran."""
+    try:
+        with open(STATE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save_compact_state(state):
+    tmp = STATE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, STATE_PATH)
+
+
+# ---------- Moving one participant ----------
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:   # no hard links on this file system
+        shutil.copy2(src, dst)
+
+def move_files(folder, files, target):
+    """Make `files` of `folder` appear in `target` (atomically if target is new), then drop the old names."""
+    if os.path.isdir(target):
+        stage = target
+    else:
+        stage = os.path.join(os.path.dirname(target), STAGING_PREFIX + os.path.basename(target))
+        shutil.rmtree(stage, ignore_errors=True)   # left over from an interrupted run
+        os.makedirs(stage)
+    moved = []
+    for f in files:
+        src, dst = os.path.join(folder, f), os.path.join(stage, f)
+        if os.path.exists(os.path.join(target, f)) and os.path.samefile(src, os.path.join(target, f)):
+            moved.append(f)   # linked by an interrupted run
+            continue
+        if os.path.exists(os.path.join(target, f)):
+            print(f"  {f}: already exists in {rel_path(target)}, left in place")
+            continue
+        _link(src, dst)
+        moved.append(f)
+    if stage != target:
+        os.rename(stage, target)   # the switch: participant_dir() now resolves here
+    return moved
+
+def update_references(old_folder, new_folder, files, state):
+    """session_files paths and compact.py state keys of moved files."""
+    old_rel, new_rel = rel_path(old_folder), rel_path(new_folder)
+    conn = get_db_connection()
+    conn.executemany(
+        "UPDATE OR REPLACE session_files SET path=? WHERE path=?",
+        [(f"{new_rel}/{f}", f"{old_rel}/{f}") for f in files],
+    )
+    conn.commit()
+    conn.close()
+
+    if state is not None:
+        for key in [k for k in state["sessions"] if k.startswith(old_rel + "/")]:
+            stem = key[len(old_rel) + 1:]
+            if any(f.startswith(stem) for f in files):
+                state["sessions"][f"{new_rel}/{stem}"] = state["sessions"].pop(key)
+
+def migrate_participant(pid, folder, files, state, dry_run=False):
+    if not files:
+        return 0
+    target = shard_dir(pid)
+    print(f"{pid}: {len(files)} files {rel_path(folder)}/ -> {rel_path(target)}/")
+    if dry_run:
+        return 0
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    moved = move_files(folder, files, target)
+    update_references(folder, target, moved, state)
+    for f in moved:
+        os.remove(os.path.join(folder, f))
+    return len(moved)
+
+
+# ---------- Whole tree ----------
+
+def run(dry_run=False, live_hours=LIVE_HOURS, idle_minutes=IDLE_MINUTES):
+    by_name = load_participants()
+    state = load_compact_state()
+    totals = {"participants": 0, "files": 0, "live": 0, "left": 0}
+
+    for name, people in sorted(by_name.items()):
+        folder = legacy_dir(name)
+        if not folder or not os.path.isdir(folder):
+            continue
+        names = sorted(f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f)))
+        claimed = set()
+        for pid, sessions in people:
+            files = owned_files(names, sessions)
+            if len(people) == 1:
+                files = names   # sole owner of the folder: everything in it
+            claimed.update(files)
+            if is_live(folder, files, sessions, live_hours, idle_minutes):
+                print(f"{pid}: live session, skipped (run again later)")
+                totals["live"] += 1
+                continue
+            if files:
+                totals["participants"] += 1
+                totals["files"] += migrate_participant(pid, folder, files, state, dry_run)
+
+        unclaimed = [f for f in names if f not in claimed]
+        if unclaimed:
+            print(f"{rel_path(folder)}/: {len(unclaimed)} files not matched to any of {len(people)} participants, left in place")
+            totals["left"] += len(unclaimed)
+        if not dry_run and not os.listdir(folder):
+            os.rmdir(folder)
+
+    if state is not None and not dry_run:
+        save_compact_state(state)
+    print(f"{totals['participants']} participants, {totals['files']} files moved, "
+          f"{totals['live']} live (skipped), {totals['left']} unmatched files left")
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move user_data/<name>/ folders to the sharded <ab>/<cd>/<participant_id>/ layout.")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would be moved")
+    parser.add_argument("--live-hours", type=float, default=LIVE_HOURS,
+                        help="unfinished sessions younger than this count as live")
+    parser.add_argument("--idle-minutes", type=float, default=IDLE_MINUTES,
+                        help="participants with files written this recently count as live")
+    args = parser.parse_args(argv)
+    run(args.dry_run, args.live_hours, args.idle_minutes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# profiler.py
+
+import os, re, sys, time, random, threading
+from collections import Counter
+from datetime import datetime, timezone
+
+# Opt-in sampling profiler for slow requests.
+#
+# A background thread (one per worker process) looks at the stacks of the
+# request threads being profiled every PROFILE_INTERVAL_MS and counts them.
+# A request is profiled when either
+#   PROFILE_SAMPLE_RATE  (0..1)  it is picked at random, or
+#   PROFILE_SLOW_MS      (> 0)   it took longer than this
+# Both default to off; with neither set the hooks are not installed at all.
+# Because "slow" is only known at the end, a slow threshold samples every
+# request and keeps the profile only if the threshold was crossed.
+#
+# Profiles are written to PROFILE_DIR as flamegraph-ready "folded" stacks
+# (one "frame;frame;frame count" line per distinct stack) with a header
+# naming route, participant_id, session file and duration. Only the newest
+# PROFILE_KEEP files are kept. Admins list / download them at /admin/profiles.
+
+BASE_DIR = os.path.dirname(__file__)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000
+KEEP = int(os.environ.get("PROFILE_KEEP", "200"))
+MAX_DEPTH = 64
+
+PROFILE_EXT = ".folded"
+
+
+class Sampler:
+    """Counts the stacks of registered threads every `interval` seconds."""
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self._targets = {}     # thread ident -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # per process: gunicorn forks after import
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._targets = {}
+            threading.Thread(target=self._run, name="profiler-sampler", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._targets:
+                    continue
+                frames = sys._current_frames()
+                for ident, counts in self._targets.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        counts[fold(frame)] += 1
+
+    def start(self, ident):
+        self._ensure_thread()
+        with self._lock:
+            self._targets[ident] = Counter()
+
+    def stop(self, ident):
+        """Stop sampling a thread; returns its Counter of stacks."""
+        with self._lock:
+            return self._targets.pop(ident, Counter())
+
+
+def fold(frame):
+    """Stack of a frame as 'outer;...;inner', each entry 'function (file:line)'."""
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+SAMPLER = Sampler()
+
+
+# ---------- Profile files ----------
+
+def _slug(value):
+    return re.sub(r"[^A-Za-z0-9]+", "-", str(value or "")).strip("-")[:60] or "none"
+
+def write_profile(counts, route, method, duration, participant_id=None, session_file=None):
+    """Write one profile and drop the oldest beyond KEEP. Returns the file name."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    name = (f"{stamp}_{_slug(route)}_{_slug(participant_id)}_{int(duration * 1000)}ms_{os.getpid()}"
+            f"{PROFILE_EXT}")
+    with open(os.path.join(PROFILE_DIR, name), "w", encoding="utf-8") as f:
+        f.write(f"# route: {method} {route}\n")
+        f.write(f"# participant_id: {participant_id or ''}\n")
+        f.write(f"# session_file: {session_file or ''}\n")
+        f.write(f"# duration_ms: {duration * 1000:.1f}\n")
+        f.write(f"# samples: {sum(counts.values())} every {INTERVAL * 1000:g} ms, pid {os.getpid()}\n")
+        for stack, count in counts.most_common():
+            f.write(f"{stack} {count}\n")
+    rotate()
+    return name
+
+def rotate(keep=KEEP):
+    names = list_profiles()
+    for name in names[keep:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
+
+def list_profiles():
+    """Profile file names, newest first (names start with a UTC timestamp)."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted((n for n in os.listdir(PROFILE_DIR) if n.endswith(PROFILE_EXT)), reverse=True)
+
+def read_header(name):
+    """The '# key: value' header lines of a profile as a dict."""
+    header = {}
+    with open(os.path.join(PROFILE_DIR, name), "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.startswith("# "):
+                break
+            key, _, value = line[2:].partition(": ")
+            header[key] = value.strip()
+    return header
+
+
+# ---------- Flask wiring ----------
+
+def init_app(app, sample_rate=SAMPLE_RATE, slow_ms=SLOW_MS):
+    """Install the hooks if profiling is enabled (PROFILE_SAMPLE_RATE / PROFILE_SLOW_MS)."""
+    if sample_rate <= 0 and slow_ms <= 0:
+        return
+    from flask import g, request, session
+
+    @app.before_request
+    def _start_profile():
+        rule = request.url_rule
+        if rule is None or getattr(rule, "websocket", False):   # long-lived sockets
+            return
+        picked = sample_rate > 0 and random.random() < sample_rate
+        if picked or slow_ms > 0:
+            g._profile = (time.perf_counter(), picked)
+            SAMPLER.start(threading.get_ident())
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        started = g.pop("_profile", None)
+        if started is None:
+            return
+        counts = SAMPLER.stop(threading.get_ident())
+        began, picked = started
+        duration = time.perf_counter() - began
+        if not counts or not (picked or duration * 1000 >= slow_ms):
+            return
+        try:
+            write_profile(counts, request.url_rule.rule, request.method, duration,
+                          session.get("participant_id"), session.get("current_base_filename"))
+        except Exception as e:
+            print(f"Profiler write error: {e}")
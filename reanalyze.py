@@ -0,0 +1,187 @@
+# reanalyze.py
+#
+# Offline re-analysis of stored camera sessions with the current (or a given)
+# emotion/AU mapping from emotion_model.py.
+#
+#   python reanalyze.py                       # all sessions under user_data/
+#   python reanalyze.py --workers 8
+#   python reanalyze.py --config mapping.json # thresholds / maps to try
+#   python reanalyze.py --force               # ignore up-to-date outputs
+#
+# For every raw-score log  user_data/<name>/session_..._camera_scores.bin
+# it writes, next to the original:
+#   session_..._camera.v<mapping_version>.bin    (same record format as _camera.bin)
+#   session_..._camera.v<mapping_version>.json   (metadata: input stamp, counts)
+# Outputs whose input file and mapping version are unchanged are skipped.
+# Label-only logs (_camera.bin / legacy _camera.csv) cannot be re-classified
+# and are only reported.
+
+import os, sys, json, time, argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from camera_format import read_scores, pack_frames, EMOTIONS, AU_NAMES, SCORES_SUFFIX, BIN_SUFFIX, RLE_SUFFIX, CSV_SUFFIX
+from emotion_model import EmotionModel
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USER_DATA_DIR = os.path.join(BASE_DIR, 'user_data')
+
+BLOCK_FRAMES = 200_000   # frames classified per matrix pass (bounds worker memory)
+
+_MODEL = None
+
+
+# ---------- Discovery ----------
+
+def discover(root):
+    """
+    Returns (score_logs, label_only_logs) under root.
+    A session counts as label-only if it has no _camera_scores.bin.
+    """
+    score_logs, label_only = [], []
+    for dirpath, dirnames, filenames in os.walk(root):
+        names = set(filenames)
+        for f in sorted(filenames):
+            path = os.path.join(dirpath, f)
+            if f.endswith(SCORES_SUFFIX):
+                score_logs.append(path)
+            elif f.endswith(BIN_SUFFIX) or f.endswith(RLE_SUFFIX):
+                suffix = BIN_SUFFIX if f.endswith(BIN_SUFFIX) else RLE_SUFFIX
+                if f[: -len(suffix)] + SCORES_SUFFIX not in names:
+                    label_only.append(path)
+            elif f.endswith(CSV_SUFFIX):
+                # legacy text log (an export next to a .bin is not counted)
+                stem = f[: -len(CSV_SUFFIX)]
+                if not names & {stem + BIN_SUFFIX, stem + RLE_SUFFIX, stem + SCORES_SUFFIX}:
+                    label_only.append(path)
+    return score_logs, label_only
+
+def output_paths(scores_path, version):
+    stem = scores_path[: -len(SCORES_SUFFIX)]
+    return f"{stem}_camera.v{version}.bin", f"{stem}_camera.v{version}.json"
+
+def input_stamp(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+# ---------- Worker ----------
+
+def _init_worker(config):
+    global _MODEL
+    _MODEL = EmotionModel(**config)
+
+def reanalyze_one(scores_path, force=False):
+    """Re-classify one raw-score log. Returns (path, status, n_frames)."""
+    model = _MODEL
+    out_bin, out_meta = output_paths(scores_path, model.version)
+    stamp = input_stamp(scores_path)
+
+    if not force and os.path.exists(out_bin) and os.path.exists(out_meta):
+        try:
+            with open(out_meta, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("input") == stamp and meta.get("mapping_version") == model.version:
+                return scores_path, "skipped", meta.get("frames", 0)
+        except ValueError:
+            pass
+
+    records = read_scores(scores_path)
+    emotion_counts = np.zeros(len(EMOTIONS), dtype=np.int64)
+    au_counts = np.zeros(len(AU_NAMES), dtype=np.int64)
+
+    au_shifts = np.arange(len(AU_NAMES), dtype=np.uint16)
+
+    tmp_bin = out_bin + ".tmp"
+    try:
+        with open(tmp_bin, "wb") as f:
+            for start in range(0, len(records), BLOCK_FRAMES):
+                block = records[start:start + BLOCK_FRAMES]
+                emotions, aus = model.classify(block["scores"])
+                f.write(pack_frames(block["ts"], emotions, aus))
+
+                emotion_counts += np.bincount(emotions, minlength=len(EMOTIONS))[:len(EMOTIONS)]
+                au_counts += ((aus[:, None] >> au_shifts) & 1).sum(axis=0, dtype=np.int64)
+        os.replace(tmp_bin, out_bin)
+    finally:
+        if os.path.exists(tmp_bin):
+            os.remove(tmp_bin)
+
+    meta = {
+        "source": os.path.basename(scores_path),
+        "input": stamp,
+        "mapping_version": model.version,
+        "frames": int(len(records)),
+        "emotion_counts": dict(zip(EMOTIONS, emotion_counts.tolist())),
+        "au_counts": dict(zip(AU_NAMES, au_counts.tolist())),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    tmp_meta = out_meta + ".tmp"
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_meta, out_meta)
+
+    return scores_path, "done", int(len(records))
+
+
+# ---------- Driver ----------
+
+def run(root, workers=None, config=None, force=False, quiet=False):
+    config = config or {}
+    version = EmotionModel(**config).version
+    score_logs, label_only = discover(root)
+
+    print(f"Mapping version {version}: {len(score_logs)} raw-score logs, "
+          f"{len(label_only)} label-only logs (not re-classifiable)")
+    if not score_logs:
+        return {"done": 0, "skipped": 0, "failed": 0}
+
+    totals = {"done": 0, "skipped": 0, "failed": 0}
+    frames = 0
+    started = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config,)) as pool:
+        futures = {pool.submit(reanalyze_one, p, force): p for p in score_logs}
+        for i, fut in enumerate(as_completed(futures), 1):
+            path = futures[fut]
+            try:
+                _, status, n = fut.result()
+                frames += n if status == "done" else 0
+            except Exception as e:
+                status = "failed"
+                print(f"  failed: {path}: {e}", file=sys.stderr)
+            totals[status] += 1
+
+            if not quiet:
+                elapsed = time.monotonic() - started
+                rate = frames / elapsed if elapsed else 0
+                print(f"[{i}/{len(score_logs)}] {status:7s} {os.path.relpath(path, root)}"
+                      f"  ({rate:,.0f} frames/s)")
+
+    print(f"Finished in {time.monotonic() - started:.1f}s: "
+          f"{totals['done']} done, {totals['skipped']} up to date, {totals['failed']} failed")
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-classify stored camera sessions with the emotion/AU mapping.")
+    parser.add_argument("--root", default=USER_DATA_DIR, help="user_data directory to scan")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--config", help="JSON file with EmotionModel overrides "
+                                         "(emotion_map, au_map, emotion_threshold, happy_override, au_threshold)")
+    parser.add_argument("--force", action="store_true", help="recompute even if outputs are up to date")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args(argv)
+
+    config = {}
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+    totals = run(args.root, workers=args.workers, config=config, force=args.force, quiet=args.quiet)
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+# session_summary.py
+
+import json
+
+import numpy as np
+
+import metrics
+from database import get_db_connection
+from camera_format import EMOTIONS
+from stimuli import get_stimulus
+
+# Incrementally maintained per-session summary (session_summaries table).
+# The ingestion routes call these with each batch they write, so the admin
+# views can show duration / MCQ score / camera stats without reading files.
+
+SUMMARY_COLUMNS = [
+    "session_file", "participant_id", "start_time", "end_time",
+    "event_count", "first_event_at", "last_event_at", "duration_seconds",
+    "mcq_answers", "mcq_answered", "mcq_correct",
+    "camera_frames", "first_frame_ms", "last_frame_ms", "emotion_histogram",
+]
+
+
+def mcq_answer_key():
+    """{question index: correct option} from data/mcq_questions.json (cached)."""
+    return {i: q.get("answer") for i, q in enumerate(get_stimulus("mcq_questions"))}
+
+def score_answers(answers):
+    """answers: {"<Qn>": option} -> (answered, correct) against the current key."""
+    key = mcq_answer_key()
+    correct = sum(1 for qn, opt in answers.items() if key.get(int(qn)) == opt)
+    return len(answers), correct
+
+
+# ---------- Writers (called from the ingestion routes) ----------
+
+def start_summary(participant_id, session_file, start_time):
+    metrics.touch_session(session_file)
+    conn = get_db_connection()
+    conn.execute("""
+        INSERT OR REPLACE INTO session_summaries (session_file, participant_id, start_time, event_count, first_event_at, last_event_at)
+        VALUES (?, ?, ?, 1, ?, ?)
+    """, (session_file, participant_id, start_time, start_time, start_time))
+    conn.commit()
+    conn.close()
+
+def record_events(session_file, events):
+    """
+    Fold a batch of stored events (EventType / TimeElapsed / timestamp /
+    VariableFields dicts, in order) into the session's summary row.
+    """
+    if not events:
+        return
+    metrics.touch_session(session_file)
+
+    # latest answer per question in this batch (QSubmit carries Qn + Soption)
+    new_answers = {}
+    for ev in events:
+        if ev["EventType"] == "QSubmit":
+            fields = ev["VariableFields"] or {}
+            if "Qn" in fields and "Soption" in fields:
+                new_answers[str(fields["Qn"])] = fields["Soption"]
+
+    elapsed = [ev["TimeElapsed"] for ev in events if isinstance(ev["TimeElapsed"], (int, float))]
+    max_elapsed = int(max(elapsed)) if elapsed else 0
+
+    conn = get_db_connection()
+    conn.execute("BEGIN IMMEDIATE")   # serialize read-modify-write across workers
+    try:
+        if new_answers:
+            row = conn.execute(
+                "SELECT mcq_answers FROM session_summaries WHERE session_file=?", (session_file,)
+            ).fetchone()
+            answers = json.loads(row[0]) if row else {}
+            answers.update(new_answers)
+            answered, correct = score_answers(answers)
+            conn.execute("""
+                UPDATE session_summaries
+                SET mcq_answers=?, mcq_answered=?, mcq_correct=?
+                WHERE session_file=?
+            """, (json.dumps(answers, ensure_ascii=False), answered, correct, session_file))
+
+        conn.execute("""
+            UPDATE session_summaries
+            SET event_count = event_count + ?,
+                first_event_at = COALESCE(first_event_at, ?),
+                last_event_at = ?,
+                duration_seconds = MAX(duration_seconds, ?)
+            WHERE session_file=?
+        """, (len(events), events[0]["timestamp"], events[-1]["timestamp"], max_elapsed, session_file))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def record_frames(session_file, ts, emotions):
+    """Fold a batch of camera frames (epoch-ms array, emotion-code array) into the summary."""
+    n = len(ts)
+    if n == 0:
+        return
+    metrics.touch_session(session_file)
+
+    counts = np.bincount(np.asarray(emotions, dtype=np.int64), minlength=len(EMOTIONS))
+
+    conn = get_db_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT emotion_histogram FROM session_summaries WHERE session_file=?", (session_file,)
+        ).fetchone()
+        hist = json.loads(row[0]) if row else {}
+        for code, count in enumerate(counts.tolist()):
+            if count:
+                label = EMOTIONS[code] if code < len(EMOTIONS) else "unknown"
+                hist[label] = hist.get(label, 0) + count
+
+        conn.execute("""
+            UPDATE session_summaries
+            SET camera_frames = camera_frames + ?,
+                first_frame_ms = COALESCE(MIN(first_frame_ms, ?), ?),
+                last_frame_ms = COALESCE(MAX(last_frame_ms, ?), ?),
+                emotion_histogram = ?
+            WHERE session_file=?
+        """, (n, int(np.min(ts)), int(np.min(ts)), int(np.max(ts)), int(np.max(ts)),
+              json.dumps(hist), session_file))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def end_session(session_file, end_time):
+    """Session finished: stamp end_time on the summary and on participant_sessions."""
+    metrics.session_ended(session_file)
+    conn = get_db_connection()
+    conn.execute("UPDATE session_summaries SET end_time=? WHERE session_file=?", (end_time, session_file))
+    conn.execute("""
+        UPDATE participant_sessions SET end_time=?
+        WHERE session_file=? AND end_time IS NULL
+    """, (end_time, session_file))
+    conn.commit()
+    conn.close()
+
+
+# ---------- Readers (admin views) ----------
+
+def _row_to_summary(row):
+    s = dict(zip(SUMMARY_COLUMNS, row))
+    s["mcq_answers"] = json.loads(s["mcq_answers"] or "{}")
+    s["emotion_histogram"] = json.loads(s["emotion_histogram"] or "{}")
+    hist = s["emotion_histogram"]
+    s["dominant_emotion"] = max(hist, key=hist.get) if hist else None
+    s["mcq_total"] = len(mcq_answer_key())
+    return s
+
+def get_participant_summaries(participant_id):
+    """All session summaries of one participant, newest first."""
+    conn = get_db_connection()
+    rows = conn.execute(f"""
+        SELECT {", ".join(SUMMARY_COLUMNS)} FROM session_summaries
+        WHERE participant_id=?
+        ORDER BY start_time DESC
+    """, (participant_id,)).fetchall()
+    conn.close()
+    return [_row_to_summary(r) for r in rows]
+
+def get_latest_summaries(participant_ids):
+    """{participant_id: latest session summary} for one dashboard page."""
+    if not participant_ids:
+        return {}
+    marks = ",".join("?" * len(participant_ids))
+    conn = get_db_connection()
+    rows = conn.execute(f"""
+        SELECT {", ".join(SUMMARY_COLUMNS)} FROM session_summaries
+        WHERE participant_id IN ({marks})
+        ORDER BY start_time
+    """, list(participant_ids)).fetchall()
+    conn.close()
+
+    latest = {}
+    for r in rows:
+        s = _row_to_summary(r)
+        latest[s["participant_id"]] = s     # later start_time wins
+    return latest
@@ -6,6 +6,263 @@ import { getEmotion, getAUs } from "./analysis.js";
 let recording = false;
 let activeVideo = null;
 
+// "labels": classify in the browser (analysis.js) and send emotion + AUs
+// "scores": send raw blendshape scores, classified server-side (emotion_model.py)
+// The server picks the mode in its /start_camera_log response.
+let uploadMode = "labels";
+
+// --- Frame chunking ---
+// Frames are collected into a columnar chunk and sent to
+// /append_camera_log_batch about once per second (~30 frames)
+// instead of one POST per frame.
+const CHUNK_FLUSH_MS = 1000;
+const CHUNK_MAX_FRAMES = 30;
+
+let chunk = newChunk();
+let lastFrameMs = null;
+let chunkTimer = null;
+
+// --- Retries ---
+// The server answers 503 while its write queue is full (write_queue.py).
+// Chunks are sent one at a time in order; a chunk that fails with a network
+// error or 5xx stays at the front of chunkQueue and is retried with
+// exponential backoff, later chunks queue up behind it.
+const RETRY_MIN_MS = 1000;
+const RETRY_MAX_MS = 30000;
+
+let chunkQueue = [];            // { url, body } waiting to be sent, oldest first
+let chunkChain = Promise.resolve();
+let chunkRetryTimer = null;
+let chunkRetryMs = RETRY_MIN_MS;
+let stopRequested = false;
+
+// --- WebSocket channel ---
+// When /camera_ws is available, frames go over one open socket instead:
+// labels mode sends each frame as an 11-byte binary record (same layout as
+// camera_format.py: int64 ts, uint8 emotion code, uint16 AU mask), scores
+// mode sends the usual chunks as text messages. If the socket cannot be
+// opened or drops, recording continues over the HTTP chunk endpoints.
+const WS_CONNECT_TIMEOUT_MS = 3000;
+const WS_END_TIMEOUT_MS = 3000;
+
+// Same order as camera_format.EMOTIONS / AU_NAMES (and AUMap in analysis.js)
+const EMOTIONS = ["neutral", "happy", "sad", "angry", "surprise", "fear", "disgust"];
+const AU_NAMES = [
+    "Lip Corner Puller (Smile)", "Upper Lip Raiser", "Looking Down", "Brow Inner Raiser",
+    "Brow Outer Raiser", "Blink", "Lip Corner Depressor", "Lip Tightener", "Lip Pressor",
+    "Lid Tightener", "Chin Raiser", "Brow Lowerer", "Cheek Raiser", "Jaw Drop"
+];
+
+let socket = null;
+
+function packFrame(ms, emotion, aus) {
+    const buf = new ArrayBuffer(11);
+    const view = new DataView(buf);
+    view.setBigInt64(0, BigInt(ms), true);
+    const code = EMOTIONS.indexOf(emotion);
+    view.setUint8(8, code < 0 ? 255 : code);
+    let mask = 0;
+    for (const au of aus) {
+        const bit = AU_NAMES.indexOf(au);
+        if (bit >= 0) mask |= 1 << bit;
+    }
+    view.setUint16(9, mask, true);
+    return buf;
+}
+
+function openSocket() {
+    if (!("WebSocket" in window)) return Promise.resolve(null);
+    const url = (location.protocol === "https:" ? "wss://" : "ws://") + location.host + "/camera_ws";
+
+    return new Promise(resolve => {
+        let ws;
+        try {
+            ws = new WebSocket(url);
+        } catch (e) {
+            resolve(null);
+            return;
+        }
+        ws.binaryType = "arraybuffer";
+        const timer = setTimeout(() => { ws.close(); resolve(null); }, WS_CONNECT_TIMEOUT_MS);
+
+        ws.onmessage = ev => {
+            let msg = {};
+            try { msg = JSON.parse(ev.data); } catch (e) { /* ignore */ }
+            if (msg.status === "ready") {
+                clearTimeout(timer);
+                resolve(ws);
+            } else if (msg.status === "error") {
+                clearTimeout(timer);
+                ws.close();
+                resolve(null);
+            }
+        };
+        ws.onerror = () => { clearTimeout(timer); resolve(null); };
+        ws.onclose = () => {
+            clearTimeout(timer);
+            if (socket === ws) {
+                console.warn("Camera socket closed, falling back to HTTP chunks.");
+                socket = null;
+            }
+            resolve(null);
+        };
+    });
+}
+
+function closeSocket() {
+    const ws = socket;
+    socket = null;
+    if (!ws || ws.readyState !== WebSocket.OPEN) return Promise.resolve();
+
+    // Ask the server to flush this connection's buffer and close the log
+    return new Promise(resolve => {
+        const timer = setTimeout(done, WS_END_TIMEOUT_MS);
+        function done() {
+            clearTimeout(timer);
+            ws.close();
+            resolve();
+        }
+        ws.onmessage = ev => {
+            try {
+                if (JSON.parse(ev.data).status === "ended") done();
+            } catch (e) { /* ignore */ }
+        };
+        ws.onclose = done;
+        ws.send(JSON.stringify({ type: "end" }));
+    });
+}
+
+function newChunk() {
+    if (uploadMode === "scores") {
+        return { t0: null, dt: [], names: null, scores: [] };
+    }
+    return { t0: null, dt: [], emotion: [], AUs: [] };
+}
+
+function chunkUrl() {
+    return uploadMode === "scores" ? "/append_camera_scores_batch" : "/append_camera_log_batch";
+}
+
+function addTimestamp(ms) {
+    if (chunk.t0 === null) {
+        chunk.t0 = ms;
+        chunk.dt.push(0);
+    } else {
+        chunk.dt.push(ms - lastFrameMs);
+    }
+    lastFrameMs = ms;
+}
+
+function addFrame(ms, emotion, aus) {
+    addTimestamp(ms);
+    chunk.emotion.push(emotion);
+    chunk.AUs.push(aus);
+
+    if (chunk.dt.length >= CHUNK_MAX_FRAMES) flushChunk();
+}
+
+function addScores(ms, blend) {
+    addTimestamp(ms);
+    if (!chunk.names) chunk.names = blend.map(b => b.categoryName);
+    // 3 decimals is plenty for the 0.15 / 0.2 / 0.3 thresholds and keeps the payload small
+    chunk.scores.push(blend.map(b => Math.round(b.score * 1000) / 1000));
+
+    if (chunk.dt.length >= CHUNK_MAX_FRAMES) flushChunk();
+}
+
+function takeChunk() {
+    if (!chunk.dt.length) return null;
+    const body = JSON.stringify(chunk);
+    chunk = newChunk();
+    return body;
+}
+
+function isRetryable(status) {
+    return status === 429 || status >= 500;
+}
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+function scheduleChunkRetry() {
+    if (chunkRetryTimer) return;
+    chunkRetryTimer = setTimeout(() => {
+        chunkRetryTimer = null;
+        sendChunks();
+    }, chunkRetryMs);
+    chunkRetryMs = Math.min(chunkRetryMs * 2, RETRY_MAX_MS);
+}
+
+function sendChunks() {
+    chunkChain = chunkChain.then(async () => {
+        while (chunkQueue.length) {
+            const item = chunkQueue[0];
+            let res = null;
+            try {
+                res = await fetch(item.url, {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: item.body
+                });
+            } catch (e) {
+                console.warn("Camera chunk failed, will retry", e);
+            }
+            if (chunkQueue[0] !== item) continue;   // handed to beaconChunk() meanwhile
+            if (!res || isRetryable(res.status)) {
+                scheduleChunkRetry();   // keep it at the front
+                return;
+            }
+            chunkQueue.shift();
+            chunkRetryMs = RETRY_MIN_MS;
+            if (!res.ok) {
+                console.error(`Camera chunk rejected (HTTP ${res.status}), not retried`);
+            } else {
+                const status = (await res.json().catch(() => ({}))).status;
+                if (status === "dropped" || status === "ignored") console.warn(`Camera chunk ${status} by the server`);
+            }
+        }
+    });
+    return chunkChain;
+}
+
+function flushChunk() {
+    const url = chunkUrl();
+    if (socket && uploadMode === "scores") {
+        if (chunk.dt.length) {
+            socket.send(JSON.stringify({ type: "scores", ...chunk }));
+            chunk = newChunk();
+        }
+        return Promise.resolve();
+    }
+    const body = takeChunk();
+    if (body) chunkQueue.push({ url, body });
+    if (chunkRetryTimer) return chunkChain;   // backing off: sent with the retry
+    return sendChunks();
+}
+
+function beaconChunk() {
+    const body = takeChunk();
+    if (body) chunkQueue.push({ url: chunkUrl(), body });
+    // Page is going away: hand every chunk still waiting (or backing off) to the
+    // browser. Periodic sends are plain fetches (the browser caps keepalive bodies
+    // in flight at ~64 KB in total), so the one in flight may be cancelled by the
+    // unload and is beaconed as well -- at worst one chunk arrives twice.
+    for (const item of chunkQueue.splice(0)) {
+        const blob = new Blob([item.body], { type: "application/json" });
+        if (!(navigator.sendBeacon && navigator.sendBeacon(item.url, blob))) {
+            fetch(item.url, {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: item.body,
+                keepalive: true
+            }).catch(e => console.log("Log error", e));
+        }
+    }
+}
+
+window.addEventListener("pagehide", beaconChunk);
+
 export async function startCameraRecording(videoElement) {
     if (!videoElement) {
         console.error("Recorder Error: No video element provided.");
@@ -14,44 +271,69 @@ export async function startCameraRecording(videoElement) {
     console.log("Camera Recorder Started.");
     activeVideo = videoElement;
 
-    // Initialize backend file
-    try {
-        await fetch("/start_camera_log", { method: "POST" });
-    } catch (e) {
-        console.error("Could not start log:", e);
-    }
+    // Initialize backend file (frames are only stored once this succeeded)
+    stopRequested = false;
+    if (!(await startLog())) return;
+
+    chunk = newChunk();
+    lastFrameMs = null;
+    chunkTimer = setInterval(flushChunk, CHUNK_FLUSH_MS);
+    socket = await openSocket();
 
     recording = true;
     loop();
 }
 
+async function startLog() {
+    let wait = RETRY_MIN_MS;
+    while (!stopRequested) {
+        try {
+            const res = await fetch("/start_camera_log", { method: "POST" });
+            if (res.ok) {
+                const info = await res.json();
+                uploadMode = info.mode === "scores" ? "scores" : "labels";
+                return true;
+            }
+            if (!isRetryable(res.status)) {
+                console.error(`Could not start log (HTTP ${res.status})`);
+                return false;
+            }
+        } catch (e) {
+            console.warn("Could not start log, will retry", e);
+        }
+        await sleep(wait);
+        wait = Math.min(wait * 2, RETRY_MAX_MS);
+    }
+    return false;
+}
+
 async function loop() {
     if (!recording) return;
 
     if (faceLandmarker && activeVideo && activeVideo.readyState >= 2) {
         // 1. Get raw data
         const results = faceLandmarker.detectForVideo(activeVideo, performance.now());
-        
+
         if (results.faceBlendshapes && results.faceBlendshapes.length > 0) {
             const blend = results.faceBlendshapes[0].categories;
-            
-            // 2. Analyze
-            const emotion = getEmotion(blend);
-            const aus = getAUs(blend);
-
-            // 3. SEND EVERYTHING 
-            // We log every frame (even neutral) to ensure data completeness.
-            const payload = {
-                timestamp: new Date().toISOString(),
-                emotion: emotion,
-                AUs: aus 
-            };
-
-            fetch("/append_camera_log", {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify(payload)
-            }).catch(e => console.log("Log error", e));
+
+            if (uploadMode === "scores") {
+                // 2. Server classifies (no per-frame analysis here)
+                addScores(Date.now(), blend);
+            } else {
+                // 2. Analyze
+                const emotion = getEmotion(blend);
+                const aus = getAUs(blend);
+
+                // 3. QUEUE EVERYTHING
+                // We log every frame (even neutral) to ensure data completeness.
+                // Each frame keeps its own millisecond timestamp.
+                if (socket) {
+                    socket.send(packFrame(Date.now(), emotion, aus));
+                } else {
+                    addFrame(Date.now(), emotion, aus);
+                }
+            }
         }
     }
 
@@ -59,8 +341,22 @@ async function loop() {
     setTimeout(loop, 33);
 }
 
-export async function stopCameraRecording() {
+export function stopCameraRecording() {
     recording = false;
-    await fetch("/end_camera_log", { method: "POST" });
+    stopRequested = true;
+    if (chunkTimer) {
+        clearInterval(chunkTimer);
+        chunkTimer = null;
+    }
+    // The page navigates away right after this, so nothing is awaited before
+    // /end_camera_log: the last partial chunk is queued (pagehide beacons it if
+    // still pending), the close goes out as a keepalive request, the socket's
+    // "end" message makes the server close the log after the frames it still
+    // buffers, and the END event closes it once more.
+    const sent = flushChunk();
+    const drained = closeSocket();
+    const ended = fetch("/end_camera_log", { method: "POST", keepalive: true })
+        .catch(e => console.log("Log error", e));
     console.log("Camera Recorder Stopped.");
-}
\ No newline at end of file
+    return Promise.all([sent, drained, ended]);
+}
@@ -30,10 +30,24 @@ document.addEventListener("DOMContentLoaded", () => {
         guessType: []
     };
 
+    // --- Hashed asset URLs (window.ASSETS from index.html, see assets.py) ---
+    const ASSETS = window.ASSETS || {};
+
+    function assetUrl(name) {
+        return ASSETS[name] ? ASSETS[name].url : "/static/" + name;
+    }
+
+    function pictureSources(name) {
+        const sources = ASSETS[name] ? ASSETS[name].sources : [];
+        return sources.map(([type, srcset]) =>
+            `<source type="${type}" srcset="${srcset}" sizes="(max-width: 448px) 100vw, 448px">`
+        ).join("");
+    }
+
     // --- Image Task Data ---
     let imageIndex = 0;
     let imageDescriptions = [];
-    const imageList = ["/static/stage_5_img_0.jpg", "/static/stage_5_img_1.jpg"];
+    const imageList = ["stage_5_img_0.jpg", "stage_5_img_1.jpg"];
 
     // --- DOM Elements ---
     const container = document.getElementById('container');
@@ -94,8 +108,8 @@ document.addEventListener("DOMContentLoaded", () => {
     async function loadCameraModules() {
         if (cameraModulesLoaded) return;
 
-        const face = await import("/static/camera/face.js");
-        const recorder = await import("/static/camera/recorder.js");
+        const face = await import(assetUrl("camera/face.js"));
+        const recorder = await import(assetUrl("camera/recorder.js"));
 
         initFaceModel = face.initFaceModel;
         setupCamera = async function() {
@@ -115,22 +129,14 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
     async function loadExperimentData() {
-        const [paraRes, quesRes, mcqRes, fbRes] = await Promise.all([
-            fetch('/get_paragraph'),
-            fetch('/get_questions'),
-            fetch('/get_mcq_questions'),
-            fetch('/get_feedback_questions')
-        ]);
-
-        const paraData = await paraRes.json();
-        const quesData = await quesRes.json();
-        const mcqData = await mcqRes.json();
-        const fbData = await fbRes.json();
-
-        paragraphText = paraData.paragraph;
-        questions = quesData.questions;
-        mcqQuestions = mcqData.questions;
-        feedbackQuestions = fbData.questions;
+        // One cached, compressed request (304 on repeat loads) instead of four
+        const res = await fetch('/get_experiment_bundle');
+        const bundle = await res.json();
+
+        paragraphText = bundle.paragraph;
+        questions = bundle.questions;
+        mcqQuestions = bundle.mcq_questions;
+        feedbackQuestions = bundle.feedback_questions;
 
         console.log("Loaded paragraph:", paragraphText);
         console.log("Loaded subjective questions:", questions.length);
@@ -152,21 +158,107 @@ document.addEventListener("DOMContentLoaded", () => {
         return Math.floor((Date.now() - sessionStartTime) / 1000);
     }
 
+    // ==========================================
+    //  BUFFERED EVENT LOGGER
+    // ==========================================
+    // Events are queued and sent in ordered batches to /log_events.
+    // MCQ navigation bursts are flushed on a short timer; every other
+    // event marks a stage transition and is flushed right away.
+    // Every event carries a sequence number (increasing across page loads,
+    // microseconds since the epoch at the latest), so the server can restore
+    // the logged order and skip duplicates however the batches arrive.
+    const EVENT_FLUSH_MS = 1000;
+    const BUFFERED_EVENTS = new Set(["Qfirstseen", "QChange", "QSubmit", "QMark", "QUnmark"]);
+
+    let eventBuffer = [];
+    let eventFlushTimer = null;
+    let eventFlushChain = Promise.resolve();
+    let eventSeq = 0;
+
+    function nextEventSeq() {
+        eventSeq = Math.max(eventSeq + 1, Date.now() * 1000);
+        return eventSeq;
+    }
+
     function logEvent(stage, variable_field = {}) {
         const payload = {
             stage: stage,
             timestamp: getISTTimestamp(),
             time_elapsed: getElapsedSeconds(),
-            variable_field: variable_field
+            variable_field: variable_field,
+            seq: nextEventSeq()
         };
         console.log("Logging event:", payload);
-        fetch('/log_event', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify(payload)
-        }).catch(err => console.warn('logEvent failed', err));
+        eventBuffer.push(payload);
+
+        if (!BUFFERED_EVENTS.has(stage)) {
+            flushEvents();
+        } else if (!eventFlushTimer) {
+            eventFlushTimer = setTimeout(flushEvents, EVENT_FLUSH_MS);
+        }
+    }
+
+    function flushEvents() {
+        if (eventFlushTimer) {
+            clearTimeout(eventFlushTimer);
+            eventFlushTimer = null;
+        }
+        // Chain sends so batches normally reach the server in the order they were
+        // logged. The buffer is taken when the send actually starts, so anything
+        // still queued at unload time is picked up by beaconEvents() instead.
+        eventFlushChain = eventFlushChain.then(() => {
+            if (!eventBuffer.length) return;
+
+            const batch = eventBuffer;
+            eventBuffer = [];
+            const retry = reason => {
+                console.warn('logEvent batch failed, re-queueing', reason);
+                eventBuffer = batch.concat(eventBuffer);
+                if (!eventFlushTimer) eventFlushTimer = setTimeout(flushEvents, EVENT_FLUSH_MS);
+            };
+
+            return fetch('/log_events', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({ events: batch }),
+                keepalive: true
+            }).then(res => {
+                // 503 (write queue full) and other 5xx: keep the batch and retry.
+                // 4xx (e.g. no active session) will not get better: give up on it.
+                if (res.status >= 500) {
+                    retry(`HTTP ${res.status}`);
+                } else if (!res.ok) {
+                    console.error(`logEvent batch rejected (HTTP ${res.status}), not retried`);
+                }
+            }, retry);   // network error
+        });
+        return eventFlushChain;
     }
 
+    function beaconEvents() {
+        if (!eventBuffer.length) return;
+        // Nothing chained runs after unload, so always hand the rest to the browser
+        // now; the sequence numbers put it back in order on the server.
+        const events = eventBuffer;
+        eventBuffer = [];
+        const body = JSON.stringify({ events: events });
+        if (!(navigator.sendBeacon && navigator.sendBeacon('/log_events', new Blob([body], { type: 'application/json' })))) {
+            fetch('/log_events', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: body,
+                keepalive: true
+            }).catch(err => console.warn('logEvent beacon failed', err));
+        }
+    }
+
+    // Page is going away: hand whatever is left to the browser.
+    // Only hidden (it may come back): send through the chain, in order.
+    window.addEventListener('pagehide', beaconEvents);
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') flushEvents();
+    });
+
     function toggleEndSession(show) {
         document.getElementById("endBtn").style.display = show ? 'inline-block' : 'none';
     }
@@ -728,14 +820,17 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
     function renderImageDescription() {
-        const imgSrc = imageList[imageIndex];
+        const imgName = imageList[imageIndex];
 
         container.innerHTML = `
             <h1 class="text-3xl font-bold mb-6">Image Description (${imageIndex + 1}/2)</h1>
             <p class="text-lg mb-4">Please describe what you see in the image below:</p>
 
-            <img src="${imgSrc}" 
-                class="w-full max-w-md mx-auto rounded shadow mb-6" />
+            <picture>
+                ${pictureSources(imgName)}
+                <img src="${assetUrl(imgName)}" 
+                    class="w-full max-w-md mx-auto rounded shadow mb-6" />
+            </picture>
 
             <textarea id="imageDescInput" 
                     class="w-full border rounded p-3 text-lg"
@@ -0,0 +1,121 @@
+# stimuli.py
+
+import os, json, gzip, hashlib, threading
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+# Experiment stimuli under data/, parsed once per process and re-parsed only
+# when one of the files changes (mtime / size). Used by the /get_* routes,
+# the /get_experiment_bundle endpoint and anything that needs the MCQ key.
+
+BASE_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+
+STIMULUS_FILES = {
+    "paragraph": "paragraph.txt",
+    "questions": "questions.txt",
+    "mcq_questions": "mcq_questions.json",
+    "feedback_questions": "feedback_questions.txt",
+}
+
+
+# ---------- Parsers (same rules as the original per-request handlers) ----------
+
+def parse_paragraph(path):
+    if not os.path.exists(path):
+        return ""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+def parse_questions(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def parse_mcq_questions(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def parse_feedback_questions(path):
+    if not os.path.exists(path):
+        return []
+
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if "|" in line:
+                q_text, q_opts = line.split("|", 1)
+                q_text = q_text.strip()
+                q_opts = q_opts.strip()
+                if q_opts == "TEXT":
+                    opts = ["TEXT"]
+                else:
+                    opts = [opt.strip() for opt in q_opts.split(",")]
+                questions.append({"question": q_text, "options": opts})
+    return questions
+
+PARSERS = {
+    "paragraph": parse_paragraph,
+    "questions": parse_questions,
+    "mcq_questions": parse_mcq_questions,
+    "feedback_questions": parse_feedback_questions,
+}
+
+
+# ---------- Cache ----------
+
+class StimulusBundle:
+    """Parsed stimuli plus the pre-encoded / precompressed bundle body."""
+
+    def __init__(self, data):
+        self.data = data
+        self.body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0)
+        self.br_body = brotli.compress(self.body, quality=11) if brotli else None
+
+
+_cache = {"stamp": None, "bundle": None}
+_lock = threading.Lock()
+
+def _stamp():
+    stamp = []
+    for name in STIMULUS_FILES.values():
+        try:
+            st = os.stat(os.path.join(DATA_DIR, name))
+            stamp.append((name, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamp.append((name, None, None))
+    return tuple(stamp)
+
+def get_bundle():
+    """Current StimulusBundle; rebuilt only if a file under data/ changed."""
+    stamp = _stamp()
+    bundle = _cache["bundle"]
+    if bundle is not None and _cache["stamp"] == stamp:
+        return bundle
+
+    with _lock:
+        if _cache["bundle"] is not None and _cache["stamp"] == stamp:
+            return _cache["bundle"]
+        data = {
+            key: PARSERS[key](os.path.join(DATA_DIR, name))
+            for key, name in STIMULUS_FILES.items()
+        }
+        bundle = StimulusBundle(data)
+        _cache["stamp"] = stamp
+        _cache["bundle"] = bundle
+        return bundle
+
+def get_stimulus(key):
+    """One parsed stimulus ('paragraph', 'questions', 'mcq_questions', 'feedback_questions')."""
+    return get_bundle().data[key]
@@ -0,0 +1,94 @@
+# storage.py
+
+import os, hashlib
+from werkzeug.utils import safe_join
+
+# Where participant data lives on disk -- every blueprint and script resolves
+# participant folders here.
+#
+#   user_data/<ab>/<cd>/<participant_id>/session_<name>_<ts>...
+#
+# <ab>/<cd> are the first hex digits of sha1(participant_id), so no directory
+# grows past a few hundred entries and participants who share a name no
+# longer share a folder. Folders of the old flat layout
+# (user_data/<participant name>/) are still used for participants that have
+# data there and no sharded folder yet; migrate_storage.py moves them over.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USER_DATA_DIR = os.path.join(BASE_DIR, "user_data")
+
+SHARD_LEVELS = 2        # directories of SHARD_WIDTH hex digits above each participant folder
+SHARD_WIDTH = 2
+
+
+def shard_parts(participant_id):
+    digest = hashlib.sha1(participant_id.encode("utf-8")).hexdigest()
+    return [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+
+def shard_dir(participant_id, root=USER_DATA_DIR):
+    """user_data/<ab>/<cd>/<participant_id>"""
+    return os.path.join(root, *shard_parts(participant_id), participant_id)
+
+def legacy_dir(name, root=USER_DATA_DIR):
+    """user_data/<name> of the flat layout (None for names that are not a plain folder name)."""
+    if not name or name in (".", "..") or "/" in name or os.sep in name:
+        return None
+    return safe_join(root, name)
+
+def participant_dir(participant_id, name=None, root=USER_DATA_DIR):
+    """
+    Folder holding a participant's files: the sharded one, unless only an
+    unmigrated flat-layout folder of that name exists.
+    """
+    sharded = shard_dir(participant_id, root)
+    if name and not os.path.isdir(sharded):
+        legacy = legacy_dir(name, root)
+        if legacy and os.path.isdir(legacy):
+            return legacy
+    return sharded
+
+def ensure_participant_dir(participant_id, name=None, root=USER_DATA_DIR):
+    folder = participant_dir(participant_id, name, root)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def rel_path(path, root=USER_DATA_DIR):
+    """Path relative to user_data/ with forward slashes (manifest / ZIP names)."""
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+
+# ---------- Walking user_data/ ----------
+
+def _is_shard(name):
+    return len(name) == SHARD_WIDTH and all(c in "0123456789abcdef" for c in name)
+
+def iter_participant_dirs(root=USER_DATA_DIR):
+    """
+    Yields (folder, participant_id, legacy_name) for every participant folder:
+    sharded ones with legacy_name None, flat-layout ones with participant_id None.
+    """
+    if not os.path.isdir(root):
+        return
+    for top in sorted(os.listdir(root)):
+        top_path = os.path.join(root, top)
+        if not os.path.isdir(top_path):
+            continue
+        sharded = _sharded_below(top_path, [top], root) if _is_shard(top) else []
+        yield from sharded
+        # a participant named like a shard ("ab") can share its flat folder with one
+        if not sharded or any(os.path.isfile(os.path.join(top_path, n)) for n in os.listdir(top_path)):
+            yield top_path, None, top
+
+def _sharded_below(path, parts, root):
+    """Participant folders under a shard directory (empty if it is not one)."""
+    found = []
+    for name in sorted(os.listdir(path)):
+        child = os.path.join(path, name)
+        if not os.path.isdir(child):
+            continue
+        if len(parts) < SHARD_LEVELS:
+            if _is_shard(name):
+                found += _sharded_below(child, parts + [name], root)
+        elif shard_parts(name) == parts:
+            found.append((child, name, None))
+    return found
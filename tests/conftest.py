@@ -0,0 +1,14 @@
+# tests/conftest.py
+#
+# The app is a set of flat modules in the repo root (no package), so put the
+# root on sys.path for the tests:  python -m pytest -q
+# database.py creates experiment.db in the working directory on import, so
+# the tests run from a scratch directory instead of the repo.
+
+import os, sys, atexit, shutil, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_scratch = tempfile.mkdtemp(prefix="sad_tests_")
+os.chdir(_scratch)
+atexit.register(shutil.rmtree, _scratch, ignore_errors=True)
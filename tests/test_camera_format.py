@@ -0,0 +1,117 @@
+import json
+
+import numpy as np
+
+from camera_format import (
+    FRAME_DTYPE, RLE_DTYPE, RLE_MAX_GAP_MS, UNKNOWN_EMOTION, AU_NAMES,
+    encode_frames, pack_frames, encode_runs, expand_runs, read_frames, read_legacy_csv,
+    iter_rows, export_csv, export_json, emotion_code, au_mask,
+)
+
+T0 = 1731597012123   # 2024-11-14T15:10:12.123Z
+
+FRAMES = [
+    (T0, "neutral", []),
+    (T0 + 33, "happy", ["Blink"]),
+    (T0 + 66, "happy", ["Blink", "Jaw Drop"]),
+    (T0 + 100, "not an emotion", ["not an AU"]),
+]
+
+
+def write_bin(tmp_path, data, name="s_camera.bin"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+# ---------- .bin ----------
+
+def test_bin_round_trip(tmp_path):
+    path = write_bin(tmp_path, encode_frames(FRAMES))
+    frames = read_frames(path)
+    assert frames.dtype == FRAME_DTYPE and len(frames) == 4
+    assert frames["ts"].tolist() == [t for t, _, _ in FRAMES]
+    assert frames["emotion"][3] == UNKNOWN_EMOTION
+    assert frames["aus"][2] == au_mask(["Blink", "Jaw Drop"])
+    assert list(iter_rows(frames))[1:3] == [
+        ("2024-11-14T15:10:12.156Z", "happy", ["Blink"]),
+        ("2024-11-14T15:10:12.189Z", "happy", [n for n in AU_NAMES if n in ("Blink", "Jaw Drop")]),
+    ]
+    assert list(iter_rows(frames))[3][1:] == ("", [])
+
+def test_pack_frames_matches_encode_frames():
+    ts = [t for t, _, _ in FRAMES]
+    codes = [emotion_code(e) for _, e, _ in FRAMES]
+    masks = [au_mask(a) for _, _, a in FRAMES]
+    assert pack_frames(ts, codes, masks) == encode_frames(FRAMES)
+
+def test_trailing_partial_record_ignored(tmp_path):
+    path = write_bin(tmp_path, encode_frames(FRAMES) + b"\x01\x02\x03")
+    assert len(read_frames(path)) == 4
+    assert len(read_frames(str(tmp_path / "missing_camera.bin"))) == 0
+
+
+# ---------- .rle ----------
+
+def steady_frames(n, labels):
+    frames = np.empty(n, dtype=FRAME_DTYPE)
+    frames["ts"] = T0 + 33 * np.arange(n)
+    frames["emotion"] = labels
+    frames["aus"] = 0
+    return frames
+
+def test_runs_round_trip():
+    frames = steady_frames(10, [0, 0, 0, 1, 1, 0, 0, 0, 0, 0])
+    runs = encode_runs(frames)
+    assert runs["count"].tolist() == [3, 2, 5]
+    assert runs["start"].tolist() == [T0, T0 + 99, T0 + 165]
+    assert runs["end"].tolist() == [T0 + 66, T0 + 132, T0 + 297]
+    assert expand_runs(runs).tolist() == frames.tolist()
+
+def test_runs_break_on_gap():
+    frames = steady_frames(4, [2, 2, 2, 2])
+    frames["ts"][2:] += RLE_MAX_GAP_MS
+    runs = encode_runs(frames)
+    assert runs["count"].tolist() == [2, 2]
+    assert expand_runs(runs).tolist() == frames.tolist()
+
+def test_read_frames_expands_rle(tmp_path):
+    frames = steady_frames(6, [3, 3, 3, 4, 4, 4])
+    path = write_bin(tmp_path, encode_runs(frames).tobytes(), "s_camera.rle")
+    assert read_frames(path).tolist() == frames.tolist()
+    assert len(encode_runs(np.zeros(0, dtype=FRAME_DTYPE))) == 0
+    assert encode_runs(frames).dtype == RLE_DTYPE
+
+
+# ---------- exports / legacy CSV ----------
+
+def test_csv_export_round_trip(tmp_path):
+    path = write_bin(tmp_path, encode_frames(FRAMES[:3]))
+    csv_path = str(tmp_path / "s_camera.csv")
+    export_csv(path, csv_path)
+    assert read_legacy_csv(csv_path).tolist() == read_frames(path).tolist()
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
+
+def test_json_export(tmp_path):
+    path = write_bin(tmp_path, encode_frames(FRAMES[:2]))
+    json_path = str(tmp_path / "s_camera.json")
+    export_json(path, json_path)
+    with open(json_path, encoding="utf-8") as f:
+        assert json.load(f) == [
+            {"timestamp": "2024-11-14T15:10:12.123Z", "emotion": "neutral", "AUs": []},
+            {"timestamp": "2024-11-14T15:10:12.156Z", "emotion": "happy", "AUs": ["Blink"]},
+        ]
+
+def test_read_legacy_csv_skips_bad_rows(tmp_path):
+    csv_path = tmp_path / "s_camera.csv"
+    csv_path.write_text(
+        "timestamp,emotion,AUs\n"
+        "2024-11-14T15:10:12.123Z,sad,\"['Blink']\"\n"
+        "yesterday,happy,[]\n"
+        "2024-11-14T15:10:12.156Z,angry,not a list\n",
+        encoding="utf-8",
+    )
+    frames = read_legacy_csv(str(csv_path))
+    assert frames["ts"].tolist() == [T0, T0 + 33]
+    assert frames["emotion"].tolist() == [emotion_code("sad"), emotion_code("angry")]
+    assert frames["aus"].tolist() == [au_mask(["Blink"]), 0]
@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+import pytest
+
+from grading import extract_responses, response_matrix, item_statistics, NO_ANSWER
+
+
+def ev(kind, elapsed, **fields):
+    return {"EventType": kind, "TimeElapsed": elapsed, "VariableFields": fields}
+
+EVENTS = [
+    ev("session_started", 0),
+    ev("Qfirstseen", 100, Qn=0, FirsttimeSeen=100),
+    ev("QSubmit", 110, Qn=0, Soption="A"),
+    ev("QChange", 112, Qn=0, Qnto=1),
+    ev("Qfirstseen", 112, Qn=1),
+    ev("QSubmit", 120, Qn=1, Soption="B"),
+    ev("QSubmit", 125, Qn=1, Soption="C"),
+    ev("QChange", 130, Qn=1, Qnto=0),
+    ev("End", 140),
+    ev("Feedback", 150),
+]
+
+
+# ---------- extract_responses ----------
+
+def test_extract_responses():
+    assert extract_responses(EVENTS) == {
+        # visits: 100-112 and 130-140
+        "0": {"answer": "A", "first_seen": 100.0, "answered_at": 110.0, "dwell": 22.0, "submits": 1},
+        # visit 112-130, answer changed once
+        "1": {"answer": "C", "first_seen": 112.0, "answered_at": 125.0, "dwell": 18.0, "submits": 2},
+    }
+
+def test_extract_responses_cut_short():
+    # no End: the open visit closes at the last event
+    r = extract_responses([ev("Qfirstseen", 10, Qn=3), ev("QChange", 15, Qn=3, Qnto=4), ev("QSubmit", 19, Qn=4, Soption="B")])
+    assert r["3"]["dwell"] == 5.0 and r["3"]["answer"] is None
+    assert r["4"]["dwell"] == 4.0 and r["4"]["answer"] == "B"
+
+def test_response_matrix():
+    R, T, W, S = response_matrix([extract_responses(EVENTS), {}], [["A", "B"], ["A", "B", "C"], ["A"]])
+    assert R.tolist() == [[0, 2, NO_ANSWER], [NO_ANSWER] * 3]
+    assert T[0, :2].tolist() == [10.0, 13.0] and math.isnan(T[0, 2])
+    assert W[0, :2].tolist() == [22.0, 18.0] and np.isnan(W[1]).all()
+    assert S.tolist() == [[1, 2, 0], [0, 0, 0]]
+
+
+# ---------- item_statistics ----------
+
+def test_item_statistics_hand_computed():
+    key = np.array([0, 1, 2], dtype=np.int16)
+    R = np.array([
+        [0, 1, 2],            # 3 correct
+        [0, 1, 0],            # 2
+        [0, 0, 0],            # 1
+        [1, NO_ANSWER, 2],    # 1
+    ], dtype=np.int16)
+    nan = float("nan")
+    T = np.array([[10, 20, nan], [30, nan, nan], [20, nan, nan], [nan, nan, nan]])
+    W = np.ones((4, 3))
+
+    stats, correct = item_statistics(R, key, T, W, n_options=3)
+
+    assert correct.tolist() == [[1, 1, 1], [1, 1, 0], [1, 0, 0], [0, 0, 1]]
+    assert stats["difficulty"].tolist() == [0.75, 0.5, 0.5]
+    assert stats["answered"].tolist() == [4, 3, 4]
+    # item vs. rest score (total minus the item), Pearson:
+    #   item 0: x=[1,1,1,0] rest=[2,1,0,1] -> 0
+    #   item 1: x=[1,1,0,0] rest=[2,1,1,1] -> 0.5 / sqrt(1 * 0.75)
+    #   item 2: x=[1,0,0,1] rest=[2,2,1,0] -> -0.5 / sqrt(1 * 2.75)
+    assert stats["point_biserial"] == pytest.approx([0.0, 1 / math.sqrt(3), -0.5 / math.sqrt(2.75)])
+    # 27% of 4 -> 1 session per group: top is session 0, bottom session 2 (stable order among ties)
+    assert stats["upper_lower"].tolist() == [0.0, 1.0, 1.0]
+    assert stats["time_to_answer"] == [20.0, 20.0, None]
+    assert stats["dwell"] == [1.0, 1.0, 1.0]
+    assert stats["option_counts"].tolist() == [[3, 1, 0], [1, 2, 0], [2, 0, 2]]
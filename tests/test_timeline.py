@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from timeline import FrameIndex, build_intervals, parse_event_time, EMOTION_LABELS
+from camera_format import EMOTIONS, AU_NAMES
+
+T0 = parse_event_time("2025-11-14T20:40:00+05:30")
+
+
+def ev(kind, seconds, **fields):
+    """Stored event `seconds` after T0, with a server-side timestamp."""
+    ist = timezone(timedelta(hours=5, minutes=30))
+    ts = datetime.fromtimestamp((T0 + seconds * 1000) / 1000, tz=ist)
+    return {"EventType": kind, "TimeElapsed": seconds, "timestamp": ts.isoformat(), "VariableFields": fields}
+
+
+# ---------- parse_event_time ----------
+
+def test_parse_event_time_formats():
+    assert parse_event_time("2025-11-14 20:40:00 IST") == T0
+    assert parse_event_time("2025-11-14T15:10:00Z") == T0
+    assert parse_event_time("2025-11-14T20:40:00") is None      # no zone
+    assert parse_event_time("garbage") is None
+    assert parse_event_time(None) is None
+
+
+# ---------- FrameIndex ----------
+
+def test_frame_index_counts():
+    # out of order on purpose; 255 is an unknown emotion
+    index = FrameIndex(ts=[300, 100, 200, 400], emotion=[1, 0, 1, 255], aus=[0b01, 0, 0b11, 0])
+    assert len(index) == 4
+    assert index.ts.tolist() == [100, 200, 300, 400]
+
+    frames, emo, aus = index.counts([100, 150, 100], [300, 1000, 100])
+    assert frames.tolist() == [2, 3, 0]           # ends are exclusive
+
+    expected_emo = np.zeros((3, len(EMOTION_LABELS)), dtype=int)
+    expected_emo[0, [0, 1]] = 1                  # 100: neutral, 200: happy
+    expected_emo[1, 1] = 2                       # 200, 300: happy
+    expected_emo[1, len(EMOTIONS)] = 1           # 400: unknown
+    assert emo.tolist() == expected_emo.tolist()
+
+    expected_aus = np.zeros((3, len(AU_NAMES)), dtype=int)
+    expected_aus[0, [0, 1]] = 1                  # 200: bits 0 and 1
+    expected_aus[1, 0], expected_aus[1, 1] = 2, 1  # 200 and 300 have bit 0, 200 has bit 1
+    assert aus.tolist() == expected_aus.tolist()
+
+def test_frame_index_empty():
+    index = FrameIndex([], [], [])
+    frames, emo, aus = index.counts([0], [10])
+    assert frames.tolist() == [0]
+    assert emo.sum() == 0 and aus.sum() == 0
+
+
+# ---------- build_intervals ----------
+
+def test_build_intervals_full_session():
+    events = [
+        ev("session_started", 0),
+        ev("eyes_closed_finished", 10),
+        ev("paragraph_finished", 20),
+        ev("question_1_finished", 30),
+        ev("subjective_section_finished", 40),
+        ev("Qfirstseen", 41, Qn=0),
+        ev("QChange", 45, Qn=0, Qnto=1),
+        ev("QChange", 50, Qn=1, Qnto=0),
+        ev("End", 55),
+        ev("Feedback", 60),
+        ev("ImageDescription", 70),
+    ]
+    got = [(label, (start - T0) // 1000, (end - T0) // 1000) for label, start, end in build_intervals(events)]
+    assert got == [
+        ("eyes_closed", 0, 10),
+        ("reading", 10, 20),
+        ("subjective_q1", 20, 30),
+        ("subjective", 20, 40),
+        ("subjective_q2", 30, 40),
+        ("mcq", 40, 55),
+        ("mcq_q1", 41, 45),
+        ("mcq_q2", 45, 50),
+        ("mcq_q1", 50, 55),
+        ("feedback", 55, 60),
+        ("image_description", 60, 70),
+    ]
+
+def test_build_intervals_cut_short_and_elapsed_fallback():
+    broken = ev("eyes_closed_finished", 10)
+    broken["timestamp"] = "not a time"           # placed by TimeElapsed instead
+    events = [ev("session_started", 0), broken, ev("QChange", 15, Qn=0, Qnto=1)]
+    got = [(label, (start - T0) // 1000, (end - T0) // 1000) for label, start, end in build_intervals(events)]
+    # QChange outside the MCQ stage opens no question; the open stage closes at the last event
+    assert got == [("eyes_closed", 0, 10), ("reading", 10, 15)]
@@ -0,0 +1,381 @@
+# timeline.py
+
+import os, csv, json, threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from database import get_db_connection
+from storage import shard_dir, legacy_dir, iter_participant_dirs
+from event_journal import read_events, JOURNAL_EXT
+from file_manifest import classify
+from camera_format import read_frames, read_legacy_csv, EMOTIONS, AU_NAMES, BIN_SUFFIX, RLE_SUFFIX, CSV_SUFFIX
+
+# Time-aligned join of a session's event log and camera log.
+#
+# build_intervals() turns the event stream into labelled [start, end) intervals
+# (epoch ms) of the experiment stages and of every subjective / MCQ question:
+#
+#   eyes_closed          session_started      -> eyes_closed_finished
+#   reading              eyes_closed_finished -> paragraph_finished / speech_baseline_timeout
+#   subjective           reading end          -> subjective_section_finished / stage3_timeout
+#   subjective_q<N>      previous boundary    -> question_<N>_finished (stage2_timeout skips to q5)
+#   mcq                  subjective end       -> End / mcq_timeout
+#   mcq_q<N>             one interval per visit of MCQ N (Qfirstseen / QChange), 1-based
+#   feedback             mcq end              -> Feedback
+#   image_description    Feedback             -> ImageDescription / image_task_timeout
+#
+# FrameIndex keeps the camera frames sorted by ts with prefix sums of the
+# emotion and AU counts, so the distribution over any interval is two
+# np.searchsorted calls and a subtraction -- for all intervals at once.
+# Event timestamps have one-second resolution, so boundaries are +-1 s.
+
+STAGES = ["eyes_closed", "reading", "subjective", "mcq", "feedback", "image_description"]
+END_EVENTS = {"FINISH", "session_ended", "EXIT"}   # as in experiment_routes
+CACHE_SIZE = 64
+
+EMOTION_LABELS = EMOTIONS + ["unknown"]   # code 255 (and anything out of range) -> "unknown"
+
+
+# ---------- Events -> intervals ----------
+
+def parse_event_time(ts):
+    """'2025-11-14 20:40:12 IST' (browser) or '2025-11-14T20:40:12+05:30' (server) -> epoch ms."""
+    if not isinstance(ts, str) or not ts:
+        return None
+    text = ts.strip()
+    if text.endswith(" IST"):
+        text = text[:-4] + "+05:30"
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        return None
+    return round(dt.timestamp() * 1000)
+
+def _event_times(events):
+    """Epoch ms of every event; unparsable timestamps fall back to first event + TimeElapsed."""
+    times = [parse_event_time(ev.get("timestamp")) for ev in events]
+    anchor = next((t for t in times if t is not None), None)
+    out = []
+    for ev, t in zip(events, times):
+        if t is None and anchor is not None:
+            try:
+                t = anchor + int(float(ev.get("TimeElapsed"))) * 1000
+            except (TypeError, ValueError):
+                t = None
+        out.append(t)
+    return out
+
+def event_fields(ev):
+    fields = ev.get("VariableFields") or {}
+    if isinstance(fields, str):   # legacy CSV rows keep it as JSON text
+        try:
+            fields = json.loads(fields)
+        except ValueError:
+            fields = {}
+    return fields if isinstance(fields, dict) else {}
+
+def build_intervals(events):
+    """Stored events (in order) -> [(label, start_ms, end_ms), ...] sorted by start."""
+    out = []
+    open_ = {}   # slot ("stage" / "question") -> (label, start)
+
+    def close(slot, t):
+        cur = open_.pop(slot, None)
+        if cur is not None and t is not None and t >= cur[1]:
+            out.append((cur[0], cur[1], t))
+
+    def begin(slot, label, t):
+        close(slot, t)
+        if t is not None:
+            open_[slot] = (label, t)
+
+    times = _event_times(events)
+    for ev, t in zip(events, times):
+        kind = ev.get("EventType") or ""
+        if t is None:
+            continue
+        stage = open_.get("stage", (None,))[0]
+
+        if kind == "session_started":
+            begin("stage", "eyes_closed", t)
+        elif kind == "eyes_closed_finished":
+            begin("stage", "reading", t)
+        elif kind in ("paragraph_finished", "speech_baseline_timeout"):
+            begin("stage", "subjective", t)
+            begin("question", "subjective_q1", t)
+        elif kind.startswith("question_") and kind.endswith("_finished"):
+            try:
+                n = int(kind[len("question_"):-len("_finished")])
+            except ValueError:
+                continue
+            begin("question", f"subjective_q{n + 1}", t)
+        elif kind == "stage2_timeout":
+            begin("question", "subjective_q5", t)
+        elif kind in ("subjective_section_finished", "stage3_timeout"):
+            close("question", t)
+            begin("stage", "mcq", t)
+        elif kind in ("Qfirstseen", "QChange") and stage == "mcq":
+            fields = event_fields(ev)
+            qn = fields.get("Qnto", fields.get("Qn")) if kind == "QChange" else fields.get("Qn")
+            try:
+                label = f"mcq_q{int(qn) + 1}"
+            except (TypeError, ValueError):
+                continue
+            if open_.get("question", (None,))[0] != label:
+                begin("question", label, t)
+        elif kind in ("End", "mcq_timeout"):
+            close("question", t)
+            begin("stage", "feedback", t)
+        elif kind == "Feedback":
+            begin("stage", "image_description", t)
+        elif kind in ("ImageDescription", "image_task_timeout"):
+            close("question", t)
+            close("stage", t)
+        elif kind in END_EVENTS:
+            close("question", t)
+            close("stage", t)
+
+    # session cut short: close at the last event
+    last = next((t for t in reversed(times) if t is not None), None)
+    close("question", last)
+    close("stage", last)
+
+    out.sort(key=lambda iv: (iv[1], iv[2]))
+    return out
+
+
+# ---------- Camera frames -> prefix-sum index ----------
+
+class FrameIndex:
+    """Sorted frame timestamps + cumulative emotion / AU counts for O(log n) interval queries."""
+
+    def __init__(self, ts, emotion, aus):
+        ts = np.asarray(ts, dtype=np.int64)
+        emotion = np.asarray(emotion, dtype=np.int64)
+        aus = np.asarray(aus, dtype=np.int64)
+        if len(ts) > 1 and np.any(np.diff(ts) < 0):
+            order = np.argsort(ts, kind="stable")
+            ts, emotion, aus = ts[order], emotion[order], aus[order]
+        self.ts = ts
+
+        codes = np.minimum(emotion, len(EMOTIONS))
+        one_hot = np.zeros((len(ts) + 1, len(EMOTION_LABELS)), dtype=np.int32)
+        one_hot[np.arange(1, len(ts) + 1), codes] = 1
+        self.emotion_cum = np.cumsum(one_hot, axis=0)
+
+        bits = np.zeros((len(ts) + 1, len(AU_NAMES)), dtype=np.int32)
+        bits[1:] = (aus[:, None] >> np.arange(len(AU_NAMES))) & 1
+        self.au_cum = np.cumsum(bits, axis=0)
+
+    def __len__(self):
+        return len(self.ts)
+
+    def counts(self, starts, ends):
+        """
+        Arrays of interval starts / ends (epoch ms, end exclusive) ->
+        (frames (k,), emotion counts (k, len(EMOTION_LABELS)), AU counts (k, len(AU_NAMES))).
+        """
+        lo = np.searchsorted(self.ts, np.asarray(starts, dtype=np.int64), side="left")
+        hi = np.searchsorted(self.ts, np.asarray(ends, dtype=np.int64), side="left")
+        return hi - lo, self.emotion_cum[hi] - self.emotion_cum[lo], self.au_cum[hi] - self.au_cum[lo]
+
+
+# ---------- Loading a session ----------
+
+def load_session_events(folder, stem):
+    """Stored events of a session: the journal, else the legacy .json array / .csv."""
+    journal = os.path.join(folder, stem + JOURNAL_EXT)
+    if os.path.exists(journal):
+        return read_events(journal)
+    path = os.path.join(folder, stem + ".json")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                return json.load(f)
+            except ValueError:
+                return []
+    path = os.path.join(folder, stem + ".csv")
+    if os.path.exists(path):
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            return list(csv.DictReader(f))
+    return []
+
+def _camera_log(folder, stem):
+    """Binary / change-only camera log, else the legacy text _camera.csv (only an export next to those)."""
+    for suffix in (BIN_SUFFIX, RLE_SUFFIX, CSV_SUFFIX):
+        path = os.path.join(folder, stem + suffix)
+        if os.path.exists(path):
+            return path
+    return None
+
+def read_camera_log(path):
+    return read_legacy_csv(path) if path.endswith(CSV_SUFFIX) else read_frames(path)
+
+def _stamp(paths):
+    return tuple((p, os.path.getmtime(p), os.path.getsize(p)) for p in paths if p and os.path.exists(p))
+
+
+class SessionTimeline:
+    """Intervals + frame index of one session."""
+
+    def __init__(self, session_file, intervals, frames):
+        self.session_file = session_file
+        self.intervals = intervals
+        self.frames = frames
+
+    @classmethod
+    def load(cls, folder, session_file):
+        log = _camera_log(folder, session_file)
+        if log:
+            f = read_camera_log(log)
+            frames = FrameIndex(f["ts"], f["emotion"], f["aus"])
+        else:
+            frames = FrameIndex([], [], [])
+        return cls(session_file, build_intervals(load_session_events(folder, session_file)), frames)
+
+    def labels(self):
+        return sorted({label for label, _, _ in self.intervals})
+
+    def query(self, label=None):
+        """One row per interval (all of them, or those named label) with its distribution."""
+        rows = [iv for iv in self.intervals if label is None or iv[0] == label]
+        if not rows:
+            return []
+        n, emo, aus = self.frames.counts([r[1] for r in rows], [r[2] for r in rows])
+        return [
+            {
+                "label": r[0], "start_ms": r[1], "end_ms": r[2], "frames": int(n[i]),
+                "emotions": _named(EMOTION_LABELS, emo[i]), "aus": _named(AU_NAMES, aus[i]),
+            }
+            for i, r in enumerate(rows)
+        ]
+
+
+def _named(names, counts):
+    return {name: int(c) for name, c in zip(names, counts) if c}
+
+
+_cache = OrderedDict()   # session_file -> (stamp, SessionTimeline)
+_cache_lock = threading.Lock()
+
+def get_timeline(folder, session_file):
+    """SessionTimeline of one session, rebuilt only when its event or camera log changed."""
+    stem = os.path.join(folder, session_file)
+    stamp = _stamp([stem + JOURNAL_EXT, stem + ".json", stem + ".csv", _camera_log(folder, session_file)])
+    with _cache_lock:
+        hit = _cache.get(stem)
+        if hit and hit[0] == stamp:
+            _cache.move_to_end(stem)
+            return hit[1]
+    timeline = SessionTimeline.load(folder, session_file)
+    with _cache_lock:
+        _cache[stem] = (stamp, timeline)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return timeline
+
+
+# ---------- Queries ----------
+
+def _owners():
+    """({session_file: participant_id} of participant_sessions, {name: [participant_id, ...]})."""
+    conn = get_db_connection()
+    registered = dict(conn.execute("SELECT session_file, participant_id FROM participant_sessions"))
+    named = {}
+    for pid, name in conn.execute("SELECT participant_id, name FROM participants ORDER BY id"):
+        named.setdefault(name, []).append(pid)
+    conn.close()
+    return registered, named
+
+def _candidate_dirs(participant_ids, named):
+    """(folder, participant_id, legacy_name) to scan: every participant folder, or only those of participant_ids."""
+    if not participant_ids:
+        return list(iter_participant_dirs())
+    names = {pid: name for name, pids in named.items() for pid in pids}
+    dirs = []
+    for pid in participant_ids:
+        if os.path.isdir(shard_dir(pid)):
+            dirs.append((shard_dir(pid), pid, None))
+        legacy = legacy_dir(names.get(pid))
+        if legacy and os.path.isdir(legacy):
+            dirs.append((legacy, None, names[pid]))
+    return dirs
+
+def find_sessions(participant_ids=None, session_file=None):
+    """
+    [(participant_id, folder, session_file), ...] of every session on disk,
+    including sessions recorded before participant_sessions existed.
+    Owner: the participant of a sharded folder, else the participant_sessions
+    row, else the only participant with the flat-layout folder's name, else
+    the folder name itself.
+    """
+    registered, named = _owners()
+    scan = participant_ids
+    if session_file and session_file in registered:
+        scan = [registered[session_file]]   # only that participant's folders
+    found = []
+    for folder, folder_pid, legacy_name in _candidate_dirs(scan, named):
+        names = set(os.listdir(folder))
+        stems = {c[0] for c in (classify(n, names) for n in names) if c}
+        pids = named.get(legacy_name, [])
+        fallback = folder_pid or (pids[0] if len(pids) == 1 else legacy_name)
+        for stem in sorted(stems):
+            if session_file and stem != session_file:
+                continue
+            pid = folder_pid or registered.get(stem) or fallback
+            if participant_ids and pid not in participant_ids:
+                continue
+            found.append((pid, folder, stem))
+    return found
+
+def session_distribution(session_file, label=None):
+    """Intervals of one session (optionally only `label`) with emotion / AU counts, or None."""
+    found = find_sessions(session_file=session_file)
+    if not found:
+        return None
+    pid, folder, session_file = found[0]
+    timeline = get_timeline(folder, session_file)
+    return {
+        "participant_id": pid, "session_file": session_file,
+        "frames": len(timeline.frames), "labels": timeline.labels(),
+        "intervals": timeline.query(label),
+    }
+
+def cohort_distribution(label, participant_ids=None):
+    """
+    Emotion / AU distribution during every interval named `label`, summed over
+    the sessions of participant_ids (all participants if None), plus per-session rows.
+    """
+    emotions = np.zeros(len(EMOTION_LABELS), dtype=np.int64)
+    aus = np.zeros(len(AU_NAMES), dtype=np.int64)
+    frames, duration_ms, sessions = 0, 0, []
+    for pid, folder, session_file in find_sessions(participant_ids):
+        if not os.path.isdir(folder):
+            continue
+        timeline = get_timeline(folder, session_file)
+        rows = [iv for iv in timeline.intervals if iv[0] == label]
+        if not rows:
+            continue
+        n, emo, au = timeline.frames.counts([r[1] for r in rows], [r[2] for r in rows])
+        emotions += emo.sum(axis=0)
+        aus += au.sum(axis=0)
+        frames += int(n.sum())
+        span = sum(r[2] - r[1] for r in rows)
+        duration_ms += span
+        sessions.append({
+            "participant_id": pid, "session_file": session_file, "intervals": len(rows),
+            "duration_ms": span, "frames": int(n.sum()), "emotions": _named(EMOTION_LABELS, emo.sum(axis=0)),
+        })
+
+    return {
+        "label": label, "sessions": len(sessions), "frames": frames, "duration_ms": duration_ms,
+        "emotions": _named(EMOTION_LABELS, emotions),
+        "emotion_share": {k: round(v / frames, 4) for k, v in _named(EMOTION_LABELS, emotions).items()} if frames else {},
+        "aus": _named(AU_NAMES, aus),
+        "au_share": {k: round(v / frames, 4) for k, v in _named(AU_NAMES, aus).items()} if frames else {},
+        "per_session": sessions,
+    }
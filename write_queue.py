@@ -0,0 +1,195 @@
+# write_queue.py
+
+import os, time, queue, atexit, threading
+
+import metrics
+from writer_pool import WRITERS
+
+# Per-process write-behind queue for the ingestion endpoints.
+# /log_event(s) and the camera append routes only validate the payload and
+# enqueue a job; one writer thread per process runs the jobs in FIFO order
+# (so events and frames of a session stay in order) and does the disk /
+# SQLite work. Request latency no longer depends on disk latency.
+#
+# When the queue is full, INGEST_QUEUE_POLICY decides what happens:
+#   "503"    reject the request (503 + Retry-After), the client retries
+#   "block"  wait up to INGEST_QUEUE_BLOCK_TIMEOUT for space, then 503
+#   "drop"   accept the request but discard the job (counted in "dropped");
+#            the client gets 200 {"status": "dropped"} and does not resend,
+#            so this policy loses data by design -- shed load, not for studies
+#   "sync"   no queue at all: run the job inside the request (old behaviour)
+# On shutdown the queue is drained (up to DRAIN_TIMEOUT) before the writer
+# pool closes its handles.
+
+QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "10000"))
+QUEUE_POLICY = os.environ.get("INGEST_QUEUE_POLICY", "503")
+BLOCK_TIMEOUT = float(os.environ.get("INGEST_QUEUE_BLOCK_TIMEOUT", "2.0"))   # seconds
+DRAIN_TIMEOUT = 30.0    # seconds
+RETRY_AFTER = 1         # seconds, sent with 503
+
+QUEUED, DROPPED, REJECTED = "queued", "dropped", "rejected"
+
+_STOP = object()
+
+
+class WriteQueue:
+    def __init__(self, maxsize=QUEUE_SIZE, policy=QUEUE_POLICY, block_timeout=BLOCK_TIMEOUT):
+        if policy not in ("503", "block", "drop", "sync"):
+            raise ValueError(f"unknown INGEST_QUEUE_POLICY {policy!r}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._writer_pid = None
+        self._closed = False
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.counters = {
+            "enqueued": 0, "written": 0, "failed": 0, "dropped": 0, "rejected": 0,
+            "max_depth": 0,
+            "wait_seconds_sum": 0.0, "wait_seconds_max": 0.0,     # enqueue -> start
+            "write_seconds_sum": 0.0, "write_seconds_max": 0.0,   # job run time
+        }
+
+    # ---------- internal ----------
+
+    def _ensure_writer(self):
+        # Started lazily and per process (gunicorn forks after import).
+        if self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+            self._queue = queue.Queue(self.maxsize)
+            self._closed = False
+            self._reset_counters()
+            t = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            t.start()
+
+    def _run(self):
+        q = self._queue
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP:
+                    return
+                enqueued_at, fn, args = item
+                started = time.monotonic()
+                try:
+                    fn(*args)
+                    ok = True
+                except Exception as e:
+                    ok = False
+                    print(f"Write queue job error ({getattr(fn, '__name__', fn)}): {e}")
+                done = time.monotonic()
+
+                wait, took = started - enqueued_at, done - started
+                with self._lock:
+                    c = self.counters
+                    c["written" if ok else "failed"] += 1
+                    c["wait_seconds_sum"] += wait
+                    c["wait_seconds_max"] = max(c["wait_seconds_max"], wait)
+                    c["write_seconds_sum"] += took
+                    c["write_seconds_max"] = max(c["write_seconds_max"], took)
+            finally:
+                q.task_done()
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    # ---------- public ----------
+
+    def submit(self, fn, *args):
+        """
+        Run fn(*args) on the writer thread.
+        Returns QUEUED, DROPPED (policy "drop", queue full) or REJECTED
+        (queue full / shutting down -> the endpoint answers 503).
+        """
+        if self.policy == "sync":
+            fn(*args)
+            return QUEUED
+
+        self._ensure_writer()
+        if self._closed:
+            self._count("rejected")
+            metrics.add_ingest_rejected()
+            return REJECTED
+
+        item = (time.monotonic(), fn, args)
+        try:
+            if self.policy == "block":
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            if self.policy == "drop":
+                self._count("dropped")
+                metrics.add_ingest_dropped()
+                return DROPPED
+            self._count("rejected")
+            metrics.add_ingest_rejected()
+            return REJECTED
+
+        with self._lock:
+            self.counters["enqueued"] += 1
+            self.counters["max_depth"] = max(self.counters["max_depth"], self._queue.qsize())
+        return QUEUED
+
+    def wait_idle(self, timeout=DRAIN_TIMEOUT):
+        """Block until every queued job has run (or timeout). Returns True if idle."""
+        q = self._queue
+        deadline = time.monotonic() + timeout
+        with q.all_tasks_done:
+            while q.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                q.all_tasks_done.wait(remaining)
+        return True
+
+    def shutdown(self, timeout=DRAIN_TIMEOUT):
+        """Stop accepting jobs, run what is queued, stop the writer thread."""
+        if self._writer_pid != os.getpid() or self._closed:
+            return
+        self._closed = True
+        if not self.wait_idle(timeout):
+            print(f"Write queue: {self._queue.qsize()} jobs not written at shutdown")
+            return
+        self._queue.put(_STOP)
+        WRITERS.close_all()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self.counters)
+        runs = s["written"] + s["failed"]
+        s.update({
+            "policy": self.policy,
+            "capacity": self.maxsize,
+            "depth": self.depth(),
+            "wait_seconds_avg": s["wait_seconds_sum"] / runs if runs else 0.0,
+            "write_seconds_avg": s["write_seconds_sum"] / runs if runs else 0.0,
+        })
+        return s
+
+
+def busy_response():
+    """Response for a REJECTED submit (Flask turns the dict into JSON)."""
+    return {"status": "busy", "msg": "Ingestion queue full, retry"}, 503, {"Retry-After": str(RETRY_AFTER)}
+
+
+WRITE_QUEUE = WriteQueue()
+metrics.register_gauge("ingest_queue_depth", "Jobs waiting in the write-behind queue.", WRITE_QUEUE.depth)
+metrics.register_gauge("ingest_queue_wait_seconds_avg", "Mean enqueue-to-write delay.",
+                       lambda: WRITE_QUEUE.stats()["wait_seconds_avg"])
+metrics.register_gauge("ingest_queue_write_seconds_avg", "Mean job run time on the writer thread.",
+                       lambda: WRITE_QUEUE.stats()["write_seconds_avg"])
+# registered after writer_pool's close_all, so it runs first (atexit is LIFO)
+atexit.register(WRITE_QUEUE.shutdown)
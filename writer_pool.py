@@ -0,0 +1,227 @@
+# writer_pool.py
+
+import io, os, csv, time, atexit, tempfile, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import metrics
+
+# Per-process pool of open append handles for the active session files
+# (event CSV, event journal, binary camera log).
+# - handles stay open between requests (no open/close per event or frame)
+# - every write() / write_bytes() / write_rows() call is one os.write() on an
+#   O_APPEND descriptor, so it lands whole at the current end of file and is
+#   visible to other workers at once; batches of two processes appending to
+#   the same file never interleave or overwrite each other
+# - a background thread fsyncs dirty handles every FLUSH_INTERVAL, outside
+#   the pool lock so writers never wait for the disk
+# - handles idle for IDLE_TIMEOUT are closed, and at most MAX_OPEN are kept
+#   (least recently used is closed first) so we never run out of fds
+# There is deliberately no user-space buffer: with several workers appending
+# to the same session files, a buffer flushed later would reorder and split
+# batches, and hide them from the other workers until the flush. Requests
+# already batch their events / frames, so each append is one write() anyway.
+
+MAX_OPEN = 256
+FLUSH_INTERVAL = 2.0      # seconds
+IDLE_TIMEOUT = 120.0      # seconds
+OPEN_FLAGS = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+
+
+class _Handle:
+    __slots__ = ("fd", "dirty", "last_used", "kind", "pending")
+
+    def __init__(self, path, binary=False):
+        self.fd = os.open(path, OPEN_FLAGS, 0o644)
+        self.kind = "camera" if binary else "events"
+        self.pending = 0                # bytes written since the last fsync
+        self.dirty = False
+        self.last_used = time.monotonic()
+
+    def append(self, data):
+        view = memoryview(data)
+        while view:
+            n = os.write(self.fd, view)
+            view = view[n:]
+        self.pending += len(data)
+
+    def take_pending(self):
+        """Mark clean; bytes written since the last sync (caller holds the pool lock)."""
+        pending, self.pending, self.dirty = self.pending, 0, False
+        return pending
+
+    def sync(self):
+        if self.dirty:
+            pending = self.take_pending()
+            os.fsync(self.fd)
+            metrics.add_bytes_written(self.kind, pending)
+
+    def close(self):
+        try:
+            self.sync()
+        finally:
+            os.close(self.fd)
+
+
+class WriterPool:
+    def __init__(self, max_open=MAX_OPEN, flush_interval=FLUSH_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+        self.max_open = max_open
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+
+        self._handles = OrderedDict()   # path -> _Handle, oldest use first
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        self._flush_hooks = []          # run by the flusher thread before each flush_all()
+        self._close_hooks = []          # run by close_all() before the handles close
+
+    # ---------- internal ----------
+
+    def _get(self, path, binary=False):
+        """Open (or reuse) the handle for path. Caller holds the lock."""
+        self._ensure_flusher()
+
+        h = self._handles.get(path)
+        if h is None:
+            while len(self._handles) >= self.max_open:
+                _, oldest = self._handles.popitem(last=False)
+                oldest.close()
+            h = _Handle(path, binary)
+            self._handles[path] = h
+        else:
+            self._handles.move_to_end(path)
+
+        h.last_used = time.monotonic()
+        h.dirty = True
+        return h
+
+    def _ensure_flusher(self):
+        # Started lazily and per process, so gunicorn workers forked
+        # after import each get their own flusher thread.
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        self._handles = OrderedDict()
+        t = threading.Thread(target=self._flush_loop, name="writer-pool-flush", daemon=True)
+        t.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            for fn in self._flush_hooks:
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"Writer pool flush hook error: {e}")
+            try:
+                self.flush_all(close_idle=True)
+            except Exception as e:
+                print(f"Writer pool flush error: {e}")
+
+    # ---------- public ----------
+
+    def write(self, path, text):
+        """Append raw text (e.g. NDJSON lines) to path."""
+        data = text.encode("utf-8")
+        with self._lock:
+            self._get(path).append(data)
+
+    def write_bytes(self, path, data):
+        """Append packed binary records (e.g. camera frames) to path."""
+        with self._lock:
+            self._get(path, binary=True).append(data)
+
+    def write_rows(self, path, rows):
+        """Append CSV rows to path."""
+        buf = io.StringIO(newline="")
+        csv.writer(buf).writerows(rows)
+        data = buf.getvalue().encode("utf-8")
+        with self._lock:
+            self._get(path).append(data)
+
+    def flush(self, path):
+        """fsync one file (writes are already visible to readers; this makes them durable)."""
+        with self._lock:
+            h = self._handles.get(path)
+            if h is not None:
+                h.sync()
+
+    def close(self, path):
+        """Flush, fsync and close one file (end of session / end of camera log)."""
+        with self._lock:
+            h = self._handles.pop(path, None)
+            if h is not None:
+                h.close()
+
+    def flush_all(self, close_idle=False):
+        """fsync every dirty handle (closing idle ones); the fsyncs run without holding the lock."""
+        now = time.monotonic()
+        idle, dirty = [], []
+        with self._lock:
+            for path, h in list(self._handles.items()):
+                if close_idle and now - h.last_used > self.idle_timeout:
+                    del self._handles[path]
+                    idle.append(h)
+                elif h.dirty:
+                    dirty.append((h, h.take_pending()))
+        for h, pending in dirty:
+            try:
+                os.fsync(h.fd)
+            except OSError:
+                continue    # closed meanwhile by close() / LRU eviction, which synced it
+            metrics.add_bytes_written(h.kind, pending)
+        for h in idle:
+            h.close()
+
+    def on_flush(self, fn):
+        """Call fn() every flush interval, e.g. to write out data idling in memory."""
+        self._flush_hooks.append(fn)
+
+    def on_close_all(self, fn):
+        """Call fn() at the start of close_all(), e.g. to write out data still held in memory."""
+        self._close_hooks.append(fn)
+
+    def close_all(self):
+        for fn in self._close_hooks:
+            try:
+                fn()
+            except Exception as e:
+                print(f"Writer pool close hook error: {e}")
+        with self._lock:
+            while self._handles:
+                _, h = self._handles.popitem(last=False)
+                h.close()
+
+    def is_open(self, path):
+        """True if this process holds a handle for path."""
+        return path in self._handles
+
+    def open_count(self):
+        return len(self._handles)
+
+
+@contextmanager
+def atomic_open(path, mode="w", **kwargs):
+    """
+    Write a whole file (an export) through a temp file that replaces path on
+    success, so readers never see half a file. The temp name is unique, so
+    two requests rebuilding the same export never write into the same file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with open(fd, mode, **kwargs) as f:
+            yield f
+        os.chmod(tmp_path, 0o644)   # mkstemp creates 0600
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+WRITERS = WriterPool()
+atexit.register(WRITERS.close_all)
+metrics.register_gauge("writer_pool_open_handles", "Append handles held open by the writer pool.",
+                       WRITERS.open_count)
@@ -0,0 +1,161 @@
+# zip_export.py
+
+import os, io, csv, time, zipfile
+
+import metrics
+from database import get_db_connection
+from storage import participant_dir, rel_path
+from writer_pool import WRITERS
+from event_journal import ensure_json, list_with_json
+from camera_format import ensure_export, bin_path_for_export, list_with_exports, RUNS, RLE_SUFFIX
+
+# Streaming ZIP export for the admin panel.
+# The archive is produced while it is being sent: every file is read in
+# CHUNK_SIZE blocks, deflated straight into a small in-memory sink and the
+# sink is drained to the client after each block. Memory stays constant no
+# matter how large the export is, nothing touches a temp file, and the
+# response goes out with chunked transfer encoding (no Content-Length).
+
+CHUNK_SIZE = 1024 * 1024
+ZIP64_AFTER = 1 << 30          # entries at/over this size get zip64 headers up front
+MANIFEST_NAME = "manifest.csv"
+
+MANIFEST_COLUMNS = [
+    "participant_id", "name", "email", "age", "mobile", "institution",
+    "batch", "branch", "roll_number", "other_institution",
+]
+
+
+class _Sink:
+    """Write-only, non-seekable stream that zipfile writes into and we drain."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+            self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self._chunks:
+            data = b"".join(self._chunks)
+            self._chunks = []
+            yield data
+
+
+def stream_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """
+    entries: iterable of (arcname, mtime, size_hint, reader) where reader()
+    yields the entry's bytes. Yields the ZIP archive as byte chunks.
+    Already-compressed data (Parquet) can be sent with ZIP_STORED.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=compression, allowZip64=True) as zf:
+        for arcname, mtime, size_hint, reader in entries:
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(mtime)[:6])
+            info.compress_type = compression
+            with zf.open(info, "w", force_zip64=size_hint >= ZIP64_AFTER) as dest:
+                for block in reader():
+                    dest.write(block)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+# ---------- Entry sources ----------
+
+def _read_file(path):
+    def reader():
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(CHUNK_SIZE)
+                if not block:
+                    break
+                metrics.add_bytes_read("export", len(block))
+                yield block
+    return reader
+
+def _file_entry(path, arcname):
+    if path.endswith(RLE_SUFFIX):
+        RUNS.flush(path)  # open run of a live change-only log
+    WRITERS.flush(path)
+    st = os.stat(path)
+    return arcname, st.st_mtime, st.st_size, _read_file(path)
+
+def _folder_names(folder, legacy):
+    files = os.listdir(folder)
+    return list_with_exports(list_with_json(files)) if legacy else sorted(files)
+
+def folder_entries(folder, prefix, legacy=False):
+    """
+    Entries for one participant folder. With legacy=True the derived
+    session_x.json / session_x_camera.csv / .json shapes are built (if stale)
+    and included next to the stored journal / binary logs.
+    """
+    if not os.path.isdir(folder):
+        return
+    for name in _folder_names(folder, legacy):
+        path = os.path.join(folder, name)
+        if legacy:
+            if bin_path_for_export(path):
+                ensure_export(path)
+            elif name.endswith(".json"):
+                ensure_json(path)
+        if os.path.isfile(path):
+            yield _file_entry(path, f"{prefix}/{name}")
+
+def tree_entries(root, legacy=False, prefix=""):
+    """Entries for everything under root (user_data/ by default), keeping its folder layout."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        rel = os.path.relpath(dirpath, root)
+        if rel == ".":
+            for name in sorted(filenames):
+                yield _file_entry(os.path.join(dirpath, name), prefix + name)
+        else:
+            yield from folder_entries(dirpath, prefix + rel.replace(os.sep, "/"), legacy)
+
+def _take(buf):
+    data = buf.getvalue().encode("utf-8")
+    buf.seek(0)
+    buf.truncate()
+    return data
+
+def manifest_entry(participant_ids=None):
+    """manifest.csv from the participants table (all of them if participant_ids is None)."""
+    def reader():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(MANIFEST_COLUMNS + ["folder"])
+        yield _take(buf)
+
+        sql = f"SELECT {', '.join(MANIFEST_COLUMNS)} FROM participants"
+        params = []
+        if participant_ids is not None:
+            sql += f" WHERE participant_id IN ({','.join('?' * len(participant_ids))})"
+            params = list(participant_ids)
+        sql += " ORDER BY id"
+
+        conn = get_db_connection()
+        cur = conn.execute(sql, params)
+        try:
+            while True:
+                rows = cur.fetchmany(500)
+                if not rows:
+                    break
+                for row in rows:
+                    writer.writerow(list(row) + [rel_path(participant_dir(row[0], row[1]))])
+                yield _take(buf)
+        finally:
+            cur.close()
+            conn.close()
+    return MANIFEST_NAME, time.time(), 0, reader